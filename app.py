@@ -1,13 +1,51 @@
 
 import sqlite3
 import textwrap
+import functools
+import csv
+import gzip
+import hashlib
+import io
 import json
-from typing import Dict, List
+import multiprocessing
+import operator
+import os
+import queue
+import random
+import re
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    BrokenExecutor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 import requests
 
+try:
+    import duckdb  # optional analytics backend
+except ImportError:
+    duckdb = None
+
+from banner_render import BANNER_FORMATS, BANNER_SIZES, Image, render_banner_task
+
 # =========================
 # Page config & base styles
 # =========================
@@ -152,6 +190,203 @@ def safe_rerun():
         st.experimental_rerun()
 
 
+# =========================
+# Helper: optional secrets
+# =========================
+
+def get_secret(key: str, default=None):
+    """st.secrets.get that tolerates a missing secrets.toml (optional settings)."""
+    try:
+        return st.secrets.get(key, default)
+    except FileNotFoundError:
+        return default
+
+
+# =========================
+# Metrics (Prometheus text format)
+# =========================
+
+METRICS_PORT = 9464
+METRICS_HOST = "127.0.0.1"
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+
+# name -> (type, help). Everything the app records is declared here.
+METRIC_DEFS = {
+    "xxx_page_render_seconds": ("histogram", "Time to render one page_* function."),
+    "xxx_sql_query_seconds": ("histogram", "Reporting query latency by analytics engine."),
+    "xxx_sql_query_failures_total": ("counter", "Reporting queries that failed (before fallback)."),
+    "xxx_db_commit_seconds": ("histogram", "Writer group-commit latency."),
+    "xxx_db_write_ops_total": ("counter", "Write ops by outcome."),
+    "xxx_ai_request_seconds": ("histogram", "AI provider call latency (excluding rate-limit waits)."),
+    "xxx_ai_errors_total": ("counter", "AI provider call errors."),
+    "xxx_ai_fallbacks_total": ("counter", "Ads that fell back to the built-in generator, by reason."),
+    "xxx_webhook_deliveries_total": ("counter", "trigger_zap deliveries by event and result."),
+    "xxx_webhook_seconds": ("histogram", "trigger_zap delivery latency."),
+    "xxx_cache_requests_total": ("counter", "Calls to cached loaders."),
+    "xxx_cache_misses_total": ("counter", "Cached loader calls that had to recompute."),
+    "xxx_banner_render_seconds": ("histogram", "Banner image render time (cache misses only)."),
+}
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    # json.dumps escapes backslashes and quotes the way the text format expects.
+    parts = [f"{k}={json.dumps(v, ensure_ascii=False)}" for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class MetricsRegistry:
+    """Tiny thread-safe counter/histogram store rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict] = {}
+        self.histograms: Dict[str, Dict] = {}
+        # name -> callable returning {label_key: value}, evaluated at scrape time.
+        self.gauges: Dict[str, Tuple[str, Callable[[], Dict]]] = {}
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + amount
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            h = series.get(key)
+            if h is None:
+                h = series[key] = {"buckets": [0] * len(METRICS_BUCKETS), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(METRICS_BUCKETS):
+                if seconds <= bound:
+                    h["buckets"][i] += 1
+            h["sum"] += seconds
+            h["count"] += 1
+
+    def gauge(self, name: str, help_text: str, collect: Callable[[], Dict]):
+        self.gauges[name] = (help_text, collect)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# HELP {name} {METRIC_DEFS.get(name, ('', ''))[1]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value:g}")
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# HELP {name} {METRIC_DEFS.get(name, ('', ''))[1]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, h in series.items():
+                    for bound, n in zip(METRICS_BUCKETS, h["buckets"]):
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{name}_bucket{_format_labels(key, 'le=' + json.dumps(le))} {n}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {h['sum']:.6f}")
+                    lines.append(f"{name}_count{_format_labels(key)} {h['count']}")
+        for name, (help_text, collect) in sorted(self.gauges.items()):
+            try:
+                values = collect()
+            except Exception:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in values.items():
+                lines.append(f"{name}{_format_labels(_label_key(dict(labels)))} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+@st.cache_resource
+def get_metrics() -> MetricsRegistry:
+    """Process-wide registry (module globals are re-created on every rerun)."""
+    registry = MetricsRegistry()
+
+    def file_sizes():
+        paths = {"main": DB_PATH, "wal": DB_PATH + "-wal", "archive": ARCHIVE_DB_PATH}
+        return {
+            (("file", name),): os.path.getsize(path)
+            for name, path in paths.items()
+            if os.path.exists(path)
+        }
+
+    def breaker_states():
+        codes = {"closed": 0, "half-open": 1, "open": 2}
+        breakers = get_ai_breakers()
+        return {(("provider", p),): codes[breakers.get(p).state] for p in AI_PROVIDERS}
+
+    registry.gauge("xxx_db_file_bytes", "SQLite file sizes.", file_sizes)
+    registry.gauge(
+        "xxx_db_writer_queue_depth",
+        "Writes waiting for the writer thread.",
+        lambda: {(): get_db_writer().stats()["queue_depth"]},
+    )
+    registry.gauge("xxx_ai_circuit_state", "AI breaker state (0 closed, 1 half-open, 2 open).", breaker_states)
+    return registry
+
+
+def metered_cache(name: str, **cache_kwargs):
+    """st.cache_data that also counts requests vs. misses (for hit rates)."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def compute(*args, **kwargs):
+            get_metrics().inc("xxx_cache_misses_total", cache=name)
+            return fn(*args, **kwargs)
+
+        cached = st.cache_data(**cache_kwargs)(compute)
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            get_metrics().inc("xxx_cache_requests_total", cache=name)
+            return cached(*args, **kwargs)
+
+        call.clear = cached.clear
+        return call
+
+    return decorator
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = get_metrics().render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@st.cache_resource
+def start_metrics_server() -> Dict:
+    """Side HTTP server for /metrics, started once per process (METRICS_PORT=0 disables)."""
+    port = int(get_secret("METRICS_PORT", METRICS_PORT))
+    host = get_secret("METRICS_HOST", METRICS_HOST)
+    state = {"url": None, "error": ""}
+    if port <= 0:
+        return state
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        # e.g. another app process already serves this port
+        state["error"] = str(e)
+        return state
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="xxx-metrics", daemon=True).start()
+    state["url"] = f"http://{host}:{server.server_address[1]}/metrics"
+    return state
+
+
 # =========================
 # DB helpers (SQLite)
 # =========================
@@ -159,8 +394,8 @@ def safe_rerun():
 DB_PATH = "xxx_ad_poster.db"
 
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
+def get_conn(db_path: str = DB_PATH):
+    conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -174,10 +409,17 @@ def ensure_column(conn, table: str, col_name: str, col_def: str):
         cur.execute(f"ALTER TABLE {table} ADD COLUMN {col_name} {col_def}")
 
 
-def init_db():
-    conn = get_conn()
+def init_db(db_path: str = DB_PATH):
+    conn = get_conn(db_path)
     cur = conn.cursor()
 
+    # Only takes effect on a brand-new file; older files are switched over by
+    # the maintenance job (needs one full VACUUM).
+    cur.execute("PRAGMA auto_vacuum=INCREMENTAL")
+
+    # WAL: readers never block the writer (and vice versa). Persistent per file.
+    cur.execute("PRAGMA journal_mode=WAL")
+
     # Programs
     cur.execute(
         """
@@ -233,11 +475,466 @@ def init_db():
     ensure_column(conn, "ad_creatives", "campaign_notes", "TEXT")
     ensure_column(conn, "ad_performance", "impressions", "INTEGER DEFAULT 0")
     ensure_column(conn, "ad_performance", "revenue", "REAL DEFAULT 0.0")
+    ensure_column(conn, "ad_creatives", "status", "TEXT DEFAULT 'Active'")
+
+    init_search_index(conn)
+    init_data_version(conn)
+    init_campaign_dimensions(conn)
+    init_jobs_table(conn)
+    init_maintenance_log(conn)
+    init_rules_tables(conn)
+    init_compliance_tables(conn)
+    init_banner_table(conn)
+    init_cohort_tables(conn)
+    init_archive_activity(conn)
 
     conn.commit()
     conn.close()
 
 
+# =========================
+# Campaign dimensions (parsed from campaign_notes)
+# =========================
+
+# Bump when the parser changes so init_db re-parses every ad once.
+CAMPAIGN_PARSER_VERSION = 2
+
+# column -> SQL type on ad_creatives
+CAMPAIGN_DIMENSION_COLUMNS = {
+    "geo": "TEXT",
+    "device": "TEXT",
+    "bid_model": "TEXT",
+    "bid_amount": "REAL",
+    "daypart_start": "INTEGER",
+    "daypart_end": "INTEGER",
+}
+
+# Dimensions offered for group-by/filter in the reports ("daypart" is derived).
+CAMPAIGN_DIMENSIONS = ["geo", "device", "bid_model", "daypart"]
+
+GEO_CODES = {
+    "US", "UK", "CA", "AU", "NZ", "IE", "DE", "FR", "ES", "IT", "NL", "BE", "AT", "CH",
+    "SE", "NO", "DK", "FI", "PL", "PT", "CZ", "BR", "MX", "AR", "CL", "CO", "JP", "KR",
+    "IN", "ID", "PH", "TH", "VN", "ZA", "TR", "RU", "WW", "T1", "T2", "T3",
+}
+# Codes that are also everyday words in capitalised notes ("NO popups", "IT works",
+# "ID required"): only taken next to another GEO or after a geo keyword.
+GEO_WORD_CODES = {"NO", "IT", "ID", "IN", "AT", "BE", "CO", "TH"}
+GEO_ALIASES = {
+    "usa": "US",
+    "united states": "US",
+    "gb": "UK",
+    "united kingdom": "UK",
+    "great britain": "UK",
+    "canada": "CA",
+    "australia": "AU",
+    "germany": "DE",
+    "france": "FR",
+    "spain": "ES",
+    "italy": "IT",
+    "worldwide": "WW",
+    "global": "WW",
+    "tier 1": "T1",
+    "tier 2": "T2",
+    "tier 3": "T3",
+}
+DEVICE_PATTERNS = {
+    "Mobile": r"\b(?:mobile|mob|phones?|smartphones?|ios|android)\b",
+    "Desktop": r"\b(?:desktop|pc|laptops?)\b",
+    "Tablet": r"\b(?:tablets?|ipad)\b",
+}
+BID_MODELS = {
+    "smartcpm": "SmartCPM",
+    "smartcpc": "SmartCPC",
+    "cpm": "CPM",
+    "cpc": "CPC",
+    "ppc": "CPC",
+    "cpa": "CPA",
+    "cpl": "CPL",
+    "cps": "CPS",
+    "cpv": "CPV",
+    "revshare": "RevShare",
+}
+# Named dayparts -> (start hour, end hour); end may be < start (wraps midnight).
+DAYPART_WORDS = {
+    "mornings?": (6, 12),
+    "afternoons?": (12, 18),
+    "evenings?": (18, 23),
+    "nights?|late night": (22, 4),
+    "24/7|all day": (0, 24),
+}
+
+_GEO_CODE = r"\b(?:[A-Z]{2}|USA|T[123])\b"
+# A run of codes ("DE, AT, CH", "US/NO"), optionally after a geo keyword.
+_GEO_RUN_RE = re.compile(
+    rf"(?P<ctx>(?i:\b(?:geos?|countr(?:y|ies)|target(?:ing|s)?|markets?)\b)\s*[:=-]?\s*)?"
+    rf"(?P<run>{_GEO_CODE}(?:\s*(?:[,/+&|]|\band\b)?\s*{_GEO_CODE})*)"
+)
+_GEO_CODE_RE = re.compile(_GEO_CODE)
+_GEO_ALIAS_RE = re.compile(r"\b(" + "|".join(sorted(GEO_ALIASES, key=len, reverse=True)) + r")\b", re.I)
+_BID_MODEL_RE = re.compile(r"\b(smart\s?cpm|smart\s?cpc|cpm|cpc|ppc|cpa|cpl|cps|cpv|rev[\s-]?share)\b", re.I)
+_MONEY = r"(?:\$\s?(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s?(?:usd|\$)?)"
+# An amount tied to a bid keyword or bid model: "CPC bid 0.12", "bid of $0.12", "SmartCPM $0.15".
+_BID_AMOUNT_RE = re.compile(
+    r"\b(?:bids?|smart\s?cpm|smart\s?cpc|cpm|cpc|ppc|cpa|cpl|cps|cpv)\b"
+    r"(?:\s*(?:bid|of|at|@|:|=|-))*\s*" + _MONEY,
+    re.I,
+)
+# Any other amount is a fallback, unless it is a budget or cap ("Budget $50/day").
+_ANY_AMOUNT_RE = re.compile(r"\$\s?(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s?(?:usd|\$)", re.I)
+_BUDGET_BEFORE_RE = re.compile(r"\b(?:budget|cap|capped|limit|spend)\b[^,;]*$", re.I)
+_BUDGET_AFTER_RE = re.compile(r"^\s*(?:/\s*|per\s+|a\s+)?(?:day|daily|week|weekly|month|monthly|total|cap|budget)\b", re.I)
+_HOURS_12_RE = re.compile(
+    r"\b(\d{1,2})(?::\d{2})?\s*(am|pm)?\s*(?:-|–|—|to)\s*(\d{1,2})(?::\d{2})?\s*(am|pm)\b", re.I
+)
+_HOURS_24_RE = re.compile(r"\b(\d{1,2}):\d{2}\s*(?:-|–|—|to)\s*(\d{1,2}):\d{2}\b")
+
+
+def _to_24h(hour: int, suffix: Optional[str]) -> int:
+    suffix = (suffix or "").lower()
+    if suffix == "pm" and hour < 12:
+        return hour + 12
+    if suffix == "am" and hour == 12:
+        return 0
+    return hour
+
+
+def parse_daypart(text: str) -> Tuple[Optional[int], Optional[int]]:
+    m = _HOURS_12_RE.search(text)
+    if m:
+        end = _to_24h(int(m.group(3)), m.group(4))
+        if m.group(2):
+            start = _to_24h(int(m.group(1)), m.group(2))
+        else:
+            # "6–11pm": the first hour borrows the suffix unless that puts it after the end.
+            start = _to_24h(int(m.group(1)), m.group(4))
+            if start > end:
+                start = _to_24h(int(m.group(1)), "am")
+        return start, (24 if end == 0 and start > 0 else end)
+    m = _HOURS_24_RE.search(text)
+    if m and int(m.group(1)) <= 24 and int(m.group(2)) <= 24:
+        return int(m.group(1)), int(m.group(2))
+    for pattern, hours in DAYPART_WORDS.items():
+        if re.search(rf"\b(?:{pattern})\b", text, re.I):
+            return hours
+    return None, None
+
+
+def parse_campaign_notes(notes: Optional[str]) -> Dict:
+    """
+    Pull GEO, device, bid model/amount and dayparting out of free-text notes,
+    e.g. "US mobile only, SmartCPM $0.15, evenings 6–11pm" ->
+    geo=US, device=Mobile, bid_model=SmartCPM, bid_amount=0.15, daypart 18–23.
+    Multiple GEOs are kept as a sorted, comma-joined set ("CA,US"); the
+    ad_geos table holds one row per code for filtering.
+    """
+    dims = {col: None for col in CAMPAIGN_DIMENSION_COLUMNS}
+    text = (notes or "").strip()
+    if not text:
+        return dims
+
+    geos = set()
+    for m in _GEO_RUN_RE.finditer(text):
+        codes = [GEO_ALIASES.get(c.lower(), c) for c in _GEO_CODE_RE.findall(m.group("run"))]
+        codes = [c for c in codes if c in GEO_CODES]
+        if m.group("ctx") or any(c not in GEO_WORD_CODES for c in codes):
+            geos.update(codes)
+    for name in _GEO_ALIAS_RE.findall(text):
+        geos.add(GEO_ALIASES[name.lower()])
+    if geos:
+        dims["geo"] = ",".join(sorted(geos))
+
+    devices = [name for name, pattern in DEVICE_PATTERNS.items() if re.search(pattern, text, re.I)]
+    if re.search(r"\ball devices\b", text, re.I) or len(devices) > 1:
+        dims["device"] = "All"
+    elif devices:
+        dims["device"] = devices[0]
+
+    m = _BID_MODEL_RE.search(text)
+    if m:
+        dims["bid_model"] = BID_MODELS[re.sub(r"[\s-]", "", m.group(1).lower())]
+    m = _BID_AMOUNT_RE.search(text)
+    if not m:
+        m = next(
+            (
+                a for a in _ANY_AMOUNT_RE.finditer(text)
+                if not _BUDGET_BEFORE_RE.search(text[: a.start()]) and not _BUDGET_AFTER_RE.match(text[a.end():])
+            ),
+            None,
+        )
+    if m:
+        dims["bid_amount"] = float(next(g for g in m.groups() if g is not None))
+
+    dims["daypart_start"], dims["daypart_end"] = parse_daypart(text)
+    return dims
+
+
+def daypart_label_sql(alias: str = "a") -> str:
+    return (
+        f"CASE WHEN {alias}.daypart_start IS NULL THEN NULL "
+        f"ELSE printf('%02d–%02dh', {alias}.daypart_start, {alias}.daypart_end) END"
+    )
+
+
+def backfill_campaign_dimensions(conn) -> int:
+    rows = conn.execute("SELECT id, campaign_notes FROM ad_creatives").fetchall()
+    cols = list(CAMPAIGN_DIMENSION_COLUMNS)
+    conn.executemany(
+        f"UPDATE ad_creatives SET {', '.join(f'{c} = ?' for c in cols)} WHERE id = ?",
+        [
+            [parse_campaign_notes(notes)[c] for c in cols] + [ad_id]
+            for ad_id, notes in rows
+        ],
+    )
+    return len(rows)
+
+
+def init_campaign_dimensions(conn):
+    """Typed + indexed dimension columns; (re)parse all notes when the parser version moves."""
+    for col, col_type in CAMPAIGN_DIMENSION_COLUMNS.items():
+        ensure_column(conn, "ad_creatives", col, col_type)
+    for col in ["geo", "device", "bid_model"]:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_ad_creatives_{col} ON ad_creatives ({col})")
+    # One row per targeted GEO, kept in step with ad_creatives.geo by triggers, so
+    # "GEO = US" also finds "CA,US" ads (an index lookup, not a LIKE over the label).
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ad_geos (
+            ad_id INTEGER NOT NULL,
+            geo TEXT NOT NULL,
+            PRIMARY KEY (ad_id, geo)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ad_geos_geo ON ad_geos (geo, ad_id)")
+    split_geos = """
+        INSERT OR IGNORE INTO ad_geos (ad_id, geo)
+        SELECT NEW.id, value FROM json_each('["' || replace(NEW.geo, ',', '","') || '"]')
+        WHERE NEW.geo IS NOT NULL;
+    """
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS ad_geos_ai AFTER INSERT ON ad_creatives BEGIN {split_geos} END")
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS ad_geos_au AFTER UPDATE OF geo ON ad_creatives BEGIN
+            DELETE FROM ad_geos WHERE ad_id = OLD.id;
+            {split_geos}
+        END
+        """
+    )
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS ad_geos_ad AFTER DELETE ON ad_creatives BEGIN "
+        "DELETE FROM ad_geos WHERE ad_id = OLD.id; END"
+    )
+    row = conn.execute("SELECT value FROM app_meta WHERE key = 'campaign_parser_version'").fetchone()
+    if row is None or row[0] < CAMPAIGN_PARSER_VERSION:
+        backfill_campaign_dimensions(conn)
+        conn.execute(
+            "INSERT OR REPLACE INTO app_meta (key, value) VALUES ('campaign_parser_version', ?)",
+            (CAMPAIGN_PARSER_VERSION,),
+        )
+
+
+# =========================
+# Full-text search (FTS5)
+# =========================
+
+# External-content FTS5 tables: the text lives only in the base tables,
+# the index is kept in sync by triggers.
+FTS_TABLES = {
+    "ad_creatives_fts": {
+        "content": "ad_creatives",
+        "columns": ["title", "headline", "body", "call_to_action", "campaign_notes"],
+    },
+    "affiliate_programs_fts": {
+        "content": "affiliate_programs",
+        "columns": ["name", "notes"],
+    },
+}
+
+
+def table_exists(conn, name: str) -> bool:
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?",
+        (name,),
+    )
+    return cur.fetchone() is not None
+
+
+def init_search_index(conn) -> bool:
+    """Create FTS5 tables + sync triggers. Returns False if FTS5 is unavailable."""
+    cur = conn.cursor()
+    for fts_name, spec in FTS_TABLES.items():
+        content = spec["content"]
+        cols = ", ".join(spec["columns"])
+        new_cols = ", ".join(f"new.{c}" for c in spec["columns"])
+        old_cols = ", ".join(f"old.{c}" for c in spec["columns"])
+        created = not table_exists(conn, fts_name)
+        try:
+            cur.execute(
+                f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {fts_name} USING fts5(
+                    {cols},
+                    content='{content}',
+                    content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2',
+                    prefix='2 3'
+                )
+                """
+            )
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5 – search falls back to LIKE.
+            return False
+
+        cur.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {fts_name}_ai AFTER INSERT ON {content} BEGIN
+                INSERT INTO {fts_name} (rowid, {cols}) VALUES (new.id, {new_cols});
+            END
+            """
+        )
+        cur.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {fts_name}_ad AFTER DELETE ON {content} BEGIN
+                INSERT INTO {fts_name} ({fts_name}, rowid, {cols})
+                VALUES ('delete', old.id, {old_cols});
+            END
+            """
+        )
+        cur.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {fts_name}_au AFTER UPDATE OF {cols} ON {content} BEGIN
+                INSERT INTO {fts_name} ({fts_name}, rowid, {cols})
+                VALUES ('delete', old.id, {old_cols});
+                INSERT INTO {fts_name} (rowid, {cols}) VALUES (new.id, {new_cols});
+            END
+            """
+        )
+
+        # Index rows that existed before the FTS table did.
+        if created:
+            cur.execute(f"INSERT INTO {fts_name} ({fts_name}) VALUES ('rebuild')")
+    return True
+
+
+def build_fts_query(text: str) -> str:
+    """
+    Turn free text from a search box into a safe FTS5 MATCH expression.
+    Every term is quoted (so operators/punctuation can't break the query)
+    and the last term gets a prefix '*' for search-as-you-type.
+    """
+    terms = [t.replace('"', '""') for t in text.split() if t.strip('"')]
+    if not terms:
+        return ""
+    quoted = [f'"{t}"' for t in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def search_creatives(query: str, limit: int = 50) -> List[sqlite3.Row]:
+    """Ranked (bm25) search over ad creatives, with highlighted snippets."""
+    match = build_fts_query(query)
+    if not match:
+        return []
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        # Weights: headline > title > body > cta > notes
+        cur.execute(
+            """
+            SELECT
+                a.id,
+                a.title,
+                a.angle,
+                a.traffic_source,
+                p.name AS program_name,
+                highlight(ad_creatives_fts, 1, '**', '**') AS headline_hl,
+                snippet(ad_creatives_fts, -1, '**', '**', '…', 16) AS snippet,
+                bm25(ad_creatives_fts, 4.0, 6.0, 2.0, 1.0, 1.0) AS score
+            FROM ad_creatives_fts
+            JOIN ad_creatives a ON a.id = ad_creatives_fts.rowid
+            LEFT JOIN affiliate_programs p ON a.program_id = p.id
+            WHERE ad_creatives_fts MATCH ?
+            ORDER BY score
+            LIMIT ?
+            """,
+            (match, limit),
+        )
+    except sqlite3.OperationalError:
+        like = f"%{query.strip()}%"
+        cur.execute(
+            """
+            SELECT
+                a.id,
+                a.title,
+                a.angle,
+                a.traffic_source,
+                p.name AS program_name,
+                a.headline AS headline_hl,
+                substr(a.body, 1, 120) AS snippet,
+                0.0 AS score
+            FROM ad_creatives a
+            LEFT JOIN affiliate_programs p ON a.program_id = p.id
+            WHERE a.title LIKE ? OR a.headline LIKE ? OR a.body LIKE ?
+                OR a.call_to_action LIKE ? OR a.campaign_notes LIKE ?
+            ORDER BY a.id DESC
+            LIMIT ?
+            """,
+            (like, like, like, like, like, limit),
+        )
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+def search_programs(query: str, limit: int = 50) -> List[sqlite3.Row]:
+    """Ranked (bm25) search over affiliate programs, with highlighted snippets."""
+    match = build_fts_query(query)
+    if not match:
+        return []
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            SELECT
+                p.id,
+                p.status,
+                p.signup_url,
+                highlight(affiliate_programs_fts, 0, '**', '**') AS name_hl,
+                snippet(affiliate_programs_fts, 1, '**', '**', '…', 16) AS snippet,
+                bm25(affiliate_programs_fts, 5.0, 1.0) AS score
+            FROM affiliate_programs_fts
+            JOIN affiliate_programs p ON p.id = affiliate_programs_fts.rowid
+            WHERE affiliate_programs_fts MATCH ?
+            ORDER BY score
+            LIMIT ?
+            """,
+            (match, limit),
+        )
+    except sqlite3.OperationalError:
+        like = f"%{query.strip()}%"
+        cur.execute(
+            """
+            SELECT
+                p.id,
+                p.status,
+                p.signup_url,
+                p.name AS name_hl,
+                substr(p.notes, 1, 120) AS snippet,
+                0.0 AS score
+            FROM affiliate_programs p
+            WHERE p.name LIKE ? OR p.notes LIKE ?
+            ORDER BY p.id DESC
+            LIMIT ?
+            """,
+            (like, like, limit),
+        )
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
 def fetch_programs() -> List[sqlite3.Row]:
     conn = get_conn()
     cur = conn.cursor()
@@ -247,8 +944,7 @@ def fetch_programs() -> List[sqlite3.Row]:
     return rows
 
 
-def insert_program(name, niche, geo_focus, signup_url, status, notes):
-    conn = get_conn()
+def insert_program_op(conn, name, niche, geo_focus, signup_url, status, notes) -> int:
     cur = conn.cursor()
     cur.execute(
         """
@@ -257,8 +953,13 @@ def insert_program(name, niche, geo_focus, signup_url, status, notes):
         """,
         (name, niche, geo_focus, signup_url, status, notes),
     )
-    conn.commit()
-    conn.close()
+    return cur.lastrowid
+
+
+def insert_program(name, niche, geo_focus, signup_url, status, notes):
+    return submit_write(
+        insert_program_op, name, niche, geo_focus, signup_url, status, notes
+    ).result()
 
 
 def get_program_by_id(pid: int) -> Dict:
@@ -270,7 +971,8 @@ def get_program_by_id(pid: int) -> Dict:
     return dict(row) if row else {}
 
 
-def fetch_ads() -> List[sqlite3.Row]:
+def fetch_ads(include_archived: bool = False) -> List[Dict]:
+    """Ads (plus program_name) as dicts, newest first; archived ones carry archived_at."""
     conn = get_conn()
     cur = conn.cursor()
     cur.execute(
@@ -281,12 +983,17 @@ def fetch_ads() -> List[sqlite3.Row]:
         ORDER BY a.id DESC
         """
     )
-    rows = cur.fetchall()
+    rows = [dict(r) for r in cur.fetchall()]
     conn.close()
+    if include_archived:
+        hot_ids = {r["id"] for r in rows}
+        archived = [a for a in load_archived_ads() if a["id"] not in hot_ids]
+        rows = sorted(rows + archived, key=lambda r: r["id"], reverse=True)
     return rows
 
 
-def insert_ad(
+def insert_ad_op(
+    conn,
     program_id,
     title,
     angle,
@@ -297,15 +1004,16 @@ def insert_ad(
     traffic_source,
     campaign_notes,
 ) -> int:
-    conn = get_conn()
+    dims = parse_campaign_notes(campaign_notes)
     cur = conn.cursor()
     cur.execute(
         """
         INSERT INTO ad_creatives (
             program_id, title, angle, headline, body,
-            call_to_action, placement_type, traffic_source, campaign_notes
+            call_to_action, placement_type, traffic_source, campaign_notes,
+            geo, device, bid_model, bid_amount, daypart_start, daypart_end
         )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """,
         (
             program_id,
@@ -317,6 +1025,12 @@ def insert_ad(
             placement_type,
             traffic_source,
             campaign_notes,
+            dims["geo"],
+            dims["device"],
+            dims["bid_model"],
+            dims["bid_amount"],
+            dims["daypart_start"],
+            dims["daypart_end"],
         ),
     )
     ad_id = cur.lastrowid
@@ -329,34 +1043,97 @@ def insert_ad(
         """,
         (ad_id,),
     )
-
-    conn.commit()
-    conn.close()
+    record_compliance_op(
+        conn,
+        ad_id,
+        {
+            "headline": headline,
+            "body": body,
+            "call_to_action": call_to_action,
+            "placement_type": placement_type,
+            "traffic_source": traffic_source,
+        },
+    )
     return ad_id
 
 
-def get_performance_for_ad(ad_id: int) -> Dict:
+def insert_ad(
+    program_id,
+    title,
+    angle,
+    headline,
+    body,
+    call_to_action,
+    placement_type,
+    traffic_source,
+    campaign_notes,
+) -> int:
+    return submit_write(
+        insert_ad_op,
+        program_id,
+        title,
+        angle,
+        headline,
+        body,
+        call_to_action,
+        placement_type,
+        traffic_source,
+        campaign_notes,
+    ).result()
+
+
+def get_performance_for_ads(ad_ids: List[int]) -> Dict[int, Dict]:
+    """
+    {ad_id: metrics} in one hot query plus one archive read for the ids that
+    have no hot row; unknown ids get zeros.
+    """
+    ad_ids = list(dict.fromkeys(ad_ids))
+    if not ad_ids:
+        return {}
     conn = get_conn()
     cur = conn.cursor()
     cur.execute(
-        "SELECT * FROM ad_performance WHERE ad_id = ?",
-        (ad_id,),
+        "SELECT * FROM ad_performance WHERE ad_id IN (SELECT value FROM json_each(?))",
+        (json.dumps(ad_ids),),
     )
-    row = cur.fetchone()
+    perf = {r["ad_id"]: dict(r) for r in cur.fetchall()}
     conn.close()
-    if row:
-        return dict(row)
-    return {
-        "ad_id": ad_id,
-        "impressions": 0,
-        "clicks": 0,
-        "leads": 0,
-        "sales": 0,
-        "revenue": 0.0,
-    }
+    missing = [i for i in ad_ids if i not in perf]
+    for ad in load_archived_ads(missing) if missing else []:
+        perf[ad["id"]] = {"ad_id": ad["id"], **{m: ad[m] for m in METRIC_COLUMNS}}
+    for ad_id in ad_ids:
+        perf.setdefault(
+            ad_id,
+            {
+                "ad_id": ad_id,
+                "impressions": 0,
+                "clicks": 0,
+                "leads": 0,
+                "sales": 0,
+                "revenue": 0.0,
+            },
+        )
+    return perf
 
 
-def update_performance(
+def get_performance_for_ad(ad_id: int) -> Dict:
+    return get_performance_for_ads([ad_id])[ad_id]
+
+
+PERFORMANCE_UPSERT_SQL = """
+    INSERT INTO ad_performance (ad_id, impressions, clicks, leads, sales, revenue)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(ad_id) DO UPDATE SET
+        impressions = excluded.impressions,
+        clicks = excluded.clicks,
+        leads = excluded.leads,
+        sales = excluded.sales,
+        revenue = excluded.revenue
+"""
+
+
+def update_performance_op(
+    conn,
     ad_id: int,
     impressions: int,
     clicks: int,
@@ -364,23 +1141,59 @@ def update_performance(
     sales: int,
     revenue: float,
 ):
-    conn = get_conn()
     cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO ad_performance (ad_id, impressions, clicks, leads, sales, revenue)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ON CONFLICT(ad_id) DO UPDATE SET
-            impressions = excluded.impressions,
-            clicks = excluded.clicks,
-            leads = excluded.leads,
-            sales = excluded.sales,
-            revenue = excluded.revenue
-        """,
-        (ad_id, impressions, clicks, leads, sales, revenue),
-    )
-    conn.commit()
-    conn.close()
+    cur.execute(PERFORMANCE_UPSERT_SQL, (ad_id, impressions, clicks, leads, sales, revenue))
+
+
+def update_performance(
+    ad_id: int,
+    impressions: int,
+    clicks: int,
+    leads: int,
+    sales: int,
+    revenue: float,
+):
+    """Upsert one ad's metrics, then run the rules for that ad; returns rule changes."""
+    submit_write(
+        update_performance_op, ad_id, impressions, clicks, leads, sales, revenue
+    ).result()
+    return apply_rules([ad_id])
+
+
+def bulk_update_performance_op(conn, rows: List[Tuple[int, int, int, int, int, float]]) -> int:
+    """Upsert many (ad_id, impressions, clicks, leads, sales, revenue) rows at once."""
+    conn.executemany(PERFORMANCE_UPSERT_SQL, rows)
+    return len(rows)
+
+
+def bulk_update_performance(rows: List[Tuple[int, int, int, int, int, float]], evaluate_rules: bool = True) -> int:
+    """
+    One writer op → one executemany inside a single transaction, then an
+    evaluate_rules job for those ads (the caller doesn't wait for it).
+    """
+    if not rows:
+        return 0
+    n = submit_write(bulk_update_performance_op, rows).result()
+    if evaluate_rules:
+        queue_rule_evaluation([r[0] for r in rows])
+    return n
+
+
+def diff_metrics(loaded: pd.DataFrame, edited: pd.DataFrame) -> pd.DataFrame:
+    """
+    Rows of `edited` whose metric values differ from `loaded` (matched on
+    ad_id), with the full set of metric columns ready for an upsert.
+    """
+    cols = ["ad_id"] + METRIC_COLUMNS
+    before = loaded[cols].set_index("ad_id")
+    after = edited[cols].set_index("ad_id").reindex(before.index)
+    after = after.fillna(before)
+    changed = (after.round(2) != before.round(2)).any(axis=1)
+    out = after[changed].reset_index()
+    for col in COUNTER_COLUMNS:
+        out[col] = out[col].astype("int64")
+    out["revenue"] = out["revenue"].astype(float).round(2)
+    return out
 
 
 def fetch_programs_df() -> pd.DataFrame:
@@ -390,327 +1203,5349 @@ def fetch_programs_df() -> pd.DataFrame:
     return df
 
 
-def fetch_ads_with_metrics_df() -> pd.DataFrame:
-    conn = get_conn()
-    df = pd.read_sql_query(
-        """
+# Column name -> SQL expression for fetch_ads_with_metrics_df (in output order).
+AD_METRICS_COLUMNS = {
+    "ad_id": "a.id",
+    "title": "a.title",
+    "angle": "a.angle",
+    "headline": "a.headline",
+    "body": "a.body",
+    "call_to_action": "a.call_to_action",
+    "placement_type": "a.placement_type",
+    "traffic_source": "a.traffic_source",
+    "campaign_notes": "a.campaign_notes",
+    "status": "a.status",
+    "geo": "a.geo",
+    "device": "a.device",
+    "bid_model": "a.bid_model",
+    "bid_amount": "a.bid_amount",
+    "daypart": daypart_label_sql("a"),
+    "program_name": "p.name",
+    "impressions": "perf.impressions",
+    "clicks": "perf.clicks",
+    "leads": "perf.leads",
+    "sales": "perf.sales",
+    "revenue": "perf.revenue",
+}
+
+# Low-cardinality labels -> pandas categoricals in compact mode.
+CATEGORY_COLUMNS = ["traffic_source", "placement_type", "angle", "program_name", "geo", "device", "bid_model", "daypart"]
+COUNTER_COLUMNS = ["impressions", "clicks", "leads", "sales"]
+METRIC_COLUMNS = COUNTER_COLUMNS + ["revenue"]
+
+# Numbers-only projection used by the reporting pages.
+REPORT_COLUMNS = (
+    ["ad_id", "title", "program_name", "traffic_source", "angle", "placement_type"]
+    + ["geo", "device", "bid_model", "daypart"]
+    + METRIC_COLUMNS
+)
+
+METRICS_CHUNK_ROWS = 50_000
+
+
+def compact_metrics_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Shrink a metrics frame: categorical labels, smallest int for counters."""
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    for col in COUNTER_COLUMNS + ["ad_id"]:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+    return df
+
+
+def build_ads_metrics_sql(columns: Optional[List[str]] = None, compact: bool = False):
+    """SQL for fetch_ads_with_metrics_df -> (sql, resolved column list)."""
+    if columns is None:
+        columns = list(AD_METRICS_COLUMNS)
+    unknown = [c for c in columns if c not in AD_METRICS_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown metrics columns: {unknown}")
+    columns = ["ad_id"] + [c for c in AD_METRICS_COLUMNS if c in columns and c != "ad_id"]
+
+    select = []
+    for col in columns:
+        expr = AD_METRICS_COLUMNS[col]
+        if compact and col in CATEGORY_COLUMNS:
+            expr = f"COALESCE(NULLIF({expr}, ''), 'Unknown')"
+        elif compact and col in METRIC_COLUMNS:
+            expr = f"COALESCE({expr}, 0)"
+        select.append(f"{expr} AS {col}")
+
+    joins = []
+    if "program_name" in columns:
+        joins.append("LEFT JOIN affiliate_programs p ON a.program_id = p.id")
+    if any(c in METRIC_COLUMNS for c in columns):
+        joins.append("LEFT JOIN ad_performance perf ON perf.ad_id = a.id")
+
+    sql = f"""
         SELECT
-            a.id AS ad_id,
-            a.title,
-            a.angle,
-            a.headline,
-            a.body,
-            a.call_to_action,
-            a.placement_type,
-            a.traffic_source,
-            a.campaign_notes,
-            p.name AS program_name,
-            perf.impressions,
-            perf.clicks,
-            perf.leads,
-            perf.sales,
-            perf.revenue
+            {", ".join(select)}
         FROM ad_creatives a
-        LEFT JOIN affiliate_programs p ON a.program_id = p.id
-        LEFT JOIN ad_performance perf ON perf.ad_id = a.id
+        {" ".join(joins)}
         ORDER BY a.id
-        """,
-        conn,
-    )
-    conn.close()
+        """
+    return sql, columns
+
+
+def fetch_ads_with_metrics_df(
+    columns: Optional[List[str]] = None,
+    compact: bool = False,
+    chunksize: Optional[int] = None,
+    include_archived: bool = False,
+) -> pd.DataFrame:
+    """
+    Ads joined with program name and metrics.
+
+    columns: projection (subset of AD_METRICS_COLUMNS); `ad_id` is always
+        included. Joins that no selected column needs are skipped.
+    compact: categorical labels (NULL/empty -> "Unknown"), metrics never
+        NULL (0) and counters downcast to the smallest integer type.
+    chunksize: read in chunks, compacting each one before the next is
+        fetched, so peak memory stays near the compact size. Only applies
+        to the SQLite engine; DuckDB already returns columnar frames.
+    include_archived: also return creatives from the cold archive store.
+    """
+    sql, columns = build_ads_metrics_sql(columns, compact)
+    archived = archived_metrics_df(columns, compact) if include_archived else None
+
+    if chunksize and active_engine_name() == "sqlite":
+        conn = get_conn()
+        frames = []
+        for chunk in pd.read_sql_query(sql, conn, chunksize=chunksize):
+            frames.append(compact_metrics_df(chunk) if compact else chunk)
+        if archived is not None and not archived.empty:
+            frames.append(compact_metrics_df(archived) if compact else archived)
+        if not frames:
+            df = pd.read_sql_query(sql, conn)
+        else:
+            if compact and len(frames) > 1:
+                # Align categories so concat keeps the categorical dtype.
+                for col in CATEGORY_COLUMNS:
+                    if col in columns:
+                        cats = pd.api.types.union_categoricals(
+                            [f[col] for f in frames]
+                        ).categories
+                        for f in frames:
+                            f[col] = f[col].cat.set_categories(cats)
+            df = pd.concat(frames, ignore_index=True)
+            if compact:
+                # Chunks may have downcast to different int widths.
+                df = compact_metrics_df(df)
+        conn.close()
+    else:
+        df = run_analytics_query(sql)
+        if archived is not None and not archived.empty:
+            df = pd.concat([df, archived], ignore_index=True)
+        if compact:
+            df = compact_metrics_df(df)
     return df
 
 
-# =========================
-# Session-state helpers
-# =========================
+KPI_TOTALS_SQL = """
+    SELECT
+        COALESCE(SUM(impressions), 0) AS impressions,
+        COALESCE(SUM(clicks), 0) AS clicks,
+        COALESCE(SUM(leads), 0) AS leads,
+        COALESCE(SUM(sales), 0) AS sales,
+        COALESCE(SUM(revenue), 0.0) AS revenue
+    FROM ad_performance perf
+    JOIN ad_creatives a ON a.id = perf.ad_id
+"""
 
-if "auth_ok" not in st.session_state:
-    st.session_state["auth_ok"] = False
 
-if "zapier_webhook_url" not in st.session_state:
-    st.session_state["zapier_webhook_url"] = ""
+def fetch_kpi_totals(include_archived: bool = False) -> Dict:
+    row = run_analytics_query(KPI_TOTALS_SQL).iloc[0]
+    totals = {
+        "impressions": int(row["impressions"]),
+        "clicks": int(row["clicks"]),
+        "leads": int(row["leads"]),
+        "sales": int(row["sales"]),
+        "revenue": float(row["revenue"]),
+    }
+    if include_archived:
+        for ad in load_archived_ads():
+            for m in METRIC_COLUMNS:
+                totals[m] += ad[m]
+    return totals
 
 
 # =========================
-# UI Helpers
+# Single-writer queue
 # =========================
 
-def render_header():
-    st.markdown(
-        """
-        <div class="xxx-header">
-            <div class="xxx-logo">🔥</div>
-            <div class="xxx-title">THE XXX AD POSTER</div>
-            <div class="xxx-subtitle">
-                Manage affiliate programs, track performance & build clean ad creatives for adult offers.
-            </div>
-        </div>
-        """,
-        unsafe_allow_html=True,
-    )
-    st.markdown("---")
+WRITER_MAX_BATCH = 200
 
 
-def render_footer():
-    st.markdown(
-        """
-        <div class="xxx-footer">
-            © 2025 THE XXX AD POSTER · Built with Python + Streamlit.<br/>
-            No passwords or sensitive data should be stored here – use it as a planning toolkit.
-        </div>
+class DBWriter:
+    """
+    One background thread per process owns the only write connection.
+    Callers queue `op(conn, *args)` callables and get a Future back; the
+    thread drains whatever is queued (up to `max_batch`) and runs it as one
+    group commit, each op inside its own SAVEPOINT so a failing op only
+    fails its own future. Ops queued with submit_exclusive run alone, outside
+    any transaction (backup-API restores, VACUUM).
+    """
+
+    def __init__(self, db_path: str = DB_PATH, max_batch: int = WRITER_MAX_BATCH):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self._queue: "queue.Queue" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "commits": 0,
+            "ops": 0,
+            "failed_ops": 0,
+            "failed_commits": 0,
+            "max_batch": 0,
+            "last_commit_ms": 0.0,
+            "max_commit_ms": 0.0,
+            "total_commit_ms": 0.0,
+            "last_commit_at": 0.0,
+            "max_exclusive_ms": 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name="xxx-db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, op, *args, **kwargs) -> Future:
+        fut: Future = Future()
+        self._queue.put((op, args, kwargs, fut, False))
+        return fut
+
+    def submit_exclusive(self, op, *args, **kwargs) -> Future:
+        """Queue `op(conn, *args)` to run by itself in autocommit mode, between group commits."""
+        fut: Future = Future()
+        self._queue.put((op, args, kwargs, fut, True))
+        return fut
+
+    def close(self):
+        """Finish queued writes, then stop the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            out = dict(self._stats)
+        out["queue_depth"] = self._queue.qsize()
+        out["avg_batch"] = out["ops"] / out["commits"] if out["commits"] else 0.0
+        out["avg_commit_ms"] = (
+            out["total_commit_ms"] / out["commits"] if out["commits"] else 0.0
+        )
+        return out
+
+    def _next_batch(self) -> List:
+        """Queued ops up to max_batch; stops after the stop marker or an exclusive op."""
+        batch = [self._queue.get()]
+        while len(batch) < self.max_batch and batch[-1] is not None and not batch[-1][4]:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # Autocommit mode: transactions are opened/closed explicitly below.
+        conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+        conn.row_factory = sqlite3.Row
+        stopping = False
+        while not stopping:
+            batch = self._next_batch()
+            if batch[-1] is None:
+                stopping = True
+                batch = batch[:-1]
+            batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+            exclusive = batch.pop() if batch and batch[-1][4] else None
+            if batch:
+                self._commit(conn, batch)
+            if exclusive:
+                self._run_exclusive(conn, exclusive)
+        conn.close()
+
+    def _run_exclusive(self, conn, item):
+        op, args, kwargs, fut, _ = item
+        started = time.perf_counter()
+        try:
+            result = op(conn, *args, **kwargs)
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            get_metrics().inc("xxx_db_write_ops_total", outcome="error")
+            with self._stats_lock:
+                self._stats["failed_ops"] += 1
+            fut.set_exception(e)
+            return
+        get_metrics().inc("xxx_db_write_ops_total", outcome="ok")
+        with self._stats_lock:
+            self._stats["ops"] += 1
+            self._stats["max_exclusive_ms"] = max(
+                self._stats["max_exclusive_ms"], (time.perf_counter() - started) * 1000
+            )
+        fut.set_result(result)
+
+    def _commit(self, conn, batch: List):
+        """One group commit: every op in its own SAVEPOINT inside one transaction."""
+        started = time.perf_counter()
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for op, args, kwargs, fut, _ in batch:
+                conn.execute("SAVEPOINT op")
+                try:
+                    outcomes.append((fut, op(conn, *args, **kwargs), None))
+                    conn.execute("RELEASE op")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    outcomes.append((fut, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            get_metrics().inc("xxx_db_write_ops_total", len(batch), outcome="commit_failed")
+            with self._stats_lock:
+                self._stats["failed_commits"] += 1
+            for _, _, _, fut, _ in batch:
+                fut.set_exception(e)
+            return
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        metrics = get_metrics()
+        metrics.observe("xxx_db_commit_seconds", elapsed_ms / 1000)
+        failed = sum(1 for _, _, err in outcomes if err)
+        metrics.inc("xxx_db_write_ops_total", len(batch) - failed, outcome="ok")
+        if failed:
+            metrics.inc("xxx_db_write_ops_total", failed, outcome="error")
+        with self._stats_lock:
+            stats = self._stats
+            stats["commits"] += 1
+            stats["ops"] += len(batch)
+            stats["failed_ops"] += sum(1 for _, _, err in outcomes if err)
+            stats["max_batch"] = max(stats["max_batch"], len(batch))
+            stats["last_commit_ms"] = elapsed_ms
+            stats["max_commit_ms"] = max(stats["max_commit_ms"], elapsed_ms)
+            stats["total_commit_ms"] += elapsed_ms
+            stats["last_commit_at"] = time.time()
+
+        for fut, result, err in outcomes:
+            if err is not None:
+                fut.set_exception(err)
+            else:
+                fut.set_result(result)
+
+
+@st.cache_resource
+def get_db_writer() -> DBWriter:
+    """Process-wide writer, shared by every Streamlit session."""
+    return DBWriter(DB_PATH)
+
+
+def submit_write(op, *args, **kwargs) -> Future:
+    """Queue a write op `op(conn, *args)`; resolve the Future for its return value."""
+    return get_db_writer().submit(op, *args, **kwargs)
+
+
+def submit_exclusive_write(op, *args, **kwargs) -> Future:
+    """Like submit_write, but `op` runs alone on the writer connection with no open transaction."""
+    return get_db_writer().submit_exclusive(op, *args, **kwargs)
+
+
+# =========================
+# Archive tier (cold store)
+# =========================
+
+AD_STATUSES = ["Active", "Winner", "Paused", "Loser"]
+
+# Creatives in these statuses are moved out of the hot tables by the archive job.
+ARCHIVE_STATUSES = ["Paused", "Loser"]
+
+# Separate SQLite file; the full ad + metrics row is stored as zlib-compressed
+# JSON, with a few label columns left uncompressed for listing.
+ARCHIVE_DB_PATH = "xxx_ad_poster_archive.db"
+# Archive writes come from several threads (archiver, jobs, pages); this keeps
+# them from interleaving with each other and with a backup restore.
+ARCHIVE_WRITE_LOCK = threading.RLock()
+
+ARCHIVE_INTERVAL_HOURS = 6
+
+# ...and only once they've been idle (no status change, no metrics update) this long.
+ARCHIVE_AFTER_DAYS = 30
+
+
+def init_archive_activity(conn):
+    """ad_creatives.last_active_at, kept current by triggers on status and metrics writes."""
+    cur = conn.cursor()
+    cur.execute("PRAGMA table_info(ad_creatives)")
+    if "last_active_at" not in [row[1] for row in cur.fetchall()]:
+        cur.execute("ALTER TABLE ad_creatives ADD COLUMN last_active_at TEXT")
+        # Existing ads start their idle clock at the upgrade.
+        cur.execute("UPDATE ad_creatives SET last_active_at = datetime('now')")
+
+    touch_ad = "UPDATE ad_creatives SET last_active_at = datetime('now') WHERE id = {}"
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS ad_creatives_active_ai AFTER INSERT ON ad_creatives BEGIN
+            {touch_ad.format("new.id")};
+        END
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS ad_creatives_active_au AFTER UPDATE OF status ON ad_creatives
+        WHEN new.status IS NOT old.status BEGIN
+            {touch_ad.format("new.id")};
+        END
+        """
+    )
+    for event in ("INSERT", "UPDATE"):
+        cur.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS ad_performance_active_a{event[0].lower()}
+            AFTER {event} ON ad_performance BEGIN
+                {touch_ad.format("new.ad_id")};
+            END
+            """
+        )
+
+
+def get_archive_conn():
+    conn = sqlite3.connect(ARCHIVE_DB_PATH)
+    conn.row_factory = sqlite3.Row
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS archived_ads (
+            id INTEGER PRIMARY KEY,
+            program_id INTEGER,
+            title TEXT,
+            traffic_source TEXT,
+            angle TEXT,
+            placement_type TEXT,
+            status TEXT,
+            archived_at TEXT NOT NULL,
+            payload BLOB NOT NULL
+        )
+        """
+    )
+    return conn
+
+
+def update_ad_status_op(conn, ad_id: int, status: str):
+    conn.execute("UPDATE ad_creatives SET status = ? WHERE id = ?", (status, ad_id))
+
+
+def update_ad_status(ad_id: int, status: str):
+    submit_write(update_ad_status_op, ad_id, status).result()
+
+
+def find_archive_candidates(statuses: Optional[List[str]] = None, idle_days: Optional[float] = None) -> List[int]:
+    """Ads in an archive status that have been idle for `idle_days` (default ARCHIVE_AFTER_DAYS)."""
+    statuses = statuses or ARCHIVE_STATUSES
+    if idle_days is None:
+        idle_days = float(get_secret("ARCHIVE_AFTER_DAYS", ARCHIVE_AFTER_DAYS))
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        f"""
+        SELECT id FROM ad_creatives
+        WHERE status IN ({', '.join('?' for _ in statuses)})
+          AND last_active_at <= datetime('now', ?)
         """,
-        unsafe_allow_html=True,
+        list(statuses) + [f"-{idle_days} days"],
+    )
+    ids = [r[0] for r in cur.fetchall()]
+    conn.close()
+    return ids
+
+
+def load_archive_rows(conn, ad_ids: List[int]) -> List[Dict]:
+    """Ad + metrics rows exactly as they go into the cold store."""
+    cur = conn.execute(
+        f"""
+        SELECT a.*, perf.impressions, perf.clicks, perf.leads, perf.sales, perf.revenue
+        FROM ad_creatives a
+        LEFT JOIN ad_performance perf ON perf.ad_id = a.id
+        WHERE a.id IN ({', '.join('?' for _ in ad_ids)})
+        """,
+        list(ad_ids),
+    )
+    return [dict(zip([d[0] for d in cur.description], r)) for r in cur.fetchall()]
+
+
+def delete_archived_from_hot_op(conn, snapshot: List[Dict], statuses: List[str]) -> List[int]:
+    """
+    Delete ads that are still archivable *and* unchanged since `snapshot` (the
+    rows copied to the cold store); returns the ids actually removed.
+    """
+    copied = {r["id"]: r for r in snapshot}
+    ids = [
+        r["id"]
+        for r in load_archive_rows(conn, list(copied))
+        if r["status"] in statuses and r == copied[r["id"]]
+    ]
+    cur = conn.cursor()
+    if ids:
+        marks = ", ".join("?" for _ in ids)
+        cur.execute(f"DELETE FROM ad_performance WHERE ad_id IN ({marks})", ids)
+        # Rendered-banner cache rows are hot-only (the files go with the next
+        # prune_banners run). Of the rule hit history only each ad's latest hit
+        # stays: bottom/top-N rules count archived ads they moved towards N.
+        cur.execute(f"DELETE FROM banner_renders WHERE ad_id IN ({marks})", ids)
+        cur.execute(
+            f"""
+            DELETE FROM rule_hits WHERE ad_id IN ({marks}) AND id NOT IN (
+                SELECT MAX(id) FROM rule_hits WHERE ad_id IN ({marks}) GROUP BY ad_id
+            )
+            """,
+            ids + ids,
+        )
+        cur.execute(f"DELETE FROM ad_creatives WHERE id IN ({marks})", ids)
+    return ids
+
+
+def archive_ads(ad_ids: List[int], statuses: Optional[List[str]] = None, batch_size: int = 500) -> int:
+    """
+    Move creatives + their metrics to the cold store. Cold rows are written
+    and committed first, then the hot rows are deleted through the writer;
+    ads that changed in between (status, copy or metrics) stay hot and are
+    dropped from the cold store again.
+    """
+    statuses = statuses or ARCHIVE_STATUSES
+    moved = 0
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    for start in range(0, len(ad_ids), batch_size):
+        batch = ad_ids[start:start + batch_size]
+        conn = get_conn()
+        rows = load_archive_rows(conn, batch)
+        conn.close()
+        if not rows:
+            continue
+
+        with ARCHIVE_WRITE_LOCK:
+            cold = get_archive_conn()
+            cold.executemany(
+                """
+                INSERT OR REPLACE INTO archived_ads (
+                    id, program_id, title, traffic_source, angle, placement_type,
+                    status, archived_at, payload
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        r["id"],
+                        r["program_id"],
+                        r["title"],
+                        r["traffic_source"],
+                        r["angle"],
+                        r["placement_type"],
+                        r["status"],
+                        now,
+                        zlib.compress(json.dumps(r).encode("utf-8"), 9),
+                    )
+                    for r in rows
+                ],
+            )
+            cold.commit()
+
+            removed = submit_write(delete_archived_from_hot_op, rows, statuses).result()
+            kept_hot = [r["id"] for r in rows if r["id"] not in set(removed)]
+            if kept_hot:
+                cold.execute(
+                    f"DELETE FROM archived_ads WHERE id IN ({', '.join('?' for _ in kept_hot)})",
+                    kept_hot,
+                )
+                cold.commit()
+            cold.close()
+        moved += len(removed)
+    return moved
+
+
+def load_archived_ads(ad_ids: Optional[List[int]] = None) -> List[Dict]:
+    """Decompressed archived ads (ad columns + metrics + program_name)."""
+    if not os.path.exists(ARCHIVE_DB_PATH):
+        return []
+    cold = get_archive_conn()
+    if ad_ids is None:
+        rows = cold.execute("SELECT archived_at, payload FROM archived_ads ORDER BY id DESC").fetchall()
+    else:
+        if not ad_ids:
+            return []
+        rows = cold.execute(
+            f"SELECT archived_at, payload FROM archived_ads WHERE id IN ({', '.join('?' for _ in ad_ids)})",
+            list(ad_ids),
+        ).fetchall()
+    cold.close()
+
+    program_names = {p["id"]: p["name"] for p in fetch_programs()}
+    ads = []
+    for r in rows:
+        ad = json.loads(zlib.decompress(r["payload"]).decode("utf-8"))
+        ad["program_name"] = program_names.get(ad.get("program_id"))
+        ad["archived_at"] = r["archived_at"]
+        for m in METRIC_COLUMNS:
+            if ad.get(m) is None:
+                ad[m] = 0.0 if m == "revenue" else 0
+        ads.append(ad)
+    return ads
+
+
+def with_campaign_dimensions(ad: Dict) -> Dict:
+    """Archived rows predating the dimension columns get them parsed on read."""
+    if "geo" not in ad:
+        ad = {**ad, **parse_campaign_notes(ad.get("campaign_notes"))}
+    if "daypart" not in ad and ad.get("daypart_start") is not None:
+        ad["daypart"] = f"{ad['daypart_start']:02d}–{ad['daypart_end']:02d}h"
+    return ad
+
+
+def archived_metrics_df(columns: List[str], compact: bool = False) -> pd.DataFrame:
+    """Archived ads shaped like fetch_ads_with_metrics_df(columns, compact)."""
+    ads = [with_campaign_dimensions(ad) for ad in load_archived_ads()]
+    df = pd.DataFrame(
+        [{c: ad.get("id" if c == "ad_id" else c) for c in columns} for ad in ads],
+        columns=columns,
     )
+    if compact:
+        for col in CATEGORY_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].fillna("").map(lambda v: v or "Unknown")
+    return df
+
+
+def restore_ads_op(conn, ads: List[Dict]):
+    ad_cols = [c[1] for c in conn.execute("PRAGMA table_info(ad_creatives)").fetchall()]
+    for ad in ads:
+        ad = with_campaign_dimensions(ad)
+        cols = [c for c in ad_cols if c in ad]
+        conn.execute(
+            f"INSERT OR REPLACE INTO ad_creatives ({', '.join(cols)}) "
+            f"VALUES ({', '.join('?' for _ in cols)})",
+            [ad[c] for c in cols],
+        )
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO ad_performance (ad_id, impressions, clicks, leads, sales, revenue)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (ad["id"], ad["impressions"], ad["clicks"], ad["leads"], ad["sales"], ad["revenue"]),
+        )
+
+
+def restore_ads(ad_ids: List[int], status: str = "Active") -> int:
+    """Move archived creatives back into the hot tables (with the given status)."""
+    ads = load_archived_ads(ad_ids)
+    if not ads:
+        return 0
+    for ad in ads:
+        ad["status"] = status
+    submit_write(restore_ads_op, ads).result()
+    with ARCHIVE_WRITE_LOCK:
+        cold = get_archive_conn()
+        cold.execute(
+            f"DELETE FROM archived_ads WHERE id IN ({', '.join('?' for _ in ads)})",
+            [ad["id"] for ad in ads],
+        )
+        cold.commit()
+        cold.close()
+    return len(ads)
+
+
+def run_archive_job() -> Dict:
+    started = time.perf_counter()
+    candidates = find_archive_candidates()
+    moved = archive_ads(candidates) if candidates else 0
+    return {
+        "archived": moved,
+        "ms": (time.perf_counter() - started) * 1000,
+        "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+@st.cache_resource
+def start_archive_scheduler() -> Dict:
+    """Background thread (one per process) running the archive job periodically."""
+    state = {"last_run": None, "last_error": ""}
+    interval = float(get_secret("ARCHIVE_INTERVAL_HOURS", ARCHIVE_INTERVAL_HOURS)) * 3600
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                state["last_run"] = run_archive_job()
+            except Exception as e:
+                state["last_error"] = str(e)
+
+    if interval > 0:
+        threading.Thread(target=loop, name="xxx-archiver", daemon=True).start()
+    return state
 
 
 # =========================
-# Auth
+# Backups (online, SQLite backup API)
 # =========================
 
-def login_page():
-    render_header()
-    st.markdown('<div class="login-card">', unsafe_allow_html=True)
-    st.markdown('<div class="login-title">🔒 Creator Login</div>', unsafe_allow_html=True)
+BACKUP_DIR = "backups"
+BACKUP_KEEP = 14
+BACKUP_INTERVAL_HOURS = 24
+# Pages copied per backup step (locks are released between steps), and the
+# retry delay when a step hits SQLITE_BUSY/LOCKED – sqlite3 only sleeps then.
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.005
+# A write from another connection restarts a stepped backup from page 0. After
+# this many restarts the copy finishes in one step instead – under WAL that is a
+# single read snapshot, so writers still aren't blocked.
+BACKUP_MAX_RESTARTS = 3
+
+# Files captured in each snapshot: name inside the snapshot -> live path.
+BACKUP_FILES = {"main": DB_PATH, "archive": ARCHIVE_DB_PATH}
+
+
+def list_backups(backup_dir: str = BACKUP_DIR) -> List[Dict]:
+    """Snapshot metadata, newest first."""
+    if not os.path.isdir(backup_dir):
+        return []
+    out = []
+    for name in sorted(os.listdir(backup_dir), reverse=True):
+        meta_path = os.path.join(backup_dir, name, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                out.append(json.load(f))
+    return out
+
+
+def integrity_check(conn) -> str:
+    return "; ".join(r[0] for r in conn.execute("PRAGMA integrity_check").fetchall())
+
+
+def backup_sqlite_file(
+    src_path: str,
+    dest_gz: str,
+    progress: Optional[Callable[[float], None]] = None,
+) -> Dict:
+    """
+    Online copy of one SQLite file: backup API in small steps (writers can
+    commit between steps), integrity_check on the copy, then gzip it.
+    """
+    timings = {}
+    tmp_path = dest_gz[: -len(".gz")] + ".tmp"
+    started = time.perf_counter()
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(tmp_path)
+    steps = 0
+    restarts = 0
+    last_remaining = None
+
+    class Restarted(Exception):
+        pass
+
+    def on_step(status, remaining, total):
+        nonlocal steps, restarts, last_remaining
+        steps += 1
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > BACKUP_MAX_RESTARTS:
+                raise Restarted()
+        last_remaining = remaining
+        if progress and total:
+            progress(1 - remaining / total)
 
-    username = st.text_input("Username", placeholder="admin")
-    password = st.text_input("Password", type="password")
+    try:
+        try:
+            src.backup(dst, pages=BACKUP_PAGES_PER_STEP, progress=on_step, sleep=BACKUP_STEP_SLEEP)
+        except Restarted:
+            src.backup(dst)
+            steps += 1
+        timings["copy_ms"] = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        integrity = integrity_check(dst)
+        timings["verify_ms"] = (time.perf_counter() - started) * 1000
+    finally:
+        dst.close()
+        src.close()
+    if integrity != "ok":
+        os.remove(tmp_path)
+        raise RuntimeError(f"integrity_check failed for backup of {src_path}: {integrity}")
+
+    started = time.perf_counter()
+    with open(tmp_path, "rb") as raw, gzip.open(dest_gz, "wb", compresslevel=6) as gz:
+        shutil.copyfileobj(raw, gz, 1 << 20)
+    timings["compress_ms"] = (time.perf_counter() - started) * 1000
+    raw_bytes = os.path.getsize(tmp_path)
+    os.remove(tmp_path)
+    return {
+        "steps": steps,
+        "restarts": restarts,
+        "raw_bytes": raw_bytes,
+        "gz_bytes": os.path.getsize(dest_gz),
+        "integrity": integrity,
+        **timings,
+    }
 
-    if st.button("Log In"):
-        admin_user = st.secrets.get("ADMIN_USERNAME", "admin")
-        admin_pw = st.secrets.get("ADMIN_PASSWORD", "xxx-poster")
 
-        if username == admin_user and password == admin_pw:
-            st.session_state["auth_ok"] = True
-            st.success("Access granted. Loading THE XXX AD POSTER…")
-            safe_rerun()
-        else:
-            st.error("Invalid credentials.")
+def prune_backups(keep: int = BACKUP_KEEP, backup_dir: str = BACKUP_DIR) -> int:
+    snapshots = list_backups(backup_dir)
+    for meta in snapshots[keep:]:
+        shutil.rmtree(os.path.join(backup_dir, meta["id"]), ignore_errors=True)
+    return max(0, len(snapshots) - keep)
+
+
+def run_backup(
+    backup_dir: str = BACKUP_DIR,
+    progress: Optional[Callable[[float], None]] = None,
+    label: str = "scheduled",
+) -> Dict:
+    """Snapshot every file in BACKUP_FILES into backups/<timestamp>/, then rotate."""
+    started = time.perf_counter()
+    snap_id = time.strftime("%Y%m%d-%H%M%S") + f"-{uuid.uuid4().hex[:4]}"
+    snap_dir = os.path.join(backup_dir, snap_id)
+    os.makedirs(snap_dir, exist_ok=True)
+    files = {name: path for name, path in BACKUP_FILES.items() if os.path.exists(path)}
+    meta = {"id": snap_id, "created_at": time.strftime("%Y-%m-%d %H:%M:%S"), "label": label, "files": {}}
+    try:
+        for i, (name, path) in enumerate(files.items()):
+            meta["files"][name] = backup_sqlite_file(
+                path,
+                os.path.join(snap_dir, f"{name}.db.gz"),
+                progress=(lambda f, i=i: progress((i + f) / len(files))) if progress else None,
+            )
+    except Exception:
+        shutil.rmtree(snap_dir, ignore_errors=True)
+        raise
+    meta["total_ms"] = (time.perf_counter() - started) * 1000
+    with open(os.path.join(snap_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    meta["pruned"] = prune_backups(int(get_secret("BACKUP_KEEP", BACKUP_KEEP)), backup_dir)
+    return meta
+
+
+def restore_sqlite_file_op(conn, src_path: str):
+    """Backup-API copy of `src_path` over the database `conn` is connected to."""
+    src = sqlite3.connect(src_path)
+    try:
+        src.backup(conn)
+    finally:
+        src.close()
+
+
+def restore_backup(snap_id: str, backup_dir: str = BACKUP_DIR) -> Dict:
+    """
+    Point-in-time restore: take a safety snapshot of the current state, then
+    copy the chosen snapshot back over the live files with the backup API
+    (other connections stay open and simply see the restored data). The main
+    DB is overwritten by the writer thread, as an exclusive op, so it never
+    races a group commit; the archive under ARCHIVE_WRITE_LOCK.
+    """
+    snap_dir = os.path.join(backup_dir, snap_id)
+    with open(os.path.join(snap_dir, "meta.json")) as f:
+        meta = json.load(f)
+    started = time.perf_counter()
+    safety = run_backup(backup_dir, label=f"before restore of {snap_id}")
+    version_before = get_data_version()
+
+    for name in meta["files"]:
+        tmp_path = os.path.join(snap_dir, f"{name}.restore.tmp")
+        with gzip.open(os.path.join(snap_dir, f"{name}.db.gz"), "rb") as gz, open(tmp_path, "wb") as raw:
+            shutil.copyfileobj(gz, raw, 1 << 20)
+        try:
+            src = sqlite3.connect(tmp_path)
+            try:
+                integrity = integrity_check(src)
+            finally:
+                src.close()
+            if integrity != "ok":
+                raise RuntimeError(f"snapshot {snap_id}/{name} is corrupt: {integrity}")
+            if BACKUP_FILES[name] == DB_PATH:
+                submit_exclusive_write(restore_sqlite_file_op, tmp_path).result()
+            else:
+                with ARCHIVE_WRITE_LOCK:
+                    dst = sqlite3.connect(BACKUP_FILES[name], timeout=30)
+                    try:
+                        restore_sqlite_file_op(dst, tmp_path)
+                    finally:
+                        dst.close()
+        finally:
+            os.remove(tmp_path)
+
+    # The restored data_version may equal one already used as a cache key.
+    submit_write(
+        lambda conn: conn.execute(
+            "UPDATE app_meta SET value = MAX(value, ?) + 1 WHERE key = 'data_version'",
+            (version_before,),
+        )
+    ).result()
+    return {
+        "restored": snap_id,
+        "safety_snapshot": safety["id"],
+        "ms": (time.perf_counter() - started) * 1000,
+    }
 
-    st.markdown("</div>", unsafe_allow_html=True)
-    render_footer()
+
+@st.cache_resource
+def start_backup_scheduler() -> Dict:
+    """Background thread (one per process) taking a snapshot every BACKUP_INTERVAL_HOURS."""
+    state = {"last_run": None, "last_error": ""}
+    interval = float(get_secret("BACKUP_INTERVAL_HOURS", BACKUP_INTERVAL_HOURS)) * 3600
+
+    def loop():
+        # Resume the cadence across restarts instead of backing up on every boot.
+        latest = list_backups()
+        if latest:
+            age = time.time() - time.mktime(time.strptime(latest[0]["created_at"], "%Y-%m-%d %H:%M:%S"))
+            time.sleep(max(0.0, interval - age))
+        while True:
+            try:
+                state["last_run"] = run_backup()
+                state["last_error"] = ""
+            except Exception as e:
+                state["last_error"] = str(e)
+            time.sleep(interval)
+
+    if interval > 0:
+        threading.Thread(target=loop, name="xxx-backup", daemon=True).start()
+    return state
 
 
 # =========================
-# Zapier helper
+# Maintenance (ANALYZE / VACUUM / WAL checkpoint)
 # =========================
 
-def trigger_zap(event_name: str, payload: Dict):
+MAINT_CHECK_SECONDS = 300
+# Only run when the writer has been quiet this long and no job is running.
+MAINT_IDLE_SECONDS = 30
+# PRAGMA optimize at least this often…
+MAINT_OPTIMIZE_HOURS = 24
+# …and reclaim/checkpoint as soon as either threshold is crossed.
+MAINT_FREELIST_RATIO = 0.10
+MAINT_FREELIST_MIN_PAGES = 256
+MAINT_WAL_BYTES = 16 * 1024 * 1024
+
+
+# Pages reclaimed per writer op, so queued writes can interleave with the vacuum.
+MAINT_VACUUM_PAGES_PER_OP = 2_000
+
+
+def incremental_vacuum_op(conn, max_pages: int) -> int:
     """
-    Send a JSON payload to a Zapier Catch Hook.
+    Free up to `max_pages` pages (exclusive writer op); returns how many were
+    freed. incremental_vacuum frees one page per step and returns no rows, so
+    execute()/fetchall() stop after the first step – executescript() steps it
+    to completion, but commits any open transaction, hence exclusive.
+    """
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)})")
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
 
-    Priority:
-    1) st.secrets["ZAPIER_WEBHOOK_URL"]
-    2) st.session_state["zapier_webhook_url"]
+
+def full_vacuum_op(conn):
+    """One-off VACUUM that switches the file to auto_vacuum=INCREMENTAL (exclusive writer op)."""
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def wal_checkpoint_op(conn) -> int:
+    """TRUNCATE checkpoint (exclusive writer op); returns the busy flag."""
+    return conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0]
+
+
+def init_maintenance_log(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS maintenance_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ran_at TEXT,
+            reason TEXT,
+            actions TEXT,
+            db_bytes_before INTEGER,
+            db_bytes_after INTEGER,
+            wal_bytes_before INTEGER,
+            wal_bytes_after INTEGER,
+            freelist_before INTEGER,
+            freelist_after INTEGER,
+            query_ms_before REAL,
+            query_ms_after REAL,
+            ms REAL
+        )
+        """
+    )
+
+
+def db_file_stats(db_path: str = DB_PATH) -> Dict:
+    conn = get_conn(db_path)
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    stats = {
+        "db_bytes": os.path.getsize(db_path) if os.path.exists(db_path) else 0,
+        "wal_bytes": os.path.getsize(db_path + "-wal") if os.path.exists(db_path + "-wal") else 0,
+        "page_count": conn.execute("PRAGMA page_count").fetchone()[0],
+        "freelist_count": conn.execute("PRAGMA freelist_count").fetchone()[0],
+        "page_size": page_size,
+        "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}[conn.execute("PRAGMA auto_vacuum").fetchone()[0]],
+        "has_stats": table_exists(conn, "sqlite_stat1"),
+    }
+    conn.close()
+    return stats
+
+
+def probe_query_ms(db_path: str = DB_PATH) -> float:
+    """Time the hot reporting queries (KPI totals + report projection)."""
+    sql, _ = build_ads_metrics_sql(REPORT_COLUMNS, compact=True)
+    conn = get_conn(db_path)
+    started = time.perf_counter()
+    conn.execute(KPI_TOTALS_SQL).fetchall()
+    conn.execute(sql).fetchall()
+    elapsed = (time.perf_counter() - started) * 1000
+    conn.close()
+    return elapsed
+
+
+def last_maintenance(action: str) -> Optional[float]:
+    """Unix time of the last run that included `action`."""
+    conn = get_conn()
+    row = conn.execute(
+        "SELECT MAX(ran_at) FROM maintenance_log WHERE actions LIKE ?", (f"%{action}%",)
+    ).fetchone()
+    conn.close()
+    if not row or not row[0]:
+        return None
+    return time.mktime(time.strptime(row[0], "%Y-%m-%d %H:%M:%S"))
+
+
+def maintenance_due(stats: Dict) -> List[str]:
+    """Which maintenance actions the current file state calls for."""
+    due = []
+    last_opt = last_maintenance("optimize")
+    hours = float(get_secret("MAINT_OPTIMIZE_HOURS", MAINT_OPTIMIZE_HOURS))
+    if not stats["has_stats"] or last_opt is None or time.time() - last_opt > hours * 3600:
+        due.append("optimize")
+    if (
+        stats["freelist_count"] >= MAINT_FREELIST_MIN_PAGES
+        and stats["freelist_count"] > MAINT_FREELIST_RATIO * stats["page_count"]
+    ):
+        due.append("vacuum")
+    if stats["wal_bytes"] > MAINT_WAL_BYTES:
+        due.append("checkpoint")
+    last_prune = last_maintenance("prune_banners")
+    if os.path.isdir(BANNER_DIR) and (last_prune is None or time.time() - last_prune > BANNER_PRUNE_HOURS * 3600):
+        due.append("prune_banners")
+    return due
+
+
+def db_is_idle() -> bool:
+    writer = get_db_writer().stats()
+    if writer["queue_depth"] or time.time() - writer["last_commit_at"] < MAINT_IDLE_SECONDS:
+        return False
+    conn = get_conn()
+    running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+    conn.close()
+    return running == 0
+
+
+def run_maintenance(actions: Optional[List[str]] = None, reason: str = "scheduled") -> Dict:
     """
-    url = st.secrets.get("ZAPIER_WEBHOOK_URL") or st.session_state.get(
-        "zapier_webhook_url", ""
+    Run the given actions (default: whatever is due) and log before/after
+    file sizes and probe-query timings to maintenance_log.
+    """
+    before = db_file_stats()
+    actions = maintenance_due(before) if actions is None else actions
+    if not actions:
+        return {"actions": [], "skipped": True}
+    query_before = probe_query_ms()
+    started = time.perf_counter()
+    done = []
+
+    if "optimize" in actions:
+        # First run has no statistics at all: full ANALYZE; afterwards the
+        # cheaper PRAGMA optimize only re-analyzes what changed.
+        stmt = "PRAGMA optimize" if before["has_stats"] else "ANALYZE"
+        submit_write(lambda conn: conn.execute(stmt).fetchall()).result()
+        done.append("optimize" if before["has_stats"] else "optimize (ANALYZE)")
+
+    if "vacuum" in actions:
+        if before["auto_vacuum"] == "incremental":
+            freed = 0
+            while True:
+                step = submit_exclusive_write(incremental_vacuum_op, MAINT_VACUUM_PAGES_PER_OP).result()
+                freed += step
+                if step < MAINT_VACUUM_PAGES_PER_OP:
+                    break
+            done.append(f"incremental_vacuum ({freed} pages)")
+        else:
+            # One-off: switching an existing file to incremental needs a full
+            # VACUUM. It runs on the writer, so queued writes wait instead of
+            # hitting a lock timeout.
+            submit_exclusive_write(full_vacuum_op).result()
+            done.append("vacuum (enabled incremental)")
+
+    if "prune_banners" in actions:
+        done.append(f"prune_banners ({prune_banner_cache()} files)")
+
+    if "checkpoint" in actions or "vacuum" in actions:
+        busy = submit_exclusive_write(wal_checkpoint_op).result()
+        done.append("wal_checkpoint" + (" (busy)" if busy else ""))
+
+    elapsed = (time.perf_counter() - started) * 1000
+    after = db_file_stats()
+    entry = {
+        "ran_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "reason": reason,
+        "actions": ", ".join(done),
+        "db_bytes_before": before["db_bytes"],
+        "db_bytes_after": after["db_bytes"],
+        "wal_bytes_before": before["wal_bytes"],
+        "wal_bytes_after": after["wal_bytes"],
+        "freelist_before": before["freelist_count"],
+        "freelist_after": after["freelist_count"],
+        "query_ms_before": query_before,
+        "query_ms_after": probe_query_ms(),
+        "ms": elapsed,
+    }
+    submit_write(
+        lambda conn: conn.execute(
+            f"INSERT INTO maintenance_log ({', '.join(entry)}) VALUES ({', '.join('?' for _ in entry)})",
+            list(entry.values()),
+        )
+    ).result()
+    return entry
+
+
+def fetch_maintenance_log(limit: int = 50) -> pd.DataFrame:
+    conn = get_conn()
+    df = pd.read_sql_query(
+        "SELECT * FROM maintenance_log ORDER BY id DESC LIMIT ?", conn, params=(limit,)
     )
-    if not url:
-        return
-    data = {"event": event_name, **payload}
-    try:
-        requests.post(url, json=data, timeout=3)
-    except Exception as e:
-        st.warning(f"Zapier webhook error: {e}")
+    conn.close()
+    return df
+
+
+@st.cache_resource
+def start_maintenance_scheduler() -> Dict:
+    """Background thread (one per process): checks thresholds, runs maintenance when idle."""
+    state = {"last_run": None, "last_error": "", "last_check": None}
+    interval = float(get_secret("MAINT_CHECK_SECONDS", MAINT_CHECK_SECONDS))
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                state["last_check"] = time.strftime("%Y-%m-%d %H:%M:%S")
+                if maintenance_due(db_file_stats()) and db_is_idle():
+                    state["last_run"] = run_maintenance()
+            except Exception as e:
+                state["last_error"] = str(e)
+
+    if interval > 0:
+        threading.Thread(target=loop, name="xxx-maintenance", daemon=True).start()
+    return state
 
 
 # =========================
-# Ad text generator (local)
+# Data version (cache keys)
 # =========================
 
-def generate_ad_from_brief(
-    offer_name: str,
-    offer_type: str,
-    audience: str,
-    promise: str,
-    hook_style: str,
-) -> Dict[str, str]:
+# Tables whose writes invalidate cached reports (rollup cube etc.).
+VERSIONED_TABLES = ["affiliate_programs", "ad_creatives", "ad_performance"]
+# Derived from ad_creatives by triggers (so covered by its data_version bumps).
+REPORT_CHILD_TABLES = ["ad_geos"]
+
+
+def init_data_version(conn):
     """
-    Simple, rule-based generator for short adult-friendly ads.
-    All language is non-explicit and focuses on benefits, privacy, and discretion.
+    Keep a monotonically increasing `data_version` in app_meta, bumped by
+    triggers on every write to the reporting tables. Cheap to read and shared
+    by all connections/processes, so it works as a cache key.
     """
-    if not audience.strip():
-        audience = "adults who want a more exciting private life"
+    cur = conn.cursor()
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS app_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    cur.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('data_version', 0)")
+    for table in VERSIONED_TABLES:
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cur.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_dv_{event.lower()}
+                AFTER {event} ON {table} BEGIN
+                    UPDATE app_meta SET value = value + 1 WHERE key = 'data_version';
+                END
+                """
+            )
 
-    if not promise.strip():
-        promise = "add more fun and excitement without drama"
 
-    if offer_type.lower() in ["toys", "toy", "products"]:
-        category_phrase = "adult products"
-    elif offer_type.lower() in ["cams", "live"]:
-        category_phrase = "live entertainment"
-    elif offer_type.lower() in ["dating", "meets"]:
-        category_phrase = "adults-only connections"
-    else:
-        category_phrase = "adult offers"
+def get_data_version() -> int:
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT value FROM app_meta WHERE key = 'data_version'")
+    row = cur.fetchone()
+    conn.close()
+    return int(row[0]) if row else 0
 
-    if hook_style == "Curiosity":
-        headline = f"This {offer_type.title()} Offer Is Making Adults Smile"
-    elif hook_style == "Discreet / Privacy":
-        headline = "100% Discreet · For Adults Only"
-    elif hook_style == "Limited-Time":
-        headline = f"{offer_type.title()} Deals Ending Soon"
-    elif hook_style == "Audience-Focused":
-        headline = f"New For {audience.capitalize()}"
+
+# =========================
+# Rollup cube (SQL-side)
+# =========================
+
+# Dimension name -> SQL expression. Empty / NULL values roll into "Unknown".
+CUBE_DIMENSIONS = {
+    "program_name": "COALESCE(NULLIF(p.name, ''), 'Unknown')",
+    "traffic_source": "COALESCE(NULLIF(a.traffic_source, ''), 'Unknown')",
+    "angle": "COALESCE(NULLIF(a.angle, ''), 'Unknown')",
+    "placement_type": "COALESCE(NULLIF(a.placement_type, ''), 'Unknown')",
+}
+
+CUBE_METRICS = ["impressions", "clicks", "leads", "sales", "revenue"]
+
+
+def cube_grouping_id(dims: List[str]) -> int:
+    """Bitmask of grouped dimensions, in CUBE_DIMENSIONS order."""
+    names = list(CUBE_DIMENSIONS)
+    return sum(1 << names.index(d) for d in dims)
+
+
+def build_rollup_sql() -> str:
+    """
+    SQLite has no GROUPING SETS / CUBE, so emulate CUBE with one GROUP BY
+    per dimension subset, glued with UNION ALL. Each branch scans the same
+    joined rows; ungrouped dimensions come back as NULL and `grouping_id`
+    tells the branches apart.
+    """
+    names = list(CUBE_DIMENSIONS)
+    branches = []
+    for mask in range(1 << len(names)):
+        select_dims = []
+        group_by = []
+        for i, name in enumerate(names):
+            if mask & (1 << i):
+                select_dims.append(f"{CUBE_DIMENSIONS[name]} AS {name}")
+                group_by.append(CUBE_DIMENSIONS[name])
+            else:
+                select_dims.append(f"NULL AS {name}")
+        metrics = ",\n                ".join(
+            f"COALESCE(SUM(perf.{m}), 0) AS {m}" for m in CUBE_METRICS
+        )
+        branches.append(
+            f"""
+            SELECT
+                {mask} AS grouping_id,
+                {", ".join(select_dims)},
+                COUNT(a.id) AS ads,
+                {metrics}
+            FROM ad_creatives a
+            LEFT JOIN affiliate_programs p ON a.program_id = p.id
+            LEFT JOIN ad_performance perf ON perf.ad_id = a.id
+            {"GROUP BY " + ", ".join(group_by) if group_by else ""}
+            """
+        )
+    return "\nUNION ALL\n".join(branches)
+
+
+def build_rollup_sql_duckdb() -> str:
+    """Same cube as build_rollup_sql, using DuckDB's native GROUP BY CUBE."""
+    names = list(CUBE_DIMENSIONS)
+    dims = ", ".join(f"{expr} AS {name}" for name, expr in CUBE_DIMENSIONS.items())
+    grouping_id = " + ".join(
+        f"(1 - GROUPING({name})) * {1 << i}" for i, name in enumerate(names)
+    )
+    metrics = ", ".join(
+        f"CAST(COALESCE(SUM({m}), 0) AS {'DOUBLE' if m == 'revenue' else 'BIGINT'}) AS {m}"
+        for m in CUBE_METRICS
+    )
+    return f"""
+        WITH base AS (
+            SELECT {dims}, a.id AS ad_id,
+                {", ".join(f"perf.{m}" for m in CUBE_METRICS)}
+            FROM ad_creatives a
+            LEFT JOIN affiliate_programs p ON a.program_id = p.id
+            LEFT JOIN ad_performance perf ON perf.ad_id = a.id
+        )
+        SELECT
+            {grouping_id} AS grouping_id,
+            {", ".join(names)},
+            COUNT(ad_id) AS ads,
+            {metrics}
+        FROM base
+        GROUP BY CUBE ({", ".join(names)})
+        """
+
+
+@metered_cache("rollup_cube", show_spinner=False, max_entries=4)
+def fetch_rollup_cube(data_version: int, engine_name: str = "sqlite") -> pd.DataFrame:
+    """
+    Full cube over program × source × angle × placement. `data_version` is
+    only the cache key: any write bumps it and the next call recomputes.
+    """
+    return run_analytics_query(
+        build_rollup_sql(),
+        duckdb_sql=build_rollup_sql_duckdb(),
+        engine_name=engine_name,
+    )
+
+
+def add_kpi_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Vectorised CTR / CR / EPC (0 when the denominator is 0)."""
+    df = df.copy()
+    impressions = df["impressions"].astype("float64")
+    clicks = df["clicks"].astype("float64")
+    df["CTR_%"] = (clicks / impressions.where(impressions > 0) * 100).fillna(0.0)
+    df["CR_sales_%"] = (df["sales"] / clicks.where(clicks > 0) * 100).fillna(0.0)
+    df["EPC"] = (df["revenue"] / clicks.where(clicks > 0)).fillna(0.0)
+    return df
+
+
+def slice_cube(cube: pd.DataFrame, dims: List[str]) -> pd.DataFrame:
+    """Pick the pre-aggregated rows for exactly this dimension combination."""
+    part = cube[cube["grouping_id"] == cube_grouping_id(dims)]
+    part = part[dims + ["ads"] + CUBE_METRICS]
+    if dims:
+        part = part.sort_values(dims)
+    return add_kpi_columns(part.reset_index(drop=True))
+
+
+def get_rollup(dims: List[str]) -> pd.DataFrame:
+    return slice_cube(fetch_rollup_cube(get_data_version(), active_engine_name()), dims)
+
+
+def campaign_dimension_expr(dim: str) -> str:
+    return daypart_label_sql("a") if dim == "daypart" else f"a.{dim}"
+
+
+def campaign_filter_sql(dim: str) -> str:
+    """WHERE clause for one dimension filter; a GEO matches any ad targeting it."""
+    if dim == "geo":
+        return "EXISTS (SELECT 1 FROM ad_geos g WHERE g.ad_id = a.id AND g.geo = ?)"
+    return f"{campaign_dimension_expr(dim)} = ?"
+
+
+@metered_cache("campaign_breakdown", show_spinner=False, max_entries=32)
+def fetch_campaign_breakdown(
+    data_version: int,
+    dims: Tuple[str, ...],
+    filters: Tuple[Tuple[str, str], ...] = (),
+    engine_name: str = "sqlite",
+) -> pd.DataFrame:
+    """
+    Metrics grouped by parsed campaign dimensions. Filters are equality
+    matches on the indexed dimension columns (GEO: membership in ad_geos),
+    so no LIKE scan over notes.
+    """
+    select = [f"COALESCE({campaign_dimension_expr(d)}, 'Unknown') AS {d}" for d in dims]
+    where = [campaign_filter_sql(d) for d, _ in filters]
+    sql = f"""
+        SELECT
+            {"".join(f"{expr}, " for expr in select)}
+            COUNT(*) AS ads,
+            COALESCE(SUM(perf.impressions), 0) AS impressions,
+            COALESCE(SUM(perf.clicks), 0) AS clicks,
+            COALESCE(SUM(perf.leads), 0) AS leads,
+            COALESCE(SUM(perf.sales), 0) AS sales,
+            COALESCE(SUM(perf.revenue), 0.0) AS revenue
+        FROM ad_creatives a
+        LEFT JOIN ad_performance perf ON perf.ad_id = a.id
+        {"WHERE " + " AND ".join(where) if where else ""}
+        {"GROUP BY " + ", ".join(str(i + 1) for i in range(len(dims))) if dims else ""}
+        {"ORDER BY " + ", ".join(str(i + 1) for i in range(len(dims))) if dims else ""}
+    """
+    df = run_analytics_query(sql, params=[v for _, v in filters], engine_name=engine_name)
+    df[["ads"] + COUNTER_COLUMNS] = df[["ads"] + COUNTER_COLUMNS].astype("int64")
+    return add_kpi_columns(df)
+
+
+@metered_cache("campaign_dimension_values", show_spinner=False, max_entries=4)
+def fetch_campaign_dimension_values(data_version: int) -> Dict[str, List[str]]:
+    conn = get_conn()
+    values = {}
+    for dim in CAMPAIGN_DIMENSIONS:
+        if dim == "geo":
+            # Single codes (what the filter matches), not the multi-GEO labels.
+            rows = conn.execute("SELECT DISTINCT geo FROM ad_geos ORDER BY 1")
+        else:
+            expr = campaign_dimension_expr(dim)
+            rows = conn.execute(f"SELECT DISTINCT {expr} FROM ad_creatives a WHERE {expr} IS NOT NULL ORDER BY 1")
+        values[dim] = [r[0] for r in rows]
+    conn.close()
+    return values
+
+
+# =========================
+# Analytics engines (SQLite / DuckDB)
+# =========================
+
+ANALYTICS_ENGINES = ["auto", "sqlite", "duckdb"]
+
+# SQLite declared type -> DuckDB column type for the synced copy.
+DUCKDB_TYPES = {"INTEGER": "BIGINT", "REAL": "DOUBLE", "TEXT": "VARCHAR"}
+
+
+class SQLiteEngine:
+    name = "sqlite"
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+
+    def query(self, sql: str, params=()) -> pd.DataFrame:
+        conn = get_conn(self.db_path)
+        df = pd.read_sql_query(sql, conn, params=params)
+        conn.close()
+        return df
+
+
+class DuckDBEngine:
+    """
+    Runs reporting queries in DuckDB. Prefers ATTACHing the SQLite file
+    directly (sqlite extension); if the extension can't be loaded (e.g. no
+    network to install it) it keeps a columnar copy of the reporting tables
+    in memory, re-synced whenever the data_version changes. A sync builds
+    the copy in a fresh in-memory database and swaps it in under the lock,
+    so queries already running keep reading the previous copy.
+    """
+
+    name = "duckdb"
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        self.conn = duckdb.connect()
+        self.synced_version = None
+        self.last_sync_ms = 0.0
+        self._lock = threading.Lock()  # guards self.conn (swapped by sync)
+        self._sync_lock = threading.Lock()  # one sync at a time
+        try:
+            try:
+                self.conn.execute("LOAD sqlite")
+            except Exception:
+                self.conn.execute("INSTALL sqlite")
+                self.conn.execute("LOAD sqlite")
+            path = os.path.abspath(db_path).replace("'", "''")
+            self.conn.execute(f"ATTACH '{path}' AS app (TYPE SQLITE, READ_ONLY)")
+            self.mode = "attach"
+        except Exception:
+            self.mode = "sync"
+
+    def sync(self):
+        """Copy the reporting tables into DuckDB if SQLite changed since last sync."""
+        with self._sync_lock:
+            src = get_conn(self.db_path)
+            try:
+                src.execute("BEGIN")  # one read snapshot for all tables
+                row = src.execute("SELECT value FROM app_meta WHERE key = 'data_version'").fetchone()
+                version = int(row[0]) if row else 0
+                if version == self.synced_version:
+                    return
+                started = time.perf_counter()
+                fresh = duckdb.connect()
+                for table in VERSIONED_TABLES + REPORT_CHILD_TABLES:
+                    cols = src.execute(f"PRAGMA table_info({table})").fetchall()
+                    ddl = ", ".join(
+                        f'"{c[1]}" {DUCKDB_TYPES.get(str(c[2]).split()[0].upper(), "VARCHAR")}'
+                        for c in cols
+                    )
+                    df = pd.read_sql_query(f"SELECT * FROM {table}", src)
+                    fresh.execute(f"CREATE TABLE {table} ({ddl})")
+                    fresh.register("sync_src", df)
+                    fresh.execute(f"INSERT INTO {table} SELECT * FROM sync_src")
+                    fresh.unregister("sync_src")
+            finally:
+                src.close()
+            # The old connection is left to the GC: cursors still reading it keep it alive.
+            with self._lock:
+                self.conn = fresh
+                self.synced_version = version
+                self.last_sync_ms = (time.perf_counter() - started) * 1000
+
+    def query(self, sql: str, params=()) -> pd.DataFrame:
+        if self.mode == "sync":
+            self.sync()
+        with self._lock:
+            cur = self.conn.cursor()
+        try:
+            if self.mode == "attach":
+                cur.execute("USE app")
+            return cur.execute(sql, list(params)).df()
+        finally:
+            cur.close()
+
+
+class AnalyticsStats:
+    """Per-engine query counters, updated from every session's thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.engines = {
+            name: {"queries": 0, "failures": 0, "total_ms": 0.0, "last_error": ""}
+            for name in ("sqlite", "duckdb")
+        }
+
+    def observe(self, engine: str, seconds: float):
+        with self._lock:
+            self.engines[engine]["queries"] += 1
+            self.engines[engine]["total_ms"] += seconds * 1000
+        get_metrics().observe("xxx_sql_query_seconds", seconds, engine=engine)
+
+    def failure(self, engine: str, error: Exception):
+        with self._lock:
+            self.engines[engine]["failures"] += 1
+            self.engines[engine]["last_error"] = str(error)
+        get_metrics().inc("xxx_sql_query_failures_total", engine=engine)
+
+    def snapshot(self) -> pd.DataFrame:
+        with self._lock:
+            return pd.DataFrame({name: dict(s) for name, s in self.engines.items()}).T
+
+
+@st.cache_resource
+def get_analytics_stats() -> AnalyticsStats:
+    """Shared across sessions."""
+    return AnalyticsStats()
+
+
+@st.cache_resource
+def get_engine(name: str, db_path: str = DB_PATH):
+    if name == "duckdb":
+        return DuckDBEngine(db_path)
+    return SQLiteEngine(db_path)
+
+
+def active_engine_name() -> str:
+    """
+    Engine for reporting queries. Priority:
+    1) st.session_state["analytics_engine"] (Integrations page)
+    2) st.secrets["ANALYTICS_ENGINE"]
+    "auto" means DuckDB when installed, else SQLite.
+    """
+    choice = st.session_state.get("analytics_engine") or get_secret("ANALYTICS_ENGINE", "auto")
+    if choice in ("auto", "duckdb"):
+        return "duckdb" if duckdb is not None else "sqlite"
+    return "sqlite"
+
+
+def run_analytics_query(
+    sql: str,
+    duckdb_sql: Optional[str] = None,
+    params=(),
+    engine_name: Optional[str] = None,
+) -> pd.DataFrame:
+    """Run a reporting query on the active engine, falling back to SQLite on any error."""
+    engine_name = engine_name or active_engine_name()
+    stats = get_analytics_stats()
+    if engine_name == "duckdb":
+        started = time.perf_counter()
+        try:
+            df = get_engine("duckdb").query(duckdb_sql or sql, params)
+            stats.observe("duckdb", time.perf_counter() - started)
+            return df
+        except Exception as e:
+            stats.failure("duckdb", e)
+    started = time.perf_counter()
+    df = get_engine("sqlite").query(sql, params)
+    stats.observe("sqlite", time.perf_counter() - started)
+    return df
+
+
+def seed_synthetic_data(db_path: str, n_ads: int, n_programs: int = 25, seed: int = 42):
+    """Fill an empty DB (already init_db'd) with random programs, ads and metrics."""
+    rng = random.Random(seed)
+    sources = ["ExoClick", "JuicyAds", "TrafficJunky", "Adsterra", "Other / Mixed", ""]
+    angles = ["Curiosity", "Discreet / Privacy", "Limited-Time", "Audience-Focused"]
+    placements = ["Banner (300x250 / 300x100 / 728x90)", "Native / Widget", "Text Only", "Social-Friendly"]
+    conn = get_conn(db_path)
+    conn.executemany(
+        "INSERT INTO affiliate_programs (name, niche, geo_focus, signup_url, status, notes) "
+        "VALUES (?, 'Other Adult', 'US', 'https://example.com', 'Approved', '')",
+        [(f"Program {i}",) for i in range(n_programs)],
+    )
+    notes = [
+        "US mobile only, SmartCPM $0.15, evenings 6–11pm",
+        "UK + IE desktop, CPC $0.04",
+        "DE, AT, CH all devices, CPM 0.80 USD, 24/7",
+        "Tier 1 mobile, CPA $25, nights",
+        "",
+    ]
+    parsed_notes = {n: parse_campaign_notes(n) for n in notes}
+    dim_cols = list(CAMPAIGN_DIMENSION_COLUMNS)
+
+    def ad_row(i):
+        note = rng.choice(notes)
+        return (
+            rng.randint(1, n_programs),
+            f"Synthetic ad {i}",
+            rng.choice(angles),
+            f"Headline {i} · discreet offers for adults",
+            "Browse trusted adult products with fast, discreet service. " * 3,
+            rng.choice(placements),
+            rng.choice(sources),
+            note,
+            *[parsed_notes[note][c] for c in dim_cols],
+        )
+
+    conn.executemany(
+        f"""
+        INSERT INTO ad_creatives (
+            program_id, title, angle, headline, body,
+            call_to_action, placement_type, traffic_source, campaign_notes,
+            {", ".join(dim_cols)}
+        )
+        VALUES (?, ?, ?, ?, ?, 'Tap to explore today’s offers.', ?, ?, ?, {", ".join("?" for _ in dim_cols)})
+        """,
+        (ad_row(i) for i in range(n_ads)),
+    )
+    perf_rows = []
+    for ad_id in range(1, n_ads + 1):
+        impressions = rng.randint(0, 100_000)
+        clicks = rng.randint(0, max(1, impressions // 20))
+        sales = rng.randint(0, max(1, clicks // 30))
+        perf_rows.append((ad_id, impressions, clicks, rng.randint(0, clicks), sales, sales * 35.0))
+    conn.executemany(
+        "INSERT INTO ad_performance (ad_id, impressions, clicks, leads, sales, revenue) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        perf_rows,
+    )
+    conn.commit()
+    conn.close()
+
+
+def benchmark_analytics_engines(n_ads: int = 50_000, repeats: int = 3) -> pd.DataFrame:
+    """
+    Time the reporting workloads (KPI totals, rollup cube, export frame) on
+    every available engine against the same synthetic DB in a temp dir.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="xxx_bench_")
+    db_path = os.path.join(tmp_dir, "bench.db")
+    try:
+        init_db(db_path)
+        seed_synthetic_data(db_path, n_ads)
+
+        export_sql, _ = build_ads_metrics_sql()
+        workloads = {
+            "KPI totals": (KPI_TOTALS_SQL, KPI_TOTALS_SQL),
+            "Rollup cube": (build_rollup_sql(), build_rollup_sql_duckdb()),
+            "Export frame": (export_sql, export_sql),
+        }
+        engines = [SQLiteEngine(db_path)]
+        if duckdb is not None:
+            engines.append(DuckDBEngine(db_path))
+
+        results = []
+        for engine in engines:
+            if engine.name == "duckdb":
+                started = time.perf_counter()
+                engine.query("SELECT 1")  # attach / first sync
+                results.append(
+                    {
+                        "engine": f"duckdb ({engine.mode})",
+                        "workload": "setup (attach / sync)",
+                        "median_ms": (time.perf_counter() - started) * 1000,
+                        "rows": n_ads,
+                    }
+                )
+            for workload, (sqlite_sql, duck_sql) in workloads.items():
+                timings = []
+                rows = 0
+                for _ in range(repeats):
+                    started = time.perf_counter()
+                    df = engine.query(duck_sql if engine.name == "duckdb" else sqlite_sql)
+                    timings.append((time.perf_counter() - started) * 1000)
+                    rows = len(df)
+                label = engine.name if engine.name == "sqlite" else f"duckdb ({engine.mode})"
+                results.append(
+                    {
+                        "engine": label,
+                        "workload": workload,
+                        "median_ms": statistics.median(timings),
+                        "rows": rows,
+                    }
+                )
+        return pd.DataFrame(results)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+# =========================
+# Session-state helpers
+# =========================
+
+if "auth_ok" not in st.session_state:
+    st.session_state["auth_ok"] = False
+
+if "zapier_webhook_url" not in st.session_state:
+    st.session_state["zapier_webhook_url"] = ""
+
+
+# =========================
+# UI Helpers
+# =========================
+
+def render_header():
+    st.markdown(
+        """
+        <div class="xxx-header">
+            <div class="xxx-logo">🔥</div>
+            <div class="xxx-title">THE XXX AD POSTER</div>
+            <div class="xxx-subtitle">
+                Manage affiliate programs, track performance & build clean ad creatives for adult offers.
+            </div>
+        </div>
+        """,
+        unsafe_allow_html=True,
+    )
+    st.markdown("---")
+
+
+def render_footer():
+    st.markdown(
+        """
+        <div class="xxx-footer">
+            © 2025 THE XXX AD POSTER · Built with Python + Streamlit.<br/>
+            No passwords or sensitive data should be stored here – use it as a planning toolkit.
+        </div>
+        """,
+        unsafe_allow_html=True,
+    )
+
+
+# =========================
+# Auth
+# =========================
+
+def login_page():
+    render_header()
+    st.markdown('<div class="login-card">', unsafe_allow_html=True)
+    st.markdown('<div class="login-title">🔒 Creator Login</div>', unsafe_allow_html=True)
+
+    username = st.text_input("Username", placeholder="admin")
+    password = st.text_input("Password", type="password")
+
+    if st.button("Log In"):
+        admin_user = st.secrets.get("ADMIN_USERNAME", "admin")
+        admin_pw = st.secrets.get("ADMIN_PASSWORD", "xxx-poster")
+
+        if username == admin_user and password == admin_pw:
+            st.session_state["auth_ok"] = True
+            st.success("Access granted. Loading THE XXX AD POSTER…")
+            safe_rerun()
+        else:
+            st.error("Invalid credentials.")
+
+    st.markdown("</div>", unsafe_allow_html=True)
+    render_footer()
+
+
+# =========================
+# Zapier helper
+# =========================
+
+def trigger_zap(event_name: str, payload: Dict):
+    """
+    Send a JSON payload to a Zapier Catch Hook.
+
+    Priority:
+    1) st.secrets["ZAPIER_WEBHOOK_URL"]
+    2) st.session_state["zapier_webhook_url"]
+    """
+    url = get_secret("ZAPIER_WEBHOOK_URL") or st.session_state.get(
+        "zapier_webhook_url", ""
+    )
+    metrics = get_metrics()
+    if not url:
+        metrics.inc("xxx_webhook_deliveries_total", event=event_name, result="skipped")
+        return
+    data = {"event": event_name, **payload}
+    started = time.perf_counter()
+    try:
+        resp = requests.post(url, json=data, timeout=3)
+        result = "ok" if resp.ok else f"http_{resp.status_code // 100}xx"
+    except Exception as e:
+        result = "exception"
+        ui_warning(f"Zapier webhook error: {e}")
+    metrics.observe("xxx_webhook_seconds", time.perf_counter() - started, event=event_name)
+    metrics.inc("xxx_webhook_deliveries_total", event=event_name, result=result)
+
+
+# =========================
+# Ad text generator (local)
+# =========================
+
+def generate_ad_from_brief(
+    offer_name: str,
+    offer_type: str,
+    audience: str,
+    promise: str,
+    hook_style: str,
+) -> Dict[str, str]:
+    """
+    Simple, rule-based generator for short adult-friendly ads.
+    All language is non-explicit and focuses on benefits, privacy, and discretion.
+    """
+    if not audience.strip():
+        audience = "adults who want a more exciting private life"
+
+    if not promise.strip():
+        promise = "add more fun and excitement without drama"
+
+    if offer_type.lower() in ["toys", "toy", "products"]:
+        category_phrase = "adult products"
+    elif offer_type.lower() in ["cams", "live"]:
+        category_phrase = "live entertainment"
+    elif offer_type.lower() in ["dating", "meets"]:
+        category_phrase = "adults-only connections"
+    else:
+        category_phrase = "adult offers"
+
+    if hook_style == "Curiosity":
+        headline = f"This {offer_type.title()} Offer Is Making Adults Smile"
+    elif hook_style == "Discreet / Privacy":
+        headline = "100% Discreet · For Adults Only"
+    elif hook_style == "Limited-Time":
+        headline = f"{offer_type.title()} Deals Ending Soon"
+    elif hook_style == "Audience-Focused":
+        headline = f"New For {audience.capitalize()}"
+    else:
+        headline = f"Explore Trusted {category_phrase.title()}"
+
+    body_lines = [
+        f"{offer_name} is for {audience} who want to {promise}.",
+        f"Browse trusted {category_phrase} with fast, discreet service.",
+        "No pressure, no drama — just adults choosing what works for them.",
+    ]
+    body = " ".join(body_lines)
+
+    cta = "Tap to explore today’s offers."
+
+    return {
+        "headline": headline,
+        "body": textwrap.fill(body, width=70),
+        "cta": cta,
+    }
+
+
+# =========================
+# Compliance linter (Aho-Corasick)
+# =========================
+
+# Starter lists – edit them on the Compliance page to match each network's
+# current ad policy. Network "*" applies to every traffic source.
+COMPLIANCE_DEFAULT_TERMS = [
+    ("*", "teen", "block"),
+    ("*", "underage", "block"),
+    ("*", "schoolgirl", "block"),
+    ("*", "young girl", "block"),
+    ("*", "incest", "block"),
+    ("*", "rape", "block"),
+    ("*", "forced", "block"),
+    ("*", "drugged", "block"),
+    ("*", "bestiality", "block"),
+    ("*", "escort", "warn"),
+    ("ExoClick", "virus detected", "block"),
+    ("ExoClick", "your phone is infected", "block"),
+    ("TrafficJunky", "virus detected", "block"),
+    ("TrafficJunky", "click here", "warn"),
+    ("JuicyAds", "virus detected", "block"),
+    ("JuicyAds", "battery damaged", "block"),
+]
+COMPLIANCE_DEFAULT_PATTERNS = [
+    ("*", r"\bguaranteed?\b", "Unsubstantiated guarantee", "warn"),
+    ("*", r"\b100\s*%\s*(free|guaranteed|real|results)\b", "Absolute claim", "warn"),
+    ("*", r"\b(enlarge(ment)?|cures?|miracle)\b", "Medical / miracle claim", "block"),
+    ("*", r"\b(lose|burn)\s+\d+\s*(lbs?|pounds|kg)\b", "Weight-loss claim", "block"),
+    ("*", r"\bfree\s+money\b", "Financial claim", "block"),
+]
+# Max characters per field and placement (over-length copy gets cut or rejected).
+PLACEMENT_LENGTH_LIMITS = {
+    "Banner (300x250 / 300x100 / 728x90)": {"headline": 40, "body": 120, "call_to_action": 25},
+    "Native / Widget": {"headline": 60, "body": 180, "call_to_action": 30},
+    "Text Only": {"headline": 50, "body": 240, "call_to_action": 30},
+    "Social-Friendly": {"headline": 80, "body": 280, "call_to_action": 40},
+}
+COMPLIANCE_FIELDS = ("headline", "body", "call_to_action")
+COMPLIANCE_SEVERITIES = ["block", "warn"]
+COMPLIANCE_RESCAN_BATCH = 2_000
+
+# A term still matches with one of these endings ("teens", "escorted").
+_COMPLIANCE_SUFFIX_RE = re.compile(r"(?:ing|es|ed|s|d)?(?![^\W_])")
+
+# Leetspeak folding (same length, so match offsets stay valid).
+_COMPLIANCE_FOLD = str.maketrans("0134578@$", "oieastbas")
+
+
+def fold_text(text: str) -> str:
+    return (text or "").lower().translate(_COMPLIANCE_FOLD)
+
+
+class AhoCorasick:
+    """Multi-pattern matcher: one pass over a text finds every term in it."""
+
+    def __init__(self, terms: List[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[int]] = [[]]
+        self.lengths = [len(t) for t in terms]
+        for idx, term in enumerate(terms):
+            node = 0
+            for ch in term:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            self.out[node].append(idx)
+        # Breadth-first: a node's fail link is the longest proper suffix that is also a prefix.
+        queue_ = deque(self.goto[0].values())
+        while queue_:
+            node = queue_.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue_.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0) if node else 0
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find(self, text: str) -> Iterator[Tuple[int, int]]:
+        """Yield (start, term index) for every occurrence, overlaps included."""
+        goto, fail, out, lengths = self.goto, self.fail, self.out, self.lengths
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for idx in out[node]:
+                yield i - lengths[idx] + 1, idx
+
+
+class ComplianceLinter:
+    """Compiled term automaton + claim regexes + length limits for one list version."""
+
+    def __init__(self, terms: List[Tuple[str, str, str]], patterns: List[Tuple[str, str, str, str]]):
+        by_term: Dict[str, Dict[str, str]] = {}
+        for network, term, severity in terms:
+            folded = fold_text(term.strip())
+            if folded:
+                by_term.setdefault(folded, {})[network.strip().lower() or "*"] = severity
+        self.terms = list(by_term)
+        self.term_networks = [by_term[t] for t in self.terms]
+        self.automaton = AhoCorasick(self.terms)
+        self.patterns = []
+        for network, pattern, message, severity in patterns:
+            try:
+                rx = re.compile(pattern, re.I)
+            except re.error:
+                continue
+            self.patterns.append((network.strip().lower() or "*", rx, message, severity))
+
+    def check(self, ad: Dict) -> List[Dict]:
+        network = (ad.get("traffic_source") or "").strip().lower()
+        issues = []
+        for field in COMPLIANCE_FIELDS:
+            text = ad.get(field) or ""
+            folded = fold_text(text)
+            seen = set()
+            for start, idx in self.automaton.find(folded):
+                # Whole words plus inflections ("class" must not hit "ass").
+                tail = _COMPLIANCE_SUFFIX_RE.match(folded, start + len(self.terms[idx]))
+                if (start > 0 and folded[start - 1].isalnum()) or not tail:
+                    continue
+                end = tail.end()
+                nets = self.term_networks[idx]
+                severity = nets.get(network) or nets.get("*")
+                if severity and idx not in seen:
+                    seen.add(idx)
+                    issues.append(
+                        {
+                            "field": field,
+                            "kind": "term",
+                            "severity": severity,
+                            "match": text[start:end],
+                            "message": f"Banned term '{self.terms[idx]}'",
+                        }
+                    )
+            for net, rx, message, severity in self.patterns:
+                if net not in ("*", network):
+                    continue
+                m = rx.search(text)
+                if m:
+                    issues.append(
+                        {"field": field, "kind": "claim", "severity": severity, "match": m.group(0), "message": message}
+                    )
+            limit = PLACEMENT_LENGTH_LIMITS.get(ad.get("placement_type") or "", {}).get(field)
+            if limit and len(text) > limit:
+                issues.append(
+                    {
+                        "field": field,
+                        "kind": "length",
+                        "severity": "warn",
+                        "match": "",
+                        "message": f"{len(text)} chars, limit {limit} for this placement",
+                    }
+                )
+        return issues
+
+
+def compliance_status(issues: List[Dict]) -> str:
+    if any(i["severity"] == "block" for i in issues):
+        return "fail"
+    return "warn" if issues else "pass"
+
+
+def init_compliance_tables(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS compliance_terms (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            network TEXT NOT NULL DEFAULT '*',
+            term TEXT NOT NULL,
+            severity TEXT NOT NULL DEFAULT 'block'
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS compliance_patterns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            network TEXT NOT NULL DEFAULT '*',
+            pattern TEXT NOT NULL,
+            message TEXT,
+            severity TEXT NOT NULL DEFAULT 'warn'
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ad_compliance (
+            ad_id INTEGER PRIMARY KEY,
+            status TEXT NOT NULL,
+            issues TEXT,
+            list_version INTEGER,
+            checked_at TEXT
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ad_compliance_status ON ad_compliance (status)")
+    if conn.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('compliance_version', 0)").rowcount:
+        conn.executemany(
+            "INSERT INTO compliance_terms (network, term, severity) VALUES (?, ?, ?)", COMPLIANCE_DEFAULT_TERMS
+        )
+        conn.executemany(
+            "INSERT INTO compliance_patterns (network, pattern, message, severity) VALUES (?, ?, ?, ?)",
+            COMPLIANCE_DEFAULT_PATTERNS,
+        )
+    for table in ("compliance_terms", "compliance_patterns"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_cv_{event.lower()}
+                AFTER {event} ON {table} BEGIN
+                    UPDATE app_meta SET value = value + 1 WHERE key = 'compliance_version';
+                END
+                """
+            )
+
+
+class ComplianceCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.linter: Optional[ComplianceLinter] = None
+
+
+@st.cache_resource
+def get_compliance_cache() -> ComplianceCache:
+    return ComplianceCache()
+
+
+def current_linter(conn=None) -> Tuple[ComplianceLinter, int]:
+    """(linter, list version) – recompiled only when the lists changed."""
+    own = conn is None
+    conn = conn or get_conn()
+    try:
+        row = conn.execute("SELECT value FROM app_meta WHERE key = 'compliance_version'").fetchone()
+        version = row[0] if row else 0
+        cache = get_compliance_cache()
+        with cache.lock:
+            if cache.linter is None or cache.version != version:
+                terms = conn.execute("SELECT network, term, severity FROM compliance_terms").fetchall()
+                patterns = conn.execute(
+                    "SELECT network, pattern, COALESCE(message, ''), severity FROM compliance_patterns"
+                ).fetchall()
+                cache.linter = ComplianceLinter([tuple(r) for r in terms], [tuple(r) for r in patterns])
+                cache.version = version
+            return cache.linter, version
+    finally:
+        if own:
+            conn.close()
+
+
+def lint_creative(ad: Dict) -> List[Dict]:
+    return current_linter()[0].check(ad)
+
+
+def upsert_compliance_op(conn, rows: List[Tuple[int, str, str, int, str]]) -> int:
+    conn.executemany(
+        """
+        INSERT INTO ad_compliance (ad_id, status, issues, list_version, checked_at) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(ad_id) DO UPDATE SET
+            status = excluded.status, issues = excluded.issues,
+            list_version = excluded.list_version, checked_at = excluded.checked_at
+        """,
+        rows,
+    )
+    return len(rows)
+
+
+def record_compliance_op(conn, ad_id: int, ad: Dict) -> List[Dict]:
+    """Lint one creative inside the caller's write transaction (used by insert_ad_op)."""
+    linter, version = current_linter(conn)
+    issues = linter.check(ad)
+    upsert_compliance_op(
+        conn,
+        [(ad_id, compliance_status(issues), json.dumps(issues), version, time.strftime("%Y-%m-%d %H:%M:%S"))],
+    )
+    return issues
+
+
+def replace_compliance_lists_op(conn, terms: List[Tuple[str, str, str]], patterns: List[Tuple[str, str, str, str]]):
+    conn.execute("DELETE FROM compliance_terms")
+    conn.executemany("INSERT INTO compliance_terms (network, term, severity) VALUES (?, ?, ?)", terms)
+    conn.execute("DELETE FROM compliance_patterns")
+    conn.executemany(
+        "INSERT INTO compliance_patterns (network, pattern, message, severity) VALUES (?, ?, ?, ?)", patterns
+    )
+
+
+def rescan_compliance(progress: Optional[Callable[[float, str], None]] = None) -> Dict:
+    """
+    Re-lint every creative in ad_creatives against the current lists.
+    Identical copy (templates, variants) is linted once per scan.
+    """
+    started = time.perf_counter()
+    linter, version = current_linter()
+    conn = get_conn()
+    total = conn.execute("SELECT COUNT(*) FROM ad_creatives").fetchone()[0]
+    cur = conn.execute(
+        "SELECT id, headline, body, call_to_action, placement_type, traffic_source FROM ad_creatives"
+    )
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    memo: Dict[Tuple, Tuple[str, str]] = {}
+    counts = {"pass": 0, "warn": 0, "fail": 0}
+    done = 0
+    while True:
+        rows = cur.fetchmany(COMPLIANCE_RESCAN_BATCH)
+        if not rows:
+            break
+        batch = []
+        for r in rows:
+            key = tuple(r[1:])
+            hit = memo.get(key)
+            if hit is None:
+                issues = linter.check(dict(r))
+                hit = memo[key] = (compliance_status(issues), json.dumps(issues))
+            counts[hit[0]] += 1
+            batch.append((r["id"], hit[0], hit[1], version, now))
+        submit_write(upsert_compliance_op, batch).result()
+        done += len(rows)
+        if progress:
+            progress(done / max(1, total), f"{done} of {total} creatives")
+    conn.close()
+    submit_write(
+        lambda c: c.execute("DELETE FROM ad_compliance WHERE ad_id NOT IN (SELECT id FROM ad_creatives)")
+    ).result()
+    return {"ads": done, "unique_texts": len(memo), "ms": round((time.perf_counter() - started) * 1000, 1), **counts}
+
+
+def fetch_compliance(ad_id: int) -> Optional[Dict]:
+    conn = get_conn()
+    row = conn.execute("SELECT * FROM ad_compliance WHERE ad_id = ?", (ad_id,)).fetchone()
+    conn.close()
+    if row is None:
+        return None
+    return {**dict(row), "issues": json.loads(row["issues"] or "[]")}
+
+
+def show_compliance_issues(issues: List[Dict]):
+    """st.error / st.warning lines for lint results (nothing when clean)."""
+    for i in issues:
+        line = f"**{i['field']}** – {i['message']}" + (f": “{i['match']}”" if i["match"] else "")
+        (st.error if i["severity"] == "block" else st.warning)(line)
+
+
+# =========================
+# Banner renderer (Pillow)
+# =========================
+
+BANNER_DIR = "banners"  # content-addressed asset cache: <dir>/<key[:2]>/<key>.<ext>
+# Bump when the layout / styling changes so every cached banner is re-rendered.
+BANNER_RENDER_VERSION = 2
+# Assets no render row references are deleted by maintenance once this old
+# (the age keeps a render that is still being recorded safe).
+BANNER_PRUNE_HOURS = 24
+BANNER_WORKERS = min(4, os.cpu_count() or 1)
+BANNER_FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans-Bold.ttf",
+    "/Library/Fonts/Arial Bold.ttf",
+    "C:/Windows/Fonts/arialbd.ttf",
+]
+# The drawing itself (sizes, layouts, fit_text, render_banner_bytes) lives in
+# banner_render.py so worker processes can import it without Streamlit.
+
+# Default sizes offered for each placement type.
+PLACEMENT_BANNER_SIZES = {
+    "Banner (300x250 / 300x100 / 728x90)": ["300x250", "300x100", "728x90"],
+    "Native / Widget": ["300x250"],
+    "Social-Friendly": ["300x250"],
+}
+
+
+@functools.lru_cache(maxsize=1)
+def banner_font_path() -> Optional[str]:
+    configured = get_secret("BANNER_FONT")
+    for path in ([configured] if configured else []) + BANNER_FONT_CANDIDATES:
+        if os.path.exists(path):
+            return path
+    return None  # Pillow's bundled default font
+
+
+def banner_key(ad: Dict, size: str, fmt: str) -> str:
+    """Content hash of everything that changes the pixels (not the ad id)."""
+    payload = json.dumps(
+        [BANNER_RENDER_VERSION, ad.get("headline") or "", ad.get("body") or "", ad.get("call_to_action") or "",
+         size, fmt, banner_font_path()],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def banner_path(key: str, fmt: str, banner_dir: str = BANNER_DIR) -> str:
+    return os.path.join(banner_dir, key[:2], f"{key}.{BANNER_FORMATS[fmt]}")
+
+
+@st.cache_resource
+def get_banner_pool(workers: int):
+    """
+    One render pool per process. Workers start via forkserver/spawn, never
+    fork: forking this multithreaded process (DB writer, job workers, the
+    Streamlit server) can leave a child stuck on a lock another thread held.
+    Tasks only reference banner_render; children do re-import the script as
+    __mp_main__ (multiprocessing's rule), whose UI is behind the __main__ guard.
+    """
+    if workers <= 1:
+        return ThreadPoolExecutor(1)
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    return ProcessPoolExecutor(workers, mp_context=ctx)
+
+
+def init_banner_table(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS banner_renders (
+            ad_id INTEGER NOT NULL,
+            size TEXT NOT NULL,
+            format TEXT NOT NULL,
+            asset_key TEXT NOT NULL,
+            render_ms REAL,
+            cached INTEGER NOT NULL DEFAULT 0,
+            rendered_at TEXT,
+            PRIMARY KEY (ad_id, size, format)
+        )
+        """
+    )
+
+
+def record_banner_renders_op(conn, rows: List[Tuple]):
+    conn.executemany(
+        """
+        INSERT INTO banner_renders (ad_id, size, format, asset_key, render_ms, cached, rendered_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(ad_id, size, format) DO UPDATE SET
+            render_ms = CASE
+                WHEN excluded.cached AND banner_renders.asset_key = excluded.asset_key THEN banner_renders.render_ms
+                ELSE excluded.render_ms
+            END,
+            asset_key = excluded.asset_key, cached = excluded.cached, rendered_at = excluded.rendered_at
+        """,
+        rows,
+    )
+
+
+def render_banners(
+    ads: List[Dict],
+    sizes: List[str],
+    fmt: str = "PNG",
+    workers: Optional[int] = None,
+    progress: Optional[Callable[[float, str], None]] = None,
+) -> List[Dict]:
+    """
+    Render every (ad, size) banner. Assets already in the cache (same content
+    hash) are reused as-is; the rest are rendered across a process pool.
+    """
+    workers = workers or int(get_secret("BANNER_WORKERS", BANNER_WORKERS))
+    results, todo = [], {}
+    for ad in map(dict, ads):
+        for size in sizes:
+            key = banner_key(ad, size, fmt)
+            path = banner_path(key, fmt)
+            cached = os.path.exists(path)
+            results.append(
+                {"ad_id": ad["id"], "size": size, "format": fmt, "key": key, "path": path, "ms": 0.0, "cached": cached}
+            )
+            if not cached and path not in todo:
+                todo[path] = (
+                    path, ad.get("headline") or "", ad.get("body") or "", ad.get("call_to_action") or "",
+                    size, fmt, banner_font_path(),
+                )
+
+    render_ms: Dict[str, float] = {}
+    if todo:
+        metrics = get_metrics()
+        pool = get_banner_pool(workers)
+        try:
+            pending = [pool.submit(render_banner_task, task) for task in todo.values()]
+            for done, fut in enumerate(as_completed(pending), 1):
+                path, ms = fut.result()
+                render_ms[path] = ms
+                metrics.observe("xxx_banner_render_seconds", ms / 1000, size=todo[path][4])
+                if progress:
+                    progress(done / len(pending), f"{done} of {len(pending)} banners rendered")
+        except BrokenExecutor:
+            get_banner_pool.clear()  # a worker died: the next call gets a fresh pool
+            raise
+    for r in results:
+        r["ms"] = round(render_ms.get(r["path"], 0.0), 1)
+
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    submit_write(
+        record_banner_renders_op,
+        [(r["ad_id"], r["size"], fmt, r["key"], None if r["cached"] else r["ms"], int(r["cached"]), now) for r in results],
+    ).result()
+    return results
+
+
+def banners_zip(results: List[Dict]) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:  # PNG / WebP are already compressed
+        for r in results:
+            if os.path.exists(r["path"]):
+                zf.write(r["path"], f"ad{r['ad_id']}_{r['size']}.{BANNER_FORMATS[r['format']]}")
+    return buf.getvalue()
+
+
+def prune_banner_cache(banner_dir: str = BANNER_DIR, min_age_hours: float = BANNER_PRUNE_HOURS) -> int:
+    """Delete cached assets no ad references any more; returns files removed."""
+    conn = get_conn()
+    live = {row[0] for row in conn.execute("SELECT DISTINCT asset_key FROM banner_renders")}
+    conn.close()
+    cutoff = time.time() - min_age_hours * 3600
+    removed = 0
+    for root, _, files in os.walk(banner_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            if name.split(".")[0] not in live and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+# =========================
+# Bulk export (network upload formats)
+# =========================
+
+EXPORT_DIR = "exports"  # files built by bulk_export jobs (purged with the jobs)
+EXPORT_BATCH = 1_000
+# st.download_button holds a file in the server's memory while it is offered,
+# so the page only builds exports up to this many ads (bigger ones: the job)…
+EXPORT_INLINE_MAX_ADS = 20_000
+# …and hands over job files up to this size (bigger ones stay on disk).
+DOWNLOAD_INLINE_MAX_BYTES = 200 * 1024 * 1024
+# Ad columns the bulk exporter can filter on (value lists, ANDed together).
+EXPORT_FILTERS = ["traffic_source", "status", "placement_type", "program_id"]
+# Bulk-upload CSV layouts: header -> ad field or callable. Mirrors each
+# network's current bulk template – adjust here when a template changes.
+NETWORK_EXPORT_LAYOUTS: Dict[str, List[Tuple[str, object]]] = {
+    "ExoClick": [
+        ("Ad Name", "title"),
+        ("Title", "headline"),
+        ("Description", "body"),
+        ("Brand Name", "program_name"),
+        ("Destination URL", "signup_url"),
+        ("Tracking ID", lambda ad: f"ad{ad['id']}"),
+    ],
+    "TrafficJunky": [
+        ("Creative Name", "title"),
+        ("Headline", "headline"),
+        ("Description", "body"),
+        ("Call To Action", "call_to_action"),
+        ("Click URL", "signup_url"),
+        ("Custom ID", lambda ad: f"ad{ad['id']}"),
+    ],
+    "JuicyAds": [
+        ("Ad Name", "title"),
+        ("Ad Title", "headline"),
+        ("Ad Description", "body"),
+        ("Destination URL", "signup_url"),
+        ("Sub ID", lambda ad: f"ad{ad['id']}"),
+    ],
+}
+BULK_EXPORT_FORMATS = {
+    **{f"{network} CSV": ("csv", network) for network in NETWORK_EXPORT_LAYOUTS},
+    "Text blocks (ZIP)": ("zip", None),
+}
+
+
+def ad_text_block(ad) -> str:
+    """Copy-ready text block for one creative (Export / Copy page format)."""
+    return textwrap.dedent(
+        f"""
+        [{ad['program_name']}] – {ad['title']}
+
+        TRAFFIC / CAMPAIGN:
+        Source: {ad['traffic_source'] or 'N/A'}
+        Notes: {ad['campaign_notes'] or 'n/a'}
+
+        HEADLINE:
+        {ad['headline']}
+
+        BODY:
+        {ad['body']}
+
+        CTA:
+        {ad['call_to_action']}
+        """
+    ).strip()
+
+
+def bulk_export_where(filters: Optional[Dict[str, List]]) -> Tuple[str, List]:
+    clauses, params = [], []
+    for col, values in (filters or {}).items():
+        if col in EXPORT_FILTERS and values:
+            clauses.append(f"a.{col} IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(list(values)))
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def count_export_ads(filters: Optional[Dict[str, List]] = None) -> int:
+    where, params = bulk_export_where(filters)
+    conn = get_conn()
+    n = conn.execute(f"SELECT COUNT(*) FROM ad_creatives a{where}", params).fetchone()[0]
+    conn.close()
+    return n
+
+
+def iter_export_ads(filters: Optional[Dict[str, List]] = None, batch: int = EXPORT_BATCH) -> Iterator[sqlite3.Row]:
+    """Creatives (+ program name / URL) in id order, fetched `batch` rows at a time."""
+    where, params = bulk_export_where(filters)
+    conn = get_conn()
+    try:
+        cur = conn.execute(
+            f"""
+            SELECT a.*, p.name AS program_name, p.signup_url
+            FROM ad_creatives a
+            LEFT JOIN affiliate_programs p ON a.program_id = p.id
+            {where}
+            ORDER BY a.id
+            """,
+            params,
+        )
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+
+def write_network_csv(f, network: str, ads: Iterator) -> Iterator[int]:
+    """Write one CSV row per ad to the text file `f`; yields the running count."""
+    layout = NETWORK_EXPORT_LAYOUTS[network]
+    writer = csv.writer(f)
+    writer.writerow([header for header, _ in layout])
+    for n, ad in enumerate(ads, 1):
+        writer.writerow([src(ad) if callable(src) else (ad[src] or "") for _, src in layout])
+        yield n
+
+
+def write_text_blocks_zip(f, ads: Iterator) -> Iterator[int]:
+    """One ad<id>.txt text block per ad into a ZIP on the binary file `f`."""
+    with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as zf:
+        for n, ad in enumerate(ads, 1):
+            zf.writestr(f"ad{ad['id']}.txt", ad_text_block(ad))
+            yield n
+
+
+def run_bulk_export(
+    fmt: str,
+    f,
+    filters: Optional[Dict[str, List]] = None,
+    progress: Optional[Callable[[float, str], None]] = None,
+) -> int:
+    """Stream the matching creatives into `f` (text for CSV, binary for ZIP); returns rows written."""
+    kind, network = BULK_EXPORT_FORMATS[fmt]
+    total = count_export_ads(filters) if progress else 0
+    ads = iter_export_ads(filters)
+    counter = write_network_csv(f, network, ads) if kind == "csv" else write_text_blocks_zip(f, ads)
+    n = 0
+    for n in counter:
+        if progress and n % EXPORT_BATCH == 0:
+            progress(n / max(1, total), f"{n} of {total} creatives")
+    return n
+
+
+def bulk_export_filename(fmt: str) -> str:
+    kind, network = BULK_EXPORT_FORMATS[fmt]
+    stamp = time.strftime("%Y%m%d_%H%M")
+    return f"xxx_{network.lower()}_bulk_{stamp}.csv" if kind == "csv" else f"xxx_ad_text_blocks_{stamp}.zip"
+
+
+def bulk_export_bytes(fmt: str, filters: Optional[Dict[str, List]] = None) -> bytes:
+    """
+    Build an export through a temp file (spills to disk past 8 MB) for a
+    deferred st.download_button: runs on click, off the script thread.
+    """
+    kind, _ = BULK_EXPORT_FORMATS[fmt]
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as tmp:
+        if kind == "csv":
+            text = io.TextIOWrapper(tmp, encoding="utf-8", newline="")
+            run_bulk_export(fmt, text, filters)
+            text.flush()
+            text.detach()
+        else:
+            run_bulk_export(fmt, tmp, filters)
+        tmp.seek(0)
+        return tmp.read()
+
+
+def read_file_bytes(path: str) -> bytes:
+    """Deferred download_button data for a file on disk (closes the handle)."""
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def prune_export_files(older_than: float, export_dir: str = EXPORT_DIR) -> int:
+    removed = 0
+    if os.path.isdir(export_dir):
+        for name in os.listdir(export_dir):
+            path = os.path.join(export_dir, name)
+            if os.path.getmtime(path) < older_than:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+# =========================
+# AI providers
+# =========================
+
+# Default limits are conservative tier-1 values; override per provider in
+# secrets, e.g. OPENAI_RPM = 3000 / OPENAI_TPM = 1000000. Base URLs can be
+# overridden the same way (OPENAI_BASE_URL, ...) to point at a proxy or a
+# local stand-in server.
+AI_PROVIDERS = {
+    "OpenAI": {
+        "secret": "OPENAI_API_KEY",
+        "limit_prefix": "OPENAI",
+        "base_url": "https://api.openai.com",
+        "model": "gpt-4.1-mini",
+        "max_tokens": 400,
+        "timeout": 15,
+        "rpm": 500,
+        "tpm": 200_000,
+    },
+    "Claude (Anthropic)": {
+        "secret": "ANTHROPIC_API_KEY",
+        "limit_prefix": "ANTHROPIC",
+        "base_url": "https://api.anthropic.com",
+        "model": "claude-3-haiku-20240307",
+        "max_tokens": 400,
+        "timeout": 20,
+        "rpm": 50,
+        "tpm": 50_000,
+    },
+    "Gemini": {
+        "secret": "GEMINI_API_KEY",
+        "limit_prefix": "GEMINI",
+        "base_url": "https://generativelanguage.googleapis.com",
+        "model": "gemini-1.5-flash",
+        "max_tokens": 400,
+        "timeout": 20,
+        "rpm": 15,
+        "tpm": 1_000_000,
+    },
+}
+
+# Retries after a 429 (waiting out Retry-After) before giving up.
+AI_MAX_RETRIES = 3
+
+# Longest a call may wait in the rate-limit queue.
+AI_QUEUE_TIMEOUT = 120.0
+
+
+class AIRateLimited(Exception):
+    """Provider answered 429; `retry_after` is in seconds."""
+
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f"{provider} rate limited (retry after {retry_after:.1f}s)")
+        self.retry_after = retry_after
+
+
+def build_ad_brief(offer_name, offer_type, audience, promise, hook_style) -> str:
+    return f'''
+You are an experienced adult affiliate copywriter. Write a short, non-explicit ad
+for an adult offer. Focus on benefits, privacy, and discretion. NO explicit words.
+
+Offer name: {offer_name}
+Offer type: {offer_type}
+Audience: {audience}
+Main promise: {promise}
+Hook style: {hook_style}
+
+Return ONLY valid JSON with keys: headline, body, cta.
+'''.strip()
+
+
+def build_variants_brief(offer_name, offer_type, audience, promise, hook_styles: List[str]) -> str:
+    """One prompt for N variants; the offer details are sent once."""
+    variant_lines = "\n".join(
+        f"{i}. Hook style: {hs}" for i, hs in enumerate(hook_styles, start=1)
+    )
+    return f'''
+You are an experienced adult affiliate copywriter. Write {len(hook_styles)} short, non-explicit
+ad variants for an adult offer. Focus on benefits, privacy, and discretion. NO explicit words.
+Each variant must use its own hook style and read clearly different from the others.
+
+Offer name: {offer_name}
+Offer type: {offer_type}
+Audience: {audience}
+Main promise: {promise}
+
+Variants:
+{variant_lines}
+
+Return ONLY a valid JSON array with exactly {len(hook_styles)} objects, in the order above,
+each with keys: hook_style, headline, body, cta.
+'''.strip()
+
+
+def ai_base_url(provider: str) -> str:
+    spec = AI_PROVIDERS[provider]
+    return str(get_secret(f"{spec['limit_prefix']}_BASE_URL", spec["base_url"])).rstrip("/")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 chars/token) for budgeting before the call."""
+    return max(1, len(text) // 4)
+
+
+def raise_if_rate_limited(provider: str, resp):
+    if resp.status_code == 429:
+        try:
+            retry_after = float(resp.headers.get("retry-after", 0) or 0)
+        except ValueError:
+            retry_after = 0.0
+        raise AIRateLimited(provider, retry_after or 5.0)
+    resp.raise_for_status()
+
+
+def call_ai_provider(
+    provider: str,
+    api_key: str,
+    prompt: str,
+    max_tokens: Optional[int] = None,
+) -> Tuple[str, int]:
+    """One blocking request -> (response text, total tokens used or 0 if unknown)."""
+    spec = AI_PROVIDERS[provider]
+    max_tokens = max_tokens or spec["max_tokens"]
+
+    if provider == "OpenAI":
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        }
+        payload = {
+            "model": spec["model"],
+            "messages": [
+                {"role": "system", "content": "You write short, clean ad copy."},
+                {"role": "user", "content": prompt},
+            ],
+            "temperature": 0.7,
+            "max_tokens": max_tokens,
+        }
+        resp = requests.post(
+            f"{ai_base_url(provider)}/v1/chat/completions",
+            headers=headers,
+            json=payload,
+            timeout=spec["timeout"],
+        )
+        raise_if_rate_limited(provider, resp)
+        data = resp.json()
+        content = data["choices"][0]["message"]["content"]
+        return content, int(data.get("usage", {}).get("total_tokens", 0))
+
+    if provider == "Claude (Anthropic)":
+        headers = {
+            "x-api-key": api_key,
+            "anthropic-version": "2023-06-01",
+            "content-type": "application/json",
+        }
+        payload = {
+            "model": spec["model"],
+            "max_tokens": max_tokens,
+            "messages": [
+                {"role": "user", "content": prompt},
+            ],
+        }
+        resp = requests.post(
+            f"{ai_base_url(provider)}/v1/messages",
+            headers=headers,
+            json=payload,
+            timeout=spec["timeout"],
+        )
+        raise_if_rate_limited(provider, resp)
+        data = resp.json()
+        text_blocks = [
+            block.get("text", "")
+            for block in data.get("content", [])
+            if block.get("type") == "text"
+        ]
+        usage = data.get("usage", {})
+        return "".join(text_blocks), int(usage.get("input_tokens", 0)) + int(
+            usage.get("output_tokens", 0)
+        )
+
+    if provider == "Gemini":
+        url = f"{ai_base_url(provider)}/v1beta/models/{spec['model']}:generateContent"
+        params = {"key": api_key}
+        payload = {
+            "contents": [
+                {
+                    "parts": [
+                        {"text": prompt}
+                    ]
+                }
+            ],
+            "generationConfig": {"maxOutputTokens": max_tokens},
+        }
+        resp = requests.post(url, params=params, json=payload, timeout=spec["timeout"])
+        raise_if_rate_limited(provider, resp)
+        data = resp.json()
+        text = (
+            data.get("candidates", [{}])[0]
+            .get("content", {})
+            .get("parts", [{}])[0]
+            .get("text", "")
+        )
+        return text, int(data.get("usageMetadata", {}).get("totalTokenCount", 0))
+
+    raise ValueError(f"Unknown AI provider: {provider}")
+
+
+# =========================
+# AI streaming (SSE)
+# =========================
+
+AD_JSON_FIELDS = ("headline", "body", "cta")
+
+
+def iter_sse_data(resp) -> Iterator[str]:
+    """`data:` payloads of a server-sent-events response, until [DONE]."""
+    resp.encoding = "utf-8"
+    for line in resp.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        yield data
+
+
+def stream_ai_provider(provider: str, api_key: str, prompt: str) -> Iterator[str]:
+    """Like call_ai_provider, but yields text deltas as they arrive."""
+    spec = AI_PROVIDERS[provider]
+
+    if provider == "OpenAI":
+        resp = requests.post(
+            f"{ai_base_url(provider)}/v1/chat/completions",
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+            },
+            json={
+                "model": spec["model"],
+                "messages": [
+                    {"role": "system", "content": "You write short, clean ad copy."},
+                    {"role": "user", "content": prompt},
+                ],
+                "temperature": 0.7,
+                "max_tokens": spec["max_tokens"],
+                "stream": True,
+            },
+            timeout=spec["timeout"],
+            stream=True,
+        )
+        raise_if_rate_limited(provider, resp)
+        with resp:
+            for data in iter_sse_data(resp):
+                for choice in json.loads(data).get("choices", []):
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        yield delta
+
+    elif provider == "Claude (Anthropic)":
+        resp = requests.post(
+            f"{ai_base_url(provider)}/v1/messages",
+            headers={
+                "x-api-key": api_key,
+                "anthropic-version": "2023-06-01",
+                "content-type": "application/json",
+            },
+            json={
+                "model": spec["model"],
+                "max_tokens": spec["max_tokens"],
+                "messages": [{"role": "user", "content": prompt}],
+                "stream": True,
+            },
+            timeout=spec["timeout"],
+            stream=True,
+        )
+        raise_if_rate_limited(provider, resp)
+        with resp:
+            for data in iter_sse_data(resp):
+                event = json.loads(data)
+                if event.get("type") == "content_block_delta":
+                    text = (event.get("delta") or {}).get("text")
+                    if text:
+                        yield text
+                elif event.get("type") == "error":
+                    raise RuntimeError(event.get("error", {}).get("message", "stream error"))
+
+    elif provider == "Gemini":
+        resp = requests.post(
+            f"{ai_base_url(provider)}/v1beta/models/{spec['model']}:streamGenerateContent",
+            params={"key": api_key, "alt": "sse"},
+            json={
+                "contents": [{"parts": [{"text": prompt}]}],
+                "generationConfig": {"maxOutputTokens": spec["max_tokens"]},
+            },
+            timeout=spec["timeout"],
+            stream=True,
+        )
+        raise_if_rate_limited(provider, resp)
+        with resp:
+            for data in iter_sse_data(resp):
+                for candidate in json.loads(data).get("candidates", []):
+                    for part in candidate.get("content", {}).get("parts", []):
+                        if part.get("text"):
+                            yield part["text"]
+
+    else:
+        raise ValueError(f"Unknown AI provider: {provider}")
+
+
+_PARTIAL_KEY_RE = re.compile(r'"(%s)"\s*:\s*"' % "|".join(AD_JSON_FIELDS))
+# A \uXXXX high surrogate waits for its pair so the two decode together.
+_HIGH_SURROGATE_TAIL_RE = re.compile(r"\\u[dD][89abAB][0-9a-fA-F]{2}$")
+
+
+class PartialAdParser:
+    """
+    Best-effort read of headline/body/cta from a JSON object that is still
+    being streamed. feed() only looks at the new delta (plus a few carried
+    characters), so a whole stream costs O(length) rather than re-parsing
+    the buffer on every delta. An open string value reads up to the end of
+    what has arrived so far.
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self.key: Optional[str] = None  # field whose string value is open
+        self.pending = ""  # unconsumed text: a split key or escape
+
+    def feed(self, delta: str) -> Dict[str, str]:
+        text, self.pending = self.pending + delta, ""
+        i = 0
+        while i < len(text):
+            if self.key is None:
+                m = _PARTIAL_KEY_RE.search(text, i)
+                if not m:
+                    # Keep a tail long enough to hold a key split across deltas.
+                    self.pending = text[max(i, len(text) - 32):]
+                    break
+                if m.group(1) in self.fields:  # first occurrence wins
+                    i = m.end()
+                    continue
+                self.key, i = m.group(1), m.end()
+                self.fields[self.key] = ""
+            j, raw = i, []
+            while j < len(text):
+                c = text[j]
+                if c == "\\":
+                    # Keep escapes whole; carry one that is cut off mid-stream.
+                    size = 6 if text[j + 1:j + 2] == "u" else 2
+                    if j + size > len(text):
+                        break
+                    raw.append(text[j:j + size])
+                    j += size
+                    continue
+                if c == '"':
+                    break
+                raw.append(c)
+                j += 1
+            piece = "".join(raw)
+            if j == len(text) or text[j] != '"':
+                self.pending = text[j:]
+                m = _HIGH_SURROGATE_TAIL_RE.search(piece)
+                if m:
+                    piece, self.pending = piece[:m.start()], piece[m.start():] + self.pending
+            try:
+                self.fields[self.key] += json.loads(f'"{piece}"', strict=False)
+            except ValueError:
+                self.fields[self.key] += piece
+            if j < len(text) and text[j] == '"':
+                self.key, i = None, j + 1
+            else:
+                break
+        return self.fields
+
+
+def extract_json_text(text: str) -> str:
+    """Strip ```json fences / chatter around the first JSON object or array."""
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        return text
+    start = min(starts)
+    end = text.rfind("}" if text[start] == "{" else "]")
+    return text[start:end + 1] if end > start else text[start:]
+
+
+# =========================
+# AI rate limiting
+# =========================
+
+class TokenBucket:
+    """Classic token bucket; `tokens` may go negative after a usage correction."""
+
+    def __init__(self, capacity: float, per_second: float):
+        self.capacity = capacity
+        self.per_second = per_second
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_second)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if now)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.per_second
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+    def drain(self, seconds: float):
+        """Empty the bucket so the next single token is `seconds` away."""
+        self._refill()
+        self.tokens = min(self.tokens, 1 - seconds * self.per_second)
+
+
+class ProviderScheduler:
+    """
+    Requests/min + tokens/min buckets for one provider/model, with a fair
+    queue: waiting calls are served round-robin across sessions, so one
+    session's bulk run can't starve everybody else.
+    """
+
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm, rpm / 60.0)
+        self.tokens = TokenBucket(tpm, tpm / 60.0)
+        self.cond = threading.Condition()
+        self.waiting: Dict[str, deque] = {}
+        self.turns: deque = deque()  # session round-robin order
+        self.stats = {
+            "granted": 0,
+            "throttled": 0,
+            "timeouts": 0,
+            "wait_total_s": 0.0,
+            "wait_max_s": 0.0,
+            "recent_waits": deque(maxlen=500),
+        }
+
+    def _head(self):
+        if not self.turns:
+            return None
+        return self.waiting[self.turns[0]][0]
+
+    def _remove(self, session_id: str, ticket):
+        q = self.waiting[session_id]
+        was_head = self._head() is ticket
+        q.remove(ticket)
+        if not q:
+            del self.waiting[session_id]
+            self.turns.remove(session_id)
+        elif was_head:
+            # Session served: it goes to the back of the line.
+            self.turns.rotate(-1)
+
+    def acquire(self, session_id: str, est_tokens: int, timeout: float = AI_QUEUE_TIMEOUT) -> float:
+        """Block until allowed to send; returns seconds spent waiting."""
+        ticket = object()
+        started = time.monotonic()
+        deadline = started + timeout
+        with self.cond:
+            if session_id not in self.waiting:
+                self.waiting[session_id] = deque()
+                self.turns.append(session_id)
+            self.waiting[session_id].append(ticket)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove(session_id, ticket)
+                    self.stats["timeouts"] += 1
+                    self.cond.notify_all()
+                    raise TimeoutError("Timed out waiting for AI rate limit")
+                if self._head() is ticket:
+                    wait = max(self.requests.wait_time(1), self.tokens.wait_time(est_tokens))
+                    if wait <= 0:
+                        self.requests.take(1)
+                        self.tokens.take(est_tokens)
+                        self._remove(session_id, ticket)
+                        self.cond.notify_all()
+                        waited = time.monotonic() - started
+                        self.stats["granted"] += 1
+                        self.stats["wait_total_s"] += waited
+                        self.stats["wait_max_s"] = max(self.stats["wait_max_s"], waited)
+                        self.stats["recent_waits"].append(waited)
+                        return waited
+                    self.cond.wait(min(wait, remaining))
+                else:
+                    self.cond.wait(remaining)
+
+    def correct_tokens(self, delta: int):
+        """Charge (or refund) the difference between estimated and actual usage."""
+        with self.cond:
+            self.tokens.take(delta)
+            self.cond.notify_all()
+
+    def throttled(self, retry_after: float):
+        with self.cond:
+            self.stats["throttled"] += 1
+            self.requests.drain(retry_after)
+            self.cond.notify_all()
+
+    def snapshot(self) -> Dict:
+        with self.cond:
+            waits = sorted(self.stats["recent_waits"])
+            queued = sum(len(q) for q in self.waiting.values())
+            out = {k: v for k, v in self.stats.items() if k != "recent_waits"}
+        out["queued"] = queued
+        out["wait_p50_s"] = waits[len(waits) // 2] if waits else 0.0
+        out["wait_p95_s"] = waits[int(len(waits) * 0.95)] if waits else 0.0
+        out["wait_avg_s"] = out["wait_total_s"] / out["granted"] if out["granted"] else 0.0
+        return out
+
+
+class AIRateLimiter:
+    """Process-wide registry of schedulers, one per (provider, model)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.schedulers: Dict[Tuple[str, str], ProviderScheduler] = {}
+
+    def get(self, provider: str) -> ProviderScheduler:
+        spec = AI_PROVIDERS[provider]
+        key = (provider, spec["model"])
+        with self._lock:
+            if key not in self.schedulers:
+                rpm = float(get_secret(f"{spec['limit_prefix']}_RPM", spec["rpm"]))
+                tpm = float(get_secret(f"{spec['limit_prefix']}_TPM", spec["tpm"]))
+                self.schedulers[key] = ProviderScheduler(rpm, tpm)
+            return self.schedulers[key]
+
+    def snapshot(self) -> pd.DataFrame:
+        with self._lock:
+            items = list(self.schedulers.items())
+        return pd.DataFrame(
+            [{"provider": p, "model": m, **sched.snapshot()} for (p, m), sched in items]
+        )
+
+
+@st.cache_resource
+def get_ai_rate_limiter() -> AIRateLimiter:
+    return AIRateLimiter()
+
+
+# Set by the job runner for the job it is running: the submitting session and
+# the warnings raised on its behalf (there is no page to show them on).
+_job_context = threading.local()
+
+
+def in_script_thread() -> bool:
+    """True on a Streamlit script thread (st.* calls render), False in workers."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+        return get_script_run_ctx(suppress_warning=True) is not None
+    except Exception:
+        return False
+
+
+def current_session_id() -> str:
+    """
+    Stable id for fair queuing: the browser session, or for a background job
+    the session that submitted it. Other threads use their name.
+    """
+    job_session = getattr(_job_context, "session_id", None)
+    if job_session:
+        return job_session
+    if not in_script_thread():
+        return threading.current_thread().name
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = uuid.uuid4().hex
+    return st.session_state["session_id"]
+
+
+def ui_warning(message: str):
+    """st.warning on a page; inside a job the warning goes to the job's message."""
+    if in_script_thread():
+        st.warning(message)
+    elif hasattr(_job_context, "warnings"):
+        _job_context.warnings.append(message)
+
+
+def rate_limited_call(
+    provider: str,
+    api_key: str,
+    prompt: str,
+    session_id: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+) -> str:
+    """call_ai_provider behind the provider's token buckets, waiting out 429s."""
+    spec = AI_PROVIDERS[provider]
+    scheduler = get_ai_rate_limiter().get(provider)
+    session_id = session_id or current_session_id()
+    max_tokens = max_tokens or spec["max_tokens"]
+    est = estimate_tokens(prompt) + max_tokens
+    latency = get_ai_latency_stats()
+    breaker = get_ai_breakers().get(provider)
+    breaker.check()
+    for attempt in range(AI_MAX_RETRIES + 1):
+        scheduler.acquire(session_id, est)
+        started = time.perf_counter()
+        try:
+            text, used = call_ai_provider(provider, api_key, prompt, max_tokens)
+        except AIRateLimited as e:
+            latency.error(provider)
+            scheduler.throttled(e.retry_after)
+            if attempt == AI_MAX_RETRIES:
+                raise
+            continue
+        except Exception:
+            latency.error(provider)
+            breaker.record_failure()
+            raise
+        latency.observe(provider, time.perf_counter() - started)
+        breaker.record_success()
+        if used:
+            scheduler.correct_tokens(used - est)
+        return text
+    raise RuntimeError("unreachable")
+
+
+def rate_limited_stream(
+    provider: str,
+    api_key: str,
+    prompt: str,
+    session_id: Optional[str] = None,
+) -> Iterator[str]:
+    """stream_ai_provider behind the token buckets; 429s are retried before the first token."""
+    spec = AI_PROVIDERS[provider]
+    scheduler = get_ai_rate_limiter().get(provider)
+    session_id = session_id or current_session_id()
+    est = estimate_tokens(prompt) + spec["max_tokens"]
+    latency = get_ai_latency_stats()
+    breaker = get_ai_breakers().get(provider)
+    breaker.check()
+    for attempt in range(AI_MAX_RETRIES + 1):
+        scheduler.acquire(session_id, est)
+        started = time.perf_counter()
+        stream = stream_ai_provider(provider, api_key, prompt)
+        try:
+            first = next(stream, None)
+        except AIRateLimited as e:
+            latency.error(provider)
+            scheduler.throttled(e.retry_after)
+            if attempt == AI_MAX_RETRIES:
+                raise
+            continue
+        except Exception:
+            latency.error(provider)
+            breaker.record_failure()
+            raise
+        out_chars = 0
+        if first is not None:
+            out_chars += len(first)
+            yield first
+            try:
+                for delta in stream:
+                    out_chars += len(delta)
+                    yield delta
+            except Exception:
+                latency.error(provider)
+                breaker.record_failure()
+                raise
+        latency.observe(provider, time.perf_counter() - started)
+        breaker.record_success()
+        scheduler.correct_tokens(estimate_tokens(prompt) + out_chars // 4 - est)
+        return
+
+
+# =========================
+# AI latency & hedged requests
+# =========================
+
+# Upper bounds (seconds) of the latency histogram buckets.
+AI_LATENCY_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, float("inf"))
+
+# Hedge delay = this quantile of the primary's recent latencies…
+AI_HEDGE_QUANTILE = 0.5
+# …or this when there is no history yet (override with AI_HEDGE_DELAY_S).
+AI_HEDGE_DEFAULT_DELAY = 2.0
+AI_HEDGE_MIN_DELAY = 0.25
+
+
+class LatencyHistogram:
+    """Cumulative bucket counts plus a window of recent samples for quantiles."""
+
+    def __init__(self, buckets=AI_LATENCY_BUCKETS, window: int = 200):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self.recent: deque = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.recent:
+            return None
+        samples = sorted(self.recent)
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+class AILatencyStats:
+    """Per-provider latency histograms and hedging counters (process-wide)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.providers: Dict[str, LatencyHistogram] = {}
+        self.hedge = {"hedged_calls": 0, "hedges_fired": 0, "primary_won": 0, "hedge_won": 0}
+
+    def _hist(self, provider: str) -> LatencyHistogram:
+        if provider not in self.providers:
+            self.providers[provider] = LatencyHistogram()
+        return self.providers[provider]
+
+    def observe(self, provider: str, seconds: float):
+        with self._lock:
+            self._hist(provider).observe(seconds)
+        get_metrics().observe("xxx_ai_request_seconds", seconds, provider=provider)
+
+    def error(self, provider: str):
+        with self._lock:
+            self._hist(provider).errors += 1
+        get_metrics().inc("xxx_ai_errors_total", provider=provider)
+
+    def quantile(self, provider: str, q: float) -> Optional[float]:
+        with self._lock:
+            return self._hist(provider).quantile(q)
+
+    def count_hedge(self, key: str):
+        with self._lock:
+            self.hedge[key] += 1
+
+    def snapshot(self) -> pd.DataFrame:
+        with self._lock:
+            rows = []
+            for provider, h in self.providers.items():
+                row = {
+                    "provider": provider,
+                    "calls": h.count,
+                    "errors": h.errors,
+                    "avg_s": h.sum / h.count if h.count else 0.0,
+                    "p50_s": h.quantile(0.5),
+                    "p95_s": h.quantile(0.95),
+                }
+                for bound, n in zip(h.buckets, h.counts):
+                    row["≤inf" if bound == float("inf") else f"≤{bound:g}s"] = n
+                rows.append(row)
+        return pd.DataFrame(rows)
+
+
+@st.cache_resource
+def get_ai_latency_stats() -> AILatencyStats:
+    return AILatencyStats()
+
+
+@st.cache_resource
+def get_hedge_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=16, thread_name_prefix="xxx-ai-hedge")
+
+
+def hedge_delay(provider: str) -> float:
+    override = get_secret("AI_HEDGE_DELAY_S")
+    if override:
+        return float(override)
+    q = get_ai_latency_stats().quantile(provider, AI_HEDGE_QUANTILE)
+    if q is None:
+        return AI_HEDGE_DEFAULT_DELAY
+    return max(AI_HEDGE_MIN_DELAY, q)
+
+
+def parse_ad_object(content: str) -> Dict:
+    """JSON validation for a single-ad response (raises unless we got an ad object)."""
+    parsed = json.loads(extract_json_text(content))
+    if not isinstance(parsed, dict) or not parsed.get("headline"):
+        raise ValueError("response is not a JSON ad object")
+    return parsed
+
+
+def ai_call_parsed(
+    provider: str,
+    api_key: str,
+    prompt: str,
+    session_id: str,
+    max_tokens: Optional[int] = None,
+    parse: Callable[[str], Any] = parse_ad_object,
+) -> Any:
+    """rate_limited_call + `parse` (which raises on an unusable response)."""
+    return parse(rate_limited_call(provider, api_key, prompt, session_id, max_tokens))
+
+
+def hedged_ai_call(
+    primary: str,
+    primary_key: str,
+    secondary: str,
+    secondary_key: str,
+    prompt: str,
+    session_id: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    parse: Callable[[str], Any] = parse_ad_object,
+) -> Tuple[Any, str]:
+    """
+    "Fastest wins": ask `primary`; if it hasn't produced a valid result within
+    hedge_delay(primary) (or failed), also ask `secondary`. Returns the first
+    valid result and the provider that produced it. The loser is abandoned –
+    its result is discarded when it arrives.
+    """
+    session_id = session_id or current_session_id()
+    stats = get_ai_latency_stats()
+    stats.count_hedge("hedged_calls")
+    pool = get_hedge_executor()
+    call = functools.partial(ai_call_parsed, session_id=session_id, max_tokens=max_tokens, parse=parse)
+    pending = {pool.submit(call, primary, primary_key, prompt): primary}
+    done, _ = wait(pending, timeout=hedge_delay(primary))
+    hedged = False
+    errors = []
+    while True:
+        for fut in done:
+            provider = pending.pop(fut)
+            try:
+                result = fut.result()
+            except Exception as e:
+                errors.append(e)
+                continue
+            for other in pending:
+                other.cancel()
+            stats.count_hedge("primary_won" if provider == primary else "hedge_won")
+            return result, provider
+        if not hedged:
+            hedged = True
+            stats.count_hedge("hedges_fired")
+            pending[pool.submit(call, secondary, secondary_key, prompt)] = secondary
+        if not pending:
+            if all(isinstance(e, AICircuitOpen) for e in errors):
+                raise errors[0]
+            raise RuntimeError("; ".join(str(e) for e in errors))
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+
+# =========================
+# AI circuit breakers
+# =========================
+
+# Consecutive failures (timeouts, 5xx, bad keys…) before a provider is cut off.
+AI_BREAKER_FAILURES = 3
+# Seconds an open breaker waits before letting one probe call through.
+AI_BREAKER_RESET_S = 60.0
+
+
+class AICircuitOpen(Exception):
+    """Raised instead of calling a provider whose breaker is open."""
+
+    def __init__(self, provider: str, retry_in: float):
+        super().__init__(f"{provider} circuit open, retry in {retry_in:.0f}s")
+        self.provider = provider
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    closed → (N consecutive failures) → open → (reset timeout) → half-open.
+    Half-open lets a single probe through: success closes the breaker,
+    failure opens it again. 429s are not failures (the rate limiter owns those).
+    """
+
+    def __init__(self, provider: str, failures: int = AI_BREAKER_FAILURES, reset_s: float = AI_BREAKER_RESET_S):
+        self.provider = provider
+        self.max_failures = failures
+        self.reset_s = reset_s
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self.trips = 0
+        self.short_circuits = 0
+        self.last_error_at: Optional[float] = None
+
+    def _retry_in(self, now: float) -> float:
+        return max(0.0, self.opened_at + self.reset_s - now)
+
+    def is_open(self) -> bool:
+        """True when a call right now would be short-circuited (no side effects)."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "open":
+                return self._retry_in(now) > 0
+            if self.state == "half-open":
+                return now - self.probe_started < self.reset_s
+            return False
+
+    def check(self):
+        """Admit a call or raise AICircuitOpen; moves open → half-open for the probe."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "closed":
+                return
+            if self.state == "open" and self._retry_in(now) > 0:
+                self.short_circuits += 1
+                raise AICircuitOpen(self.provider, self._retry_in(now))
+            if self.state == "half-open" and now - self.probe_started < self.reset_s:
+                # A probe is already in flight.
+                self.short_circuits += 1
+                raise AICircuitOpen(self.provider, self.reset_s - (now - self.probe_started))
+            self.state = "half-open"
+            self.probe_started = now
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+            self.failures += 1
+            self.last_error_at = time.time()
+            if self.state == "half-open" or self.failures >= self.max_failures:
+                if self.state != "open":
+                    self.trips += 1
+                self.state = "open"
+                self.opened_at = now
+
+    def reset(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+
+class AIBreakers:
+    """One CircuitBreaker per provider, shared by every session in the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, provider: str) -> CircuitBreaker:
+        with self._lock:
+            if provider not in self._breakers:
+                failures = get_secret(f"{AI_PROVIDERS[provider]['limit_prefix']}_BREAKER_FAILURES")
+                reset_s = get_secret(f"{AI_PROVIDERS[provider]['limit_prefix']}_BREAKER_RESET_S")
+                self._breakers[provider] = CircuitBreaker(
+                    provider,
+                    failures=int(failures or AI_BREAKER_FAILURES),
+                    reset_s=float(reset_s or AI_BREAKER_RESET_S),
+                )
+            return self._breakers[provider]
+
+    def snapshot(self) -> pd.DataFrame:
+        now = time.monotonic()
+        rows = []
+        for provider in AI_PROVIDERS:
+            b = self.get(provider)
+            with b._lock:
+                rows.append(
+                    {
+                        "provider": provider,
+                        "state": b.state,
+                        "consecutive_failures": b.failures,
+                        "retry_in_s": round(b._retry_in(now), 1) if b.state == "open" else 0.0,
+                        "trips": b.trips,
+                        "short_circuits": b.short_circuits,
+                        "last_error": (
+                            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(b.last_error_at))
+                            if b.last_error_at
+                            else ""
+                        ),
+                    }
+                )
+        return pd.DataFrame(rows)
+
+
+@st.cache_resource
+def get_ai_breakers() -> AIBreakers:
+    return AIBreakers()
+
+
+# =========================
+# AI-powered generator
+# =========================
+
+def generate_ad_with_ai(
+    provider: str,
+    offer_name: str,
+    offer_type: str,
+    audience: str,
+    promise: str,
+    hook_style: str,
+    on_partial: Optional[Callable[[Dict[str, str], float], None]] = None,
+    hedge_provider: Optional[str] = None,
+) -> Dict[str, str]:
+    """
+    Use OpenAI / Claude / Gemini if keys are configured.
+    Falls back to local generator if anything fails.
+
+    With `on_partial`, the response is streamed and the callback gets the
+    fields parsed so far plus the time-to-first-token (seconds) per delta.
+    With `hedge_provider` (and its key configured), the call is hedged
+    against that provider instead (no streaming).
+    """
+    base = generate_ad_from_brief(offer_name, offer_type, audience, promise, hook_style)
+
+    spec = AI_PROVIDERS.get(provider)
+    if spec is None:
+        return base
+
+    brief = build_ad_brief(offer_name, offer_type, audience, promise, hook_style)
+
+    try:
+        api_key = get_secret(spec["secret"])
+        if not api_key:
+            get_metrics().inc("xxx_ai_fallbacks_total", provider=provider, reason="no_key")
+            return base
+        hedge_spec = AI_PROVIDERS.get(hedge_provider) if hedge_provider != provider else None
+        hedge_key = get_secret(hedge_spec["secret"]) if hedge_spec else None
+        if hedge_key:
+            parsed, _ = hedged_ai_call(provider, api_key, hedge_provider, hedge_key, brief)
+            return {
+                "headline": parsed.get("headline", base["headline"]),
+                "body": parsed.get("body", base["body"]),
+                "cta": parsed.get("cta", base["cta"]),
+            }
+        if on_partial is None:
+            content = rate_limited_call(provider, api_key, brief)
+        else:
+            started = time.perf_counter()
+            ttft = None
+            chunks = []
+            partial = PartialAdParser()
+            for delta in rate_limited_stream(provider, api_key, brief):
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                chunks.append(delta)
+                on_partial(dict(partial.feed(delta)), ttft)
+            content = "".join(chunks)
+        parsed = json.loads(extract_json_text(content))
+        return {
+            "headline": parsed.get("headline", base["headline"]),
+            "body": parsed.get("body", base["body"]),
+            "cta": parsed.get("cta", base["cta"]),
+        }
+    except AICircuitOpen:
+        get_metrics().inc("xxx_ai_fallbacks_total", provider=provider, reason="circuit_open")
+        return base
+    except Exception as e:
+        get_metrics().inc("xxx_ai_fallbacks_total", provider=provider, reason="error")
+        ui_warning(f"AI generation failed ({provider}): {e}")
+        return base
+
+
+def parse_ad_variants(content: str, expected: int) -> List[Optional[Dict[str, str]]]:
+    """
+    Split a JSON-array response into `expected` slots. A slot is None when
+    the item is missing or lacks a non-empty headline/body.
+    """
+    try:
+        parsed = json.loads(extract_json_text(content))
+    except ValueError:
+        return [None] * expected
+    if isinstance(parsed, dict):
+        parsed = parsed.get("variants", [parsed])
+    if not isinstance(parsed, list):
+        return [None] * expected
+
+    slots: List[Optional[Dict[str, str]]] = []
+    for i in range(expected):
+        item = parsed[i] if i < len(parsed) else None
+        if (
+            isinstance(item, dict)
+            and isinstance(item.get("headline"), str)
+            and item["headline"].strip()
+            and isinstance(item.get("body"), str)
+            and item["body"].strip()
+        ):
+            slots.append(
+                {
+                    "headline": item["headline"].strip(),
+                    "body": item["body"].strip(),
+                    "cta": item["cta"].strip() if isinstance(item.get("cta"), str) else "",
+                }
+            )
+        else:
+            slots.append(None)
+    return slots
+
+
+def parse_variant_slots(content: str, expected: int) -> List[Optional[Dict[str, str]]]:
+    """parse_ad_variants for a hedged call: raises when no slot is usable."""
+    slots = parse_ad_variants(content, expected)
+    if not any(slots):
+        raise ValueError("response has no valid variants")
+    return slots
+
+
+def generate_ad_variants_with_ai(
+    provider: str,
+    offer_name: str,
+    offer_type: str,
+    audience: str,
+    promise: str,
+    hook_styles: List[str],
+    hedge_provider: Optional[str] = None,
+) -> List[Dict[str, str]]:
+    """
+    N variants from a single AI request (JSON array). Missing or invalid
+    slots are filled from the built-in generator; each variant carries a
+    `source` key ("ai" or "built-in"). With `hedge_provider` the one request
+    is hedged like generate_ad_with_ai's.
+    """
+    bases = [
+        {**generate_ad_from_brief(offer_name, offer_type, audience, promise, hs), "source": "built-in"}
+        for hs in hook_styles
+    ]
+    spec = AI_PROVIDERS.get(provider)
+    if spec is None or not hook_styles:
+        return bases
+
+    brief = build_variants_brief(offer_name, offer_type, audience, promise, hook_styles)
+    try:
+        api_key = get_secret(spec["secret"])
+        if not api_key:
+            get_metrics().inc("xxx_ai_fallbacks_total", len(bases), provider=provider, reason="no_key")
+            return bases
+        max_tokens = spec["max_tokens"] * len(hook_styles)
+        hedge_spec = AI_PROVIDERS.get(hedge_provider) if hedge_provider != provider else None
+        hedge_key = get_secret(hedge_spec["secret"]) if hedge_spec else None
+        if hedge_key:
+            slots, provider = hedged_ai_call(
+                provider, api_key, hedge_provider, hedge_key, brief,
+                max_tokens=max_tokens,
+                parse=lambda content: parse_variant_slots(content, len(hook_styles)),
+            )
+        else:
+            content = rate_limited_call(provider, api_key, brief, max_tokens=max_tokens)
+            slots = parse_ad_variants(content, len(hook_styles))
+    except AICircuitOpen:
+        get_metrics().inc("xxx_ai_fallbacks_total", len(bases), provider=provider, reason="circuit_open")
+        return bases
+    except Exception as e:
+        get_metrics().inc("xxx_ai_fallbacks_total", len(bases), provider=provider, reason="error")
+        ui_warning(f"AI generation failed ({provider}): {e}")
+        return bases
+
+    variants = []
+    for base, slot in zip(bases, slots):
+        if slot is None:
+            get_metrics().inc("xxx_ai_fallbacks_total", provider=provider, reason="invalid_slot")
+            variants.append(base)
+        else:
+            variants.append({**slot, "cta": slot["cta"] or base["cta"], "source": "ai"})
+    return variants
+
+
+# =========================
+# Headline CTR scorer (local model)
+# =========================
+
+# Hashed n-gram features -> weighted logistic regression on clicks / impressions.
+CTR_HASH_BITS = 18
+CTR_MIN_IMPRESSIONS = 500  # ads with less traffic are too noisy to learn from
+CTR_MIN_TRAIN_ADS = 30
+CTR_HOLDOUT_EVERY = 5  # ad_id % 5 == 0 is never trained on, only evaluated
+CTR_L2 = 1e-4
+CTR_LEARNING_RATE = 0.3
+CTR_FULL_EPOCHS = 150
+CTR_WARM_EPOCHS = 25
+# Automatic (warm-start) refits are queued at most this often when metrics change.
+CTR_REFIT_SECONDS = 60
+
+_CTR_WORD_RE = re.compile(r"[a-z0-9$%']+")
+
+
+def ctr_tokens(headline: str, cta: str = "", traffic_source: str = "", placement_type: str = "") -> List[str]:
+    """Word 1-2 grams + char 4-grams of the headline, CTA words and the traffic context."""
+    words = _CTR_WORD_RE.findall((headline or "").lower())
+    tokens = [f"w:{w}" for w in words] + [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+    padded = f" {' '.join(words)} "
+    tokens += [f"c:{padded[i:i + 4]}" for i in range(len(padded) - 3)]
+    tokens += [f"cta:{w}" for w in _CTR_WORD_RE.findall((cta or "").lower())]
+    tokens += [f"src:{traffic_source or ''}", f"pl:{placement_type or ''}", f"len:{min(len(words), 12)}"]
+    return tokens
+
+
+def hash_tokens(tokens: List[str], bits: int = CTR_HASH_BITS) -> Tuple[np.ndarray, np.ndarray]:
+    """crc32 feature hashing (stable across processes, unlike hash()) -> (indices, values)."""
+    mask = (1 << bits) - 1
+    idx = np.fromiter((zlib.crc32(t.encode("utf-8")) & mask for t in tokens), dtype=np.int64, count=len(tokens))
+    idx, counts = np.unique(idx, return_counts=True)
+    return idx, counts / np.sqrt(max(1, len(tokens)))
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+class CTRScorer:
+    """
+    Per-process CTR model. Features are cached per ad (keyed by its text), so
+    a refit only featurizes new / edited creatives and warm-starts from the
+    current weights. A fit trains into fresh arrays and swaps them in under
+    `lock`, so scoring never sees half-updated weights.
+    """
+
+    def __init__(self, bits: int = CTR_HASH_BITS):
+        self.lock = threading.Lock()  # guards the published model + stats
+        self.fit_lock = threading.Lock()  # one fit at a time (owns the feature cache)
+        self.refit_queued_at = 0.0
+        self.dim = 1 << bits
+        self.bits = bits
+        self.theta = np.zeros(self.dim)
+        self.bias = 0.0
+        self.features: Dict[int, Tuple[Tuple, np.ndarray, np.ndarray]] = {}
+        self.names: Dict[int, str] = {}  # feature index -> a token that hashes there
+        self.trained_version: Optional[int] = None
+        self.last_fit = 0.0
+        self.stats: Dict = {}
+
+    @property
+    def trained(self) -> bool:
+        return self.trained_version is not None
+
+    def _featurize(self, headline, cta, source, placement) -> Tuple[np.ndarray, np.ndarray]:
+        tokens = ctr_tokens(headline, cta, source, placement)
+        idx, vals = hash_tokens(tokens, self.bits)
+        if len(self.names) < 200_000:
+            mask = self.dim - 1
+            for t in tokens:
+                self.names.setdefault(zlib.crc32(t.encode("utf-8")) & mask, t)
+        return idx, vals
+
+    def _load(self) -> pd.DataFrame:
+        conn = get_conn()
+        df = pd.read_sql_query(
+            """
+            SELECT a.id, a.headline, a.call_to_action, a.traffic_source, a.placement_type,
+                   p.impressions, p.clicks
+            FROM ad_creatives a JOIN ad_performance p ON p.ad_id = a.id
+            WHERE p.impressions >= ? AND p.clicks <= p.impressions
+            """,
+            conn,
+            params=(CTR_MIN_IMPRESSIONS,),
+        )
+        conn.close()
+        return df
+
+    def _matrix(self, df: pd.DataFrame):
+        """CSR-style (indices, values, row ids) for the frame, reusing cached features."""
+        cache, idx_parts, val_parts = self.features, [], []
+        for row in df.itertuples(index=False):
+            key = (row.headline, row.call_to_action, row.traffic_source, row.placement_type)
+            hit = cache.get(row.id)
+            if hit is None or hit[0] != key:
+                hit = cache[row.id] = (key, *self._featurize(*key))
+            idx_parts.append(hit[1])
+            val_parts.append(hit[2])
+        lengths = np.fromiter((len(p) for p in idx_parts), dtype=np.int64, count=len(idx_parts))
+        rows = np.repeat(np.arange(len(idx_parts)), lengths)
+        if not idx_parts:
+            return np.zeros(0, np.int64), np.zeros(0), rows
+        return np.concatenate(idx_parts), np.concatenate(val_parts), rows
+
+    @staticmethod
+    def _predict_rows(idx, vals, rows, n, theta, bias) -> np.ndarray:
+        return _sigmoid(np.bincount(rows, weights=theta[idx] * vals, minlength=n) + bias)
+
+    def _fit(self, idx, vals, rows, y, w, epochs: int, theta: np.ndarray, bias: float) -> Tuple[np.ndarray, float]:
+        """Full-batch Adagrad on weighted binomial log-loss + L2 (updates `theta` in place)."""
+        n = len(y)
+        g_theta = np.full(self.dim, 1e-8)
+        g_bias = 1e-8
+        w = w / w.sum()
+        for _ in range(epochs):
+            err = w * (self._predict_rows(idx, vals, rows, n, theta, bias) - y)
+            grad = np.bincount(idx, weights=err[rows] * vals, minlength=self.dim) + CTR_L2 * theta
+            grad_b = err.sum()
+            g_theta += grad * grad
+            g_bias += grad_b * grad_b
+            theta -= CTR_LEARNING_RATE * grad / np.sqrt(g_theta)
+            bias -= CTR_LEARNING_RATE * grad_b / np.sqrt(g_bias)
+        return theta, bias
+
+    def model(self) -> Tuple[np.ndarray, float]:
+        """The published (theta, bias); never modified after it is swapped in."""
+        with self.lock:
+            return self.theta, self.bias
+
+    def fit(self, full: bool = False) -> Dict:
+        """(Re)train on all ads with enough impressions; returns the stats dict."""
+        with self.fit_lock:
+            started = time.perf_counter()
+            version = get_data_version()
+            df = self._load()
+            live = set(df["id"])
+            for ad_id in [a for a in self.features if a not in live]:
+                del self.features[ad_id]
+            holdout = (df["id"] % CTR_HOLDOUT_EVERY == 0).to_numpy()
+            train, test = df[~holdout], df[holdout]
+            if len(train) < CTR_MIN_TRAIN_ADS:
+                stats = {"error": f"Need {CTR_MIN_TRAIN_ADS}+ ads with ≥{CTR_MIN_IMPRESSIONS} impressions "
+                                  f"(have {len(train)} for training)."}
+                with self.lock:
+                    self.stats = stats
+                return stats
+            y = (train["clicks"] / train["impressions"]).to_numpy()
+            w = np.log1p(train["impressions"].to_numpy(dtype=float))  # more traffic, more trust
+            warm = self.trained and not full
+            if warm:
+                theta, bias = self.model()
+                theta = theta.copy()
+            else:
+                theta = np.zeros(self.dim)
+                bias = float(np.log(max(y.mean(), 1e-6) / max(1 - y.mean(), 1e-6)))
+            featurized = time.perf_counter()
+            idx, vals, rows = self._matrix(train)
+            featurized = time.perf_counter() - featurized
+            theta, bias = self._fit(idx, vals, rows, y, w, CTR_WARM_EPOCHS if warm else CTR_FULL_EPOCHS, theta, bias)
+            stats = {
+                "trained_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "mode": "incremental" if warm else "full",
+                "train_ads": len(train),
+                "holdout_ads": len(test),
+                "fit_ms": round((time.perf_counter() - started) * 1000, 1),
+                "featurize_ms": round(featurized * 1000, 1),
+                **self._evaluate(test, theta, bias),
+            }
+            with self.lock:
+                self.theta, self.bias, self.stats = theta, bias, stats
+                self.trained_version = version
+                self.last_fit = time.time()
+            return stats
+
+    def _evaluate(self, test: pd.DataFrame, theta: np.ndarray, bias: float) -> Dict:
+        """Held-out quality: pairwise ranking accuracy, Spearman, log-loss vs. a constant CTR."""
+        if len(test) < 2:
+            return {}
+        idx, vals, rows = self._matrix(test)
+        pred = self._predict_rows(idx, vals, rows, len(test), theta, bias)
+        actual = (test["clicks"] / test["impressions"]).to_numpy()
+        rng = np.random.default_rng(0)
+        a, b = rng.integers(0, len(test), size=(2, min(50_000, len(test) * 20)))
+        differ = actual[a] != actual[b]
+        pairwise = float(((pred[a] > pred[b]) == (actual[a] > actual[b]))[differ].mean()) if differ.any() else None
+        w = test["impressions"].to_numpy(dtype=float)
+
+        def logloss(p):
+            p = np.clip(p, 1e-7, 1 - 1e-7)
+            return float(-(w * (actual * np.log(p) + (1 - actual) * np.log(1 - p))).sum() / w.sum())
+
+        base = np.full(len(test), float((test["clicks"].sum()) / max(1, test["impressions"].sum())))
+        model_ll, base_ll = logloss(pred), logloss(base)
+        return {
+            "pairwise_accuracy": round(pairwise, 4) if pairwise is not None else None,
+            # Spearman = Pearson on ranks (pandas' method="spearman" needs scipy).
+            "spearman": round(float(pd.Series(pred).rank().corr(pd.Series(actual).rank())), 4),
+            "logloss": round(model_ll, 5),
+            "logloss_baseline": round(base_ll, 5),
+            "logloss_gain_pct": round((1 - model_ll / base_ll) * 100, 2) if base_ll else 0.0,
+        }
+
+    def refresh(self) -> bool:
+        """
+        Queue a train_ctr_model job when metrics changed (throttled) – the fit
+        never runs on the caller's thread. True when a model is available.
+        """
+        stale = self.trained_version != get_data_version()
+        with self.lock:
+            due = stale and time.time() - max(self.last_fit, self.refit_queued_at) >= CTR_REFIT_SECONDS
+            if due:
+                self.refit_queued_at = time.time()
+        if due:
+            submit_job("train_ctr_model", {"full": not self.trained})
+        return self.trained
+
+    def score(self, headline: str, cta: str = "", traffic_source: str = "", placement_type: str = "") -> float:
+        """Predicted CTR (fraction) for one creative."""
+        theta, bias = self.model()
+        idx, vals = hash_tokens(ctr_tokens(headline, cta, traffic_source, placement_type), self.bits)
+        return float(_sigmoid(theta[idx] @ vals + bias))
+
+    def top_features(self, n: int = 15) -> pd.DataFrame:
+        theta, _ = self.model()
+        names = dict(self.names)  # a running fit may be adding to it
+        known = np.fromiter(names, dtype=np.int64, count=len(names))
+        if not len(known):
+            return pd.DataFrame(columns=["feature", "weight"])
+        order = np.argsort(theta[known])
+        picks = np.concatenate([order[::-1][:n], order[:n]])
+        return pd.DataFrame(
+            {"feature": [names[int(known[i])] for i in picks], "weight": theta[known[picks]].round(4)}
+        )
+
+
+@st.cache_resource
+def get_ctr_scorer() -> CTRScorer:
+    return CTRScorer()
+
+
+def score_creatives(ads: List[Dict]) -> Optional[List[float]]:
+    """Predicted CTR in % for each ad dict (headline / call_to_action / traffic_source / placement_type)."""
+    scorer = get_ctr_scorer()
+    if not scorer.refresh():
+        return None
+    return [
+        round(
+            scorer.score(ad.get("headline"), ad.get("call_to_action"), ad.get("traffic_source"), ad.get("placement_type"))
+            * 100,
+            3,
+        )
+        for ad in ads
+    ]
+
+
+def show_variant_ranking(ad_ids: List[int]):
+    """Ranked predicted-CTR table for freshly generated creatives (skipped without a model)."""
+    conn = get_conn()
+    ads = [
+        dict(r)
+        for r in conn.execute(
+            "SELECT id, title, headline, call_to_action, traffic_source, placement_type FROM ad_creatives "
+            "WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id",
+            (json.dumps(ad_ids),),
+        )
+    ]
+    conn.close()
+    scores = score_creatives(ads)
+    if scores is None:
+        st.caption("CTR scorer: no model yet – it trains in the background once there is enough performance history.")
+        return
+    df = pd.DataFrame(
+        {"ad_id": [a["id"] for a in ads], "title": [a["title"] for a in ads], "headline": [a["headline"] for a in ads],
+         "predicted_ctr_%": scores}
+    ).sort_values("predicted_ctr_%", ascending=False)
+    st.markdown("**Predicted CTR ranking** (local model, see the CTR Scorer page)")
+    st.dataframe(df, width="stretch", hide_index=True)
+
+
+# =========================
+# Rule engine (auto pause / promote)
+# =========================
+
+# Rules are one-liners stored in the `rules` table, e.g.
+#   pause if clicks > 500 and cr < 0.2%
+#   loser if impressions >= 20000 and ctr < 0.1% and traffic_source = ExoClick
+#   promote top 2 by epc per traffic_source where clicks >= 100
+# ctr / cr are percentages like CTR_% / CR_sales_% (the % sign is optional),
+# epc is dollars per click.
+RULE_ACTIONS = {"pause": "Paused", "loser": "Loser", "promote": "Winner", "winner": "Winner"}
+RULE_METRICS = ["impressions", "clicks", "leads", "sales", "revenue", "ctr", "cr", "epc"]
+RULE_DIMENSIONS = {
+    "traffic_source": "traffic_source",
+    "network": "traffic_source",
+    "program_id": "program_id",
+    "program": "program_id",
+    "placement_type": "placement_type",
+    "placement": "placement_type",
+    "angle": "angle",
+    "geo": "geo",
+    "device": "device",
+    "bid_model": "bid_model",
+}
+# Rules only touch live creatives; a manual pause is never overridden.
+RULE_LIVE_STATUSES = ("Active", "Winner")
+RULE_OPS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+_RULE_THRESHOLD_RE = re.compile(r"^(?P<action>\w+)\s+if\s+(?P<cond>.+)$", re.I)
+_RULE_RANK_RE = re.compile(
+    r"^(?P<action>\w+)\s+(?P<end>top|bottom)\s+(?P<n>\d+)\s+by\s+(?P<metric>\w+)"
+    r"(?:\s+per\s+(?P<group>\w+))?(?:\s+(?:where|if)\s+(?P<cond>.+))?$",
+    re.I,
+)
+_RULE_CLAUSE_RE = re.compile(r"^(?P<field>\w+)\s*(?P<op>>=|<=|!=|==|=|>|<)\s*(?P<value>.+?)$")
+
+
+def _parse_rule_clauses(cond: Optional[str]) -> List[Tuple[str, str, object]]:
+    clauses = []
+    for part in re.split(r"\s+and\s+", cond or "", flags=re.I):
+        part = part.strip()
+        if not part:
+            continue
+        m = _RULE_CLAUSE_RE.match(part)
+        if not m:
+            raise ValueError(f"Can't read condition '{part}'")
+        field, op, value = m.group("field").lower(), m.group("op"), m.group("value").strip()
+        if field in RULE_METRICS:
+            try:
+                value = float(value.lstrip("$").rstrip("%").replace(",", ""))
+            except ValueError:
+                raise ValueError(f"'{value}' is not a number (in '{part}')") from None
+        elif field in RULE_DIMENSIONS:
+            if op not in ("=", "==", "!="):
+                raise ValueError(f"'{field}' can only be compared with = or !=")
+            field, value = RULE_DIMENSIONS[field], value.strip("\"'")
+        else:
+            raise ValueError(f"Unknown field '{field}' (metrics: {', '.join(RULE_METRICS)})")
+        clauses.append((field, op, value))
+    return clauses
+
+
+def parse_rule(text: str) -> Dict:
+    """Rule text -> spec dict; raises ValueError with a readable message."""
+    text = " ".join(text.split())
+    rank = _RULE_RANK_RE.match(text)
+    match = rank or _RULE_THRESHOLD_RE.match(text)
+    if not match:
+        raise ValueError("Expected '<action> if <conditions>' or '<action> top|bottom N by <metric> per <dimension>'")
+    action = match.group("action").lower()
+    if action not in RULE_ACTIONS:
+        raise ValueError(f"Unknown action '{action}' (use {', '.join(RULE_ACTIONS)})")
+    spec = {
+        "kind": "rank" if rank else "threshold",
+        "status": RULE_ACTIONS[action],
+        "clauses": _parse_rule_clauses(match.group("cond")),
+    }
+    if rank:
+        metric = rank.group("metric").lower()
+        if metric not in RULE_METRICS:
+            raise ValueError(f"Can't rank by '{metric}' (metrics: {', '.join(RULE_METRICS)})")
+        group = (rank.group("group") or "traffic_source").lower()
+        if group not in RULE_DIMENSIONS:
+            raise ValueError(f"Can't group by '{group}' (use {', '.join(sorted(set(RULE_DIMENSIONS)))})")
+        spec.update(
+            metric=metric,
+            n=int(rank.group("n")),
+            top=rank.group("end").lower() == "top",
+            group_by=RULE_DIMENSIONS[group],
+        )
+    elif not spec["clauses"]:
+        raise ValueError("A threshold rule needs at least one condition")
+    return spec
+
+
+class Rule:
+    """A parsed, enabled row of the rules table."""
+
+    def __init__(self, rule_id: int, name: str, definition: str, priority: int):
+        self.id = rule_id
+        self.name = name or definition
+        self.definition = definition
+        self.priority = priority
+        spec = parse_rule(definition)
+        self.kind = spec["kind"]
+        self.status = spec["status"]
+        self.clauses = spec["clauses"]
+        self.metric = spec.get("metric")
+        self.n = spec.get("n")
+        self.top = spec.get("top", True)
+        self.group_by = spec.get("group_by")
+        # Dimension equalities let a rule be skipped without touching the data.
+        self.scope = [(f, v) for f, op, v in self.clauses if f in RULE_DIMENSIONS.values() and op in ("=", "==")]
+
+    def in_scope(self, values: Dict[str, set]) -> bool:
+        return all(v in values[f] for f, v in self.scope)
+
+    def sql_where(self) -> Tuple[str, List]:
+        """Clauses as SQL over RULE_FRAME_SQL columns (field names are whitelisted)."""
+        parts = [
+            f"ad_id {'NOT ' if op == '!=' else ''}IN (SELECT ad_id FROM ad_geos WHERE geo = ?)"
+            if field == "geo"
+            else f"{field} {'=' if op == '==' else op} ?"
+            for field, op, _ in self.clauses
+        ]
+        return " AND ".join(parts) or "1", [v for _, _, v in self.clauses]
+
+    def mask(self, cols: Dict, base):
+        """Boolean array: which rows satisfy every clause (base = starting mask)."""
+        m = base
+        for field, op, value in self.clauses:
+            if field == "geo":
+                # Multi-GEO ads ("CA,US") match each of their GEOs.
+                hit = np.array([value in g.split(",") for g in cols[field]], dtype=bool)
+                m = m & (~hit if op == "!=" else hit)
+            else:
+                m = m & RULE_OPS[op](cols[field], value)
+        return m
+
+
+def init_rules_tables(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            definition TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 100,
+            enabled INTEGER NOT NULL DEFAULT 1,
+            created_at TEXT
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS rule_hits (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            rule_id INTEGER,
+            ad_id INTEGER,
+            old_status TEXT,
+            new_status TEXT,
+            group_value TEXT,
+            created_at TEXT
+        )
+        """
+    )
+    # Group the ad was ranked in (top/bottom-N rules), so archived ads still count.
+    ensure_column(conn, "rule_hits", "group_value", "TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rule_hits_ad ON rule_hits (ad_id, id)")
+    # Same trick as data_version: engines recompile only when this moves.
+    conn.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('rules_version', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS rules_rv_{event.lower()}
+            AFTER {event} ON rules BEGIN
+                UPDATE app_meta SET value = value + 1 WHERE key = 'rules_version';
+            END
+            """
+        )
+
+
+def insert_rule_op(conn, name: str, definition: str, priority: int) -> int:
+    cur = conn.execute(
+        "INSERT INTO rules (name, definition, priority, created_at) VALUES (?, ?, ?, ?)",
+        (name, definition, priority, time.strftime("%Y-%m-%d %H:%M:%S")),
+    )
+    return cur.lastrowid
+
+
+def set_rule_enabled_op(conn, rule_id: int, enabled: bool):
+    conn.execute("UPDATE rules SET enabled = ? WHERE id = ?", (int(enabled), rule_id))
+
+
+def delete_rule_op(conn, rule_id: int):
+    conn.execute("DELETE FROM rules WHERE id = ?", (rule_id,))
+
+
+def add_rule(name: str, definition: str, priority: int = 100) -> int:
+    parse_rule(definition)  # raises ValueError before anything is stored
+    return submit_write(insert_rule_op, name.strip(), " ".join(definition.split()), priority).result()
+
+
+def fetch_rules() -> List[Dict]:
+    conn = get_conn()
+    rows = conn.execute("SELECT * FROM rules ORDER BY priority, id").fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+
+def fetch_rule_hits(limit: int = 200) -> pd.DataFrame:
+    conn = get_conn()
+    df = pd.read_sql_query(
+        """
+        SELECT h.created_at, h.ad_id, c.title, h.old_status, h.new_status,
+               h.rule_id, COALESCE(NULLIF(r.name, ''), r.definition) AS rule
+        FROM rule_hits h
+        LEFT JOIN ad_creatives c ON c.id = h.ad_id
+        LEFT JOIN rules r ON r.id = h.rule_id
+        ORDER BY h.id DESC
+        LIMIT ?
+        """,
+        conn,
+        params=(limit,),
+    )
+    conn.close()
+    return df
+
+
+# One row per ad with the rule KPIs computed in SQL (ctr / cr in %, epc in $).
+RULE_FRAME_SQL = """
+    SELECT *,
+        CASE WHEN impressions > 0 THEN clicks * 100.0 / impressions ELSE 0.0 END AS ctr,
+        CASE WHEN clicks > 0 THEN sales * 100.0 / clicks ELSE 0.0 END AS cr,
+        CASE WHEN clicks > 0 THEN revenue * 1.0 / clicks ELSE 0.0 END AS epc
+    FROM (
+        SELECT
+            c.id AS ad_id,
+            COALESCE(c.status, 'Active') AS status,
+            COALESCE(c.traffic_source, '') AS traffic_source,
+            CAST(c.program_id AS TEXT) AS program_id,
+            COALESCE(c.placement_type, '') AS placement_type,
+            COALESCE(c.angle, '') AS angle,
+            COALESCE(c.geo, '') AS geo,
+            COALESCE(c.device, '') AS device,
+            COALESCE(c.bid_model, '') AS bid_model,
+            COALESCE(p.impressions, 0) AS impressions,
+            COALESCE(p.clicks, 0) AS clicks,
+            COALESCE(p.leads, 0) AS leads,
+            COALESCE(p.sales, 0) AS sales,
+            COALESCE(p.revenue, 0.0) AS revenue
+        FROM ad_creatives c
+        LEFT JOIN ad_performance p ON p.ad_id = c.id
+    )
+"""
+
+
+def load_rule_frame(where: str = "", params: Tuple = ()) -> pd.DataFrame:
+    conn = get_conn()
+    df = pd.read_sql_query(RULE_FRAME_SQL + where, conn, params=params)
+    conn.close()
+    return df
+
+
+class RuleEngine:
+    """
+    Compiled rules, recompiled when rules_version moves. evaluate() only looks
+    at the ads it is given – threshold rules are array ops over just those
+    rows, top/bottom-N rules re-rank only the groups those ads belong to.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.threshold: List[Rule] = []
+        self.rank: List[Rule] = []
+        self.errors: Dict[int, str] = {}
+
+    def refresh(self):
+        conn = get_conn()
+        row = conn.execute("SELECT value FROM app_meta WHERE key = 'rules_version'").fetchone()
+        version = row[0] if row else 0
+        if version == self.version:
+            conn.close()
+            return
+        rows = conn.execute(
+            "SELECT id, name, definition, priority FROM rules WHERE enabled = 1 ORDER BY priority, id"
+        ).fetchall()
+        conn.close()
+        threshold, rank, errors = [], [], {}
+        for r in rows:
+            try:
+                rule = Rule(r["id"], r["name"], r["definition"], r["priority"])
+            except ValueError as e:
+                errors[r["id"]] = str(e)
+                continue
+            (rank if rule.kind == "rank" else threshold).append(rule)
+        with self._lock:
+            self.threshold, self.rank, self.errors, self.version = threshold, rank, errors, version
+
+    def evaluate(self, ad_ids: Optional[List[int]] = None) -> List[Dict]:
+        """Proposed status changes for these ads (None = every ad)."""
+        self.refresh()
+        with self._lock:
+            threshold, rank = list(self.threshold), list(self.rank)
+        if not threshold and not rank:
+            return []
+
+        if ad_ids is None:
+            frame = load_rule_frame()
+        else:
+            ids = sorted({int(a) for a in ad_ids})
+            frame = load_rule_frame(" WHERE ad_id IN (SELECT value FROM json_each(?))", (json.dumps(ids),))
+        if frame.empty:
+            return []
+
+        # Threshold rules: first matching rule (by priority) decides an ad.
+        status = frame["status"].to_numpy().copy()
+        cols = {c: frame[c].to_numpy() for c in frame.columns}
+        present = {f: set(frame[f]) for f in set(RULE_DIMENSIONS.values())}
+        present["geo"] = {code for label in present["geo"] for code in label.split(",")}
+        live = (status == RULE_LIVE_STATUSES[0]) | (status == RULE_LIVE_STATUSES[1])
+        undecided = live.copy()
+        changes: Dict[int, Dict] = {}
+        for rule in threshold:
+            if not undecided.any():
+                break
+            if not rule.in_scope(present):
+                continue
+            match = rule.mask(cols, undecided)
+            # An ad already in the rule's status is decided too, just unchanged.
+            for i in (match & (status != rule.status)).nonzero()[0]:
+                ad_id = int(cols["ad_id"][i])
+                changes[ad_id] = {
+                    "ad_id": ad_id,
+                    "old_status": status[i],
+                    "status": rule.status,
+                    "rule_id": rule.id,
+                    "rule": rule.name,
+                }
+            undecided &= ~match
+
+        for rule in rank:
+            groups = None if ad_ids is None else sorted(set(frame[rule.group_by]))
+            for ad_id, ch in self._evaluate_rank(rule, groups, changes).items():
+                # old_status must stay what is in the DB (the write compares against it).
+                earlier = changes.get(ad_id)
+                if earlier is not None:
+                    ch["old_status"] = earlier["old_status"]
+                if ch["status"] == ch["old_status"]:
+                    changes.pop(ad_id, None)
+                else:
+                    changes[ad_id] = ch
+        return list(changes.values())
+
+    def _evaluate_rank(self, rule: Rule, groups: Optional[List[str]], decided: Dict) -> Dict:
+        """
+        Top/bottom-N per group, ranked in SQL so only the leaders come back
+        (plus enough spares to cover ads already decided in this pass).
+        groups=None ranks every group.
+
+        Ads this rule already moved (e.g. paused) stay in the ranking, and ones
+        archived since still fill their group's N – otherwise every pass would
+        pick the next-worst live ad until the whole group is paused.
+        """
+        where, params = rule.sql_where()
+        group_where, group_params = "", []
+        if groups is not None:
+            group_where = f" AND {rule.group_by} IN (SELECT value FROM json_each(?))"
+            group_params = [json.dumps(groups)]
+        held_sql = """
+            SELECT h.ad_id, h.group_value FROM rule_hits h
+            JOIN (SELECT ad_id, MAX(id) AS id FROM rule_hits GROUP BY ad_id) last ON last.id = h.id
+            WHERE h.rule_id = ? AND h.new_status = ?
+        """
+        held_params = [rule.id, rule.status]
+        order = "DESC" if rule.top else "ASC"
+        conn = get_conn()
+        ranked = pd.read_sql_query(
+            f"""
+            WITH held AS ({held_sql})
+            SELECT ad_id, status, grp, is_held FROM (
+                SELECT ad_id, status, {rule.group_by} AS grp,
+                       ad_id IN (SELECT ad_id FROM held) AS is_held,
+                       ROW_NUMBER() OVER (PARTITION BY {rule.group_by} ORDER BY {rule.metric} {order}, ad_id) AS rn
+                FROM ({RULE_FRAME_SQL})
+                WHERE {where}{group_where}
+                  AND (status IN (?, ?) OR (status = ? AND ad_id IN (SELECT ad_id FROM held)))
+            )
+            WHERE rn <= ?
+            ORDER BY grp, rn
+            """,
+            conn,
+            params=held_params + params + group_params
+            + [*RULE_LIVE_STATUSES, rule.status, rule.n + len(decided)],
+        )
+        # Held ads that have left the hot tables (archived) still use up N.
+        archived_held = {} if rule.status == "Winner" else dict(
+            conn.execute(
+                f"""
+                SELECT group_value, COUNT(*) FROM ({held_sql})
+                WHERE group_value IS NOT NULL AND ad_id NOT IN (SELECT id FROM ad_creatives)
+                GROUP BY group_value
+                """,
+                held_params,
+            ).fetchall()
+        )
+        holders = pd.DataFrame(columns=["ad_id", "status"])
+        if rule.status == "Winner":
+            holders = pd.read_sql_query(
+                f"SELECT ad_id, status FROM ({RULE_FRAME_SQL}) WHERE status = 'Winner'" + group_where,
+                conn,
+                params=group_params,
+            )
+        conn.close()
+
+        # Earlier decisions in this pass count as the ad's status.
+        overrides = {ad_id: ch["status"] for ad_id, ch in decided.items()}
+        for df in (ranked, holders):
+            df["status"] = df["ad_id"].map(overrides).fillna(df["status"])
+        ranked = ranked[
+            ranked["status"].isin(RULE_LIVE_STATUSES)
+            | (ranked["is_held"].astype(bool) & (ranked["status"] == rule.status))
+        ]
+        slots = ranked["grp"].map(lambda g: rule.n - archived_held.get(g, 0))
+        picked = ranked[ranked.groupby("grp", sort=False).cumcount() < slots]
+
+        out = {}
+        for ad_id, old, grp in zip(picked["ad_id"], picked["status"], picked["grp"]):
+            if old != rule.status:
+                out[int(ad_id)] = {
+                    "ad_id": int(ad_id),
+                    "old_status": old,
+                    "status": rule.status,
+                    "rule_id": rule.id,
+                    "rule": rule.name,
+                    "group": grp,
+                }
+        if rule.status == "Winner":
+            # Winners this rule promoted earlier that dropped out of the top N.
+            holders = holders[(holders["status"] == "Winner") & ~holders["ad_id"].isin(picked["ad_id"])]
+            for ad_id, previous in promoted_by_rule(rule.id, holders["ad_id"].tolist()).items():
+                out[ad_id] = {
+                    "ad_id": ad_id,
+                    "old_status": "Winner",
+                    "status": previous if previous in RULE_LIVE_STATUSES else "Active",
+                    "rule_id": rule.id,
+                    "rule": f"{rule.name} (dropped out of top {rule.n})",
+                }
+        return out
+
+
+def promoted_by_rule(rule_id: int, ad_ids: List[int]) -> Dict[int, str]:
+    """ad_id -> status before the promotion, for ads whose latest rule hit is this rule's."""
+    if not ad_ids:
+        return {}
+    conn = get_conn()
+    rows = conn.execute(
+        """
+        SELECT h.ad_id, h.rule_id, h.old_status
+        FROM rule_hits h
+        JOIN (
+            SELECT ad_id, MAX(id) AS id FROM rule_hits
+            WHERE ad_id IN (SELECT value FROM json_each(?))
+            GROUP BY ad_id
+        ) last ON last.id = h.id
+        """,
+        (json.dumps([int(a) for a in ad_ids]),),
+    ).fetchall()
+    conn.close()
+    return {int(r["ad_id"]): r["old_status"] for r in rows if r["rule_id"] == rule_id}
+
+
+@st.cache_resource
+def get_rule_engine() -> RuleEngine:
+    return RuleEngine()
+
+
+def apply_rule_changes_op(conn, changes: List[Dict]) -> List[Dict]:
+    """Write status changes (only if the status is still what we evaluated) + log hits."""
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    applied = []
+    for ch in changes:
+        cur = conn.execute(
+            "UPDATE ad_creatives SET status = ? WHERE id = ? AND COALESCE(status, 'Active') = ?",
+            (ch["status"], ch["ad_id"], ch["old_status"]),
+        )
+        if cur.rowcount:
+            conn.execute(
+                "INSERT INTO rule_hits (rule_id, ad_id, old_status, new_status, group_value, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (ch["rule_id"], ch["ad_id"], ch["old_status"], ch["status"], ch.get("group"), now),
+            )
+            applied.append(ch)
+    return applied
+
+
+def get_rules_version() -> int:
+    conn = get_conn()
+    row = conn.execute("SELECT value FROM app_meta WHERE key = 'rules_version'").fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+
+def queue_rule_evaluation(ad_ids: List[int]) -> str:
+    """apply_rules for these ads in an evaluate_rules job (bulk writes); returns the job id."""
+    return submit_job("evaluate_rules", {"ad_ids": sorted({int(a) for a in ad_ids})})
+
+
+def apply_rules(ad_ids: Optional[List[int]] = None) -> List[Dict]:
+    """
+    Evaluate rules for these ads (None = all), write the status changes and
+    send one `rules_applied` webhook. Returns the changes that were applied.
+    """
+    changes = get_rule_engine().evaluate(ad_ids)
+    if not changes:
+        return []
+    applied = submit_write(apply_rule_changes_op, changes).result()
+    if applied:
+        trigger_zap("rules_applied", {"count": len(applied), "changes": applied})
+    return applied
+
+
+# =========================
+# Cohorts & LTV (rev-share)
+# =========================
+
+# Rev-share money for a signup keeps arriving for months. It is stored per
+# acquisition date × ad (× program) × age-in-days, and rolled up per traffic
+# source × acquisition month so LTV curves never scan the detail table.
+COHORT_MAX_AGE_DAYS = 1095
+COHORT_MILESTONES = [0, 7, 30, 60, 90, 180, 365, 730]
+# Projection window: revenue earned in the last 30 days of the observed curve
+# vs. the 30 before gives the per-window decay (rev-share pays monthly).
+COHORT_PROJECTION_WINDOW = 30
+
+
+def init_cohort_tables(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cohort_signups (
+            cohort_date TEXT NOT NULL,
+            ad_id INTEGER NOT NULL,
+            program_id INTEGER,
+            traffic_source TEXT,
+            signups INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (cohort_date, ad_id)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cohort_revenue (
+            cohort_date TEXT NOT NULL,
+            ad_id INTEGER NOT NULL,
+            age_days INTEGER NOT NULL,
+            program_id INTEGER,
+            traffic_source TEXT,
+            revenue REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (cohort_date, ad_id, age_days)
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cohort_revenue_ad ON cohort_revenue (ad_id)")
+    # The source is stored with each row so the matrices outlive the ad itself
+    # (archiving removes it from ad_creatives).
+    for table in ("cohort_signups", "cohort_revenue"):
+        ensure_column(conn, table, "traffic_source", "TEXT")
+        missing = [r[0] for r in conn.execute(f"SELECT DISTINCT ad_id FROM {table} WHERE traffic_source IS NULL")]
+        if missing:
+            ads = _cohort_ad_lookup(conn, missing)
+            conn.executemany(
+                f"UPDATE {table} SET traffic_source = ? WHERE ad_id = ? AND traffic_source IS NULL",
+                [(ads[i][1], i) for i in missing if i in ads],
+            )
+    # Per-source monthly rollups, maintained incrementally by record_cohort_events_op.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cohort_source_signups (
+            traffic_source TEXT NOT NULL,
+            cohort_month TEXT NOT NULL,
+            signups INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (traffic_source, cohort_month)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cohort_source_revenue (
+            traffic_source TEXT NOT NULL,
+            cohort_month TEXT NOT NULL,
+            age_days INTEGER NOT NULL,
+            revenue REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (traffic_source, cohort_month, age_days)
+        )
+        """
+    )
+    conn.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('cohort_version', 0)")
+
+
+def _parse_day(value) -> str:
+    return pd.Timestamp(value).strftime("%Y-%m-%d")
+
+
+def _cohort_ad_lookup(conn, ad_ids) -> Dict[int, Tuple[Optional[int], str, bool]]:
+    """{ad_id: (program_id, traffic_source, archived)} from the hot table, then the archive."""
+    ad_ids = sorted(set(ad_ids))
+    ads = {
+        r["id"]: (r["program_id"], r["traffic_source"] or "Unknown", False)
+        for r in conn.execute(
+            "SELECT id, program_id, traffic_source FROM ad_creatives WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(ad_ids),),
+        )
+    }
+    missing = [i for i in ad_ids if i not in ads]
+    if missing and os.path.exists(ARCHIVE_DB_PATH):
+        cold = get_archive_conn()
+        for r in cold.execute(
+            "SELECT id, program_id, traffic_source FROM archived_ads WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(missing),),
+        ):
+            ads[r["id"]] = (r["program_id"], r["traffic_source"] or "Unknown", True)
+        cold.close()
+    return ads
+
+
+def add_archived_revenue(totals: Dict[int, float]):
+    """Add payouts to the metrics stored in archived payloads."""
+    if not totals or not os.path.exists(ARCHIVE_DB_PATH):
+        return
+    with ARCHIVE_WRITE_LOCK:
+        cold = get_archive_conn()
+        rows = cold.execute(
+            "SELECT id, payload FROM archived_ads WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(sorted(totals)),),
+        ).fetchall()
+        updates = []
+        for r in rows:
+            ad = json.loads(zlib.decompress(r["payload"]).decode("utf-8"))
+            ad["revenue"] = (ad.get("revenue") or 0.0) + totals[r["id"]]
+            updates.append((zlib.compress(json.dumps(ad).encode("utf-8"), 9), r["id"]))
+        cold.executemany("UPDATE archived_ads SET payload = ? WHERE id = ?", updates)
+        cold.commit()
+        cold.close()
+
+
+def record_cohort_events_op(
+    conn,
+    signups: List[Tuple[int, str, int]],
+    revenue: List[Tuple[int, str, str, float]],
+    add_to_totals: bool = True,
+) -> Dict:
+    """
+    Add (ad_id, acquired, count) signups and (ad_id, acquired, paid_on, amount)
+    payouts to the cohort matrices and rollups. With `add_to_totals` the
+    payouts also land in the ad's revenue total; totals for archived ads are
+    returned as `archived_totals` for the caller to write to the cold store.
+    """
+    ads = _cohort_ad_lookup(conn, {r[0] for r in signups} | {r[0] for r in revenue})
+    skipped = 0
+    signup_rows, source_signups = [], {}
+    for ad_id, acquired, count in signups:
+        if ad_id not in ads or not count:
+            skipped += 1
+            continue
+        day = _parse_day(acquired)
+        program_id, source, _ = ads[ad_id]
+        signup_rows.append((day, ad_id, program_id, source, int(count)))
+        key = (source, day[:7])
+        source_signups[key] = source_signups.get(key, 0) + int(count)
+
+    revenue_rows, source_revenue, totals = [], {}, {}
+    for ad_id, acquired, paid_on, amount in revenue:
+        day = _parse_day(acquired)
+        age = (pd.Timestamp(paid_on) - pd.Timestamp(day)).days
+        if ad_id not in ads or not 0 <= age <= COHORT_MAX_AGE_DAYS:
+            skipped += 1
+            continue
+        program_id, source, _ = ads[ad_id]
+        revenue_rows.append((day, ad_id, age, program_id, source, float(amount)))
+        key = (source, day[:7], age)
+        source_revenue[key] = source_revenue.get(key, 0.0) + float(amount)
+        totals[ad_id] = totals.get(ad_id, 0.0) + float(amount)
+
+    conn.executemany(
+        """
+        INSERT INTO cohort_signups (cohort_date, ad_id, program_id, traffic_source, signups)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(cohort_date, ad_id) DO UPDATE SET signups = signups + excluded.signups
+        """,
+        signup_rows,
+    )
+    conn.executemany(
+        """
+        INSERT INTO cohort_revenue (cohort_date, ad_id, age_days, program_id, traffic_source, revenue)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(cohort_date, ad_id, age_days) DO UPDATE SET revenue = revenue + excluded.revenue
+        """,
+        revenue_rows,
+    )
+    conn.executemany(
+        """
+        INSERT INTO cohort_source_signups (traffic_source, cohort_month, signups) VALUES (?, ?, ?)
+        ON CONFLICT(traffic_source, cohort_month) DO UPDATE SET signups = signups + excluded.signups
+        """,
+        [(*k, v) for k, v in source_signups.items()],
+    )
+    conn.executemany(
+        """
+        INSERT INTO cohort_source_revenue (traffic_source, cohort_month, age_days, revenue) VALUES (?, ?, ?, ?)
+        ON CONFLICT(traffic_source, cohort_month, age_days) DO UPDATE SET revenue = revenue + excluded.revenue
+        """,
+        [(*k, v) for k, v in source_revenue.items()],
+    )
+    hot_totals = {k: v for k, v in totals.items() if not ads[k][2]} if add_to_totals else {}
+    if hot_totals:
+        conn.executemany(
+            """
+            INSERT INTO ad_performance (ad_id, impressions, clicks, leads, sales, revenue)
+            VALUES (?, 0, 0, 0, 0, ?)
+            ON CONFLICT(ad_id) DO UPDATE SET revenue = revenue + excluded.revenue
+            """,
+            list(hot_totals.items()),
+        )
+    # One bump per batch (not a per-row trigger): imports can carry many rows.
+    conn.execute("UPDATE app_meta SET value = value + 1 WHERE key = 'cohort_version'")
+    return {
+        "signups": len(signup_rows),
+        "payouts": len(revenue_rows),
+        "skipped": skipped,
+        "hot_totals": sorted(hot_totals),
+        "archived_totals": {k: v for k, v in totals.items() if ads[k][2]} if add_to_totals else {},
+    }
+
+
+def rebuild_cohort_rollups_op(conn):
+    """
+    Recompute the per-source rollups from the cohort matrices (e.g. after ads
+    changed source). Live ads refresh their stored source first; archived ads
+    keep the one recorded with their rows.
+    """
+    for table in ("cohort_signups", "cohort_revenue"):
+        conn.execute(
+            f"""
+            UPDATE {table} SET traffic_source = (
+                SELECT COALESCE(NULLIF(a.traffic_source, ''), 'Unknown') FROM ad_creatives a WHERE a.id = {table}.ad_id
+            )
+            WHERE ad_id IN (SELECT id FROM ad_creatives)
+            """
+        )
+    conn.execute("DELETE FROM cohort_source_signups")
+    conn.execute("DELETE FROM cohort_source_revenue")
+    conn.execute(
+        """
+        INSERT INTO cohort_source_signups (traffic_source, cohort_month, signups)
+        SELECT COALESCE(NULLIF(traffic_source, ''), 'Unknown'), substr(cohort_date, 1, 7), SUM(signups)
+        FROM cohort_signups
+        GROUP BY 1, 2
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO cohort_source_revenue (traffic_source, cohort_month, age_days, revenue)
+        SELECT COALESCE(NULLIF(traffic_source, ''), 'Unknown'), substr(cohort_date, 1, 7), age_days, SUM(revenue)
+        FROM cohort_revenue
+        GROUP BY 1, 2, 3
+        """
+    )
+    conn.execute("UPDATE app_meta SET value = value + 1 WHERE key = 'cohort_version'")
+
+
+def record_cohort_events(signups=(), revenue=(), add_to_totals: bool = True) -> Dict:
+    done = submit_write(record_cohort_events_op, list(signups), list(revenue), add_to_totals).result()
+    add_archived_revenue(done.pop("archived_totals"))
+    hot = done.pop("hot_totals")
+    if hot:
+        # Revenue moved, so ROI/EPC rules may now fire.
+        done["rules_job"] = queue_rule_evaluation(hot)
+    return done
+
+
+def get_cohort_version() -> int:
+    conn = get_conn()
+    row = conn.execute("SELECT value FROM app_meta WHERE key = 'cohort_version'").fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+
+@st.cache_data(show_spinner=False)
+def load_cohort_rollups(cohort_version: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """(signups per source × month, revenue per source × month × age) – keyed on cohort_version."""
+    conn = get_conn()
+    signups = pd.read_sql_query("SELECT traffic_source, cohort_month, signups FROM cohort_source_signups", conn)
+    revenue = pd.read_sql_query(
+        "SELECT traffic_source, cohort_month, age_days, revenue FROM cohort_source_revenue", conn
+    )
+    conn.close()
+    return signups, revenue
+
+
+def _cohort_arrays(signups: pd.DataFrame, revenue: pd.DataFrame, today: pd.Timestamp):
+    """Month × age matrix of cumulative revenue, signups per month, and each month's observed age."""
+    months = sorted(set(signups["cohort_month"]) | set(revenue["cohort_month"]))
+    pos = {m: i for i, m in enumerate(months)}
+    # A month is fully observed up to (today - its last day).
+    month_end = pd.to_datetime(pd.Series(months) + "-01") + pd.offsets.MonthEnd(0)
+    observed = (today - month_end).dt.days.clip(lower=-1).to_numpy()
+    # Ages with no payouts still count (as zero) as long as some cohort reached them.
+    max_age = int(revenue["age_days"].max()) if not revenue.empty else 0
+    horizon = min(max(max_age, int(observed.max(initial=0))), COHORT_MAX_AGE_DAYS) + 1
+    matrix = np.zeros((len(months), horizon))
+    np.add.at(matrix, (revenue["cohort_month"].map(pos).to_numpy(), revenue["age_days"].to_numpy()), revenue["revenue"].to_numpy())
+    cumulative = matrix.cumsum(axis=1)
+    size = np.zeros(len(months))
+    np.add.at(size, signups["cohort_month"].map(pos).to_numpy(), signups["signups"].to_numpy(dtype=float))
+    return months, cumulative, size, observed
+
+
+def ltv_curve(signups: pd.DataFrame, revenue: pd.DataFrame, today: Optional[pd.Timestamp] = None) -> pd.Series:
+    """
+    Cumulative revenue per signup by age, using only cohorts that are old
+    enough to have reached each age (no right-censoring bias).
+    """
+    if signups.empty or signups["signups"].sum() == 0:
+        return pd.Series(dtype=float)
+    today = today or pd.Timestamp.today().normalize()
+    _, cumulative, size, observed = _cohort_arrays(signups, revenue, today)
+    ages = np.arange(cumulative.shape[1])
+    seen = ages[None, :] <= observed[:, None]
+    denom = (size[:, None] * seen).sum(axis=0)
+    numer = (cumulative * seen).sum(axis=0)
+    valid = denom > 0
+    return pd.Series(numer[valid] / denom[valid], index=ages[valid], name="ltv")
+
+
+def project_ltv(curve: pd.Series, ages: List[int]) -> Dict[int, Tuple[float, bool]]:
+    """
+    LTV at each age: observed where the curve reaches it, otherwise the last
+    window's revenue continued with the window-over-window decay (a geometric
+    series, i.e. constant churn). Ages that can't be projected yet are left
+    out. -> {age: (value, projected)}.
+    """
+    out: Dict[int, Tuple[float, bool]] = {}
+    w = COHORT_PROJECTION_WINDOW
+    last = int(curve.index.max()) if not curve.empty else -1
+    recent = ratio = None
+    if last >= 2 * w:
+        c_last, c_mid, c_first = (float(curve.loc[:a].iloc[-1]) for a in (last, last - w, last - 2 * w))
+        recent, prev = c_last - c_mid, c_mid - c_first
+        ratio = min(max(recent / prev, 0.0), 0.99) if prev > 0 else 0.0
+    for age in ages:
+        if age <= last:
+            out[age] = (float(curve.loc[:age].iloc[-1]), False)
+        elif recent is not None:
+            periods = (age - last) / w
+            tail = recent * ratio * (1 - ratio**periods) / (1 - ratio) if ratio else 0.0
+            out[age] = (float(curve.iloc[-1]) + tail, True)
+    return out
+
+
+def cohort_ltv_table(cohort_version: int) -> pd.DataFrame:
+    """Per traffic source: signups and LTV at each milestone ('*' = projected)."""
+    signups, revenue = load_cohort_rollups(cohort_version)
+    rows = []
+    for source in sorted(signups["traffic_source"].unique()):
+        s = signups[signups["traffic_source"] == source]
+        curve = ltv_curve(s, revenue[revenue["traffic_source"] == source])
+        row = {"traffic_source": source, "signups": int(s["signups"].sum())}
+        for age, (value, projected) in project_ltv(curve, COHORT_MILESTONES).items():
+            row[f"d{age}"] = f"${value:,.2f}{'*' if projected else ''}"
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def cohort_triangle(signups: pd.DataFrame, revenue: pd.DataFrame, ages: List[int] = COHORT_MILESTONES) -> pd.DataFrame:
+    """Acquisition month × milestone age: cumulative revenue per signup (blank until reached)."""
+    if signups.empty:
+        return pd.DataFrame()
+    today = pd.Timestamp.today().normalize()
+    months, cumulative, size, observed = _cohort_arrays(signups, revenue, today)
+    table = {}
+    for age in ages:
+        col = cumulative[:, min(age, cumulative.shape[1] - 1)] / np.where(size > 0, size, np.nan)
+        table[f"d{age}"] = np.where(observed >= age, col, np.nan)
+    df = pd.DataFrame(table, index=months).round(2)
+    df.insert(0, "signups", size.astype(int))
+    df.index.name = "cohort_month"
+    return df.iloc[::-1]
+
+
+def parse_cohort_csv(text: str) -> Tuple[List[Tuple], List[Tuple]]:
+    """
+    CSV with ad_id, acquired and either signups, or paid_on + revenue (both
+    allowed on one row) -> (signups, payouts) for record_cohort_events.
+    """
+    df = pd.read_csv(io.StringIO(text))
+    missing = [c for c in ["ad_id", "acquired"] if c not in df.columns]
+    if missing or not ({"signups"} <= set(df.columns) or {"paid_on", "revenue"} <= set(df.columns)):
+        raise ValueError("CSV needs ad_id, acquired and signups and/or paid_on + revenue columns.")
+    df = df.dropna(subset=["ad_id", "acquired"])
+    signups, payouts = [], []
+    if "signups" in df.columns:
+        s = df.dropna(subset=["signups"])
+        signups = list(zip(s["ad_id"].astype(int), s["acquired"], s["signups"].astype(int)))
+    if {"paid_on", "revenue"} <= set(df.columns):
+        p = df.dropna(subset=["paid_on", "revenue"])
+        payouts = list(zip(p["ad_id"].astype(int), p["acquired"], p["paid_on"], p["revenue"].astype(float)))
+    return signups, payouts
+
+
+# =========================
+# Background jobs
+# =========================
+
+JOB_STATUSES = ["queued", "running", "done", "failed", "cancelled"]
+JOB_WORKERS = 2
+JOB_POLL_SECONDS = 1.0
+# Finished jobs (and their results) are kept this long, then purged.
+JOB_RETENTION_HOURS = 24
+# Running jobs are stamped this often; one that misses a few beats lost its worker.
+JOB_HEARTBEAT_SECONDS = 10.0
+JOB_STALE_SECONDS = 60.0
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def init_jobs_table(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            params TEXT,
+            progress REAL DEFAULT 0.0,
+            message TEXT,
+            result TEXT,
+            result_name TEXT,
+            result_path TEXT,
+            error TEXT,
+            session_id TEXT,
+            cancel_requested INTEGER DEFAULT 0,
+            worker_id TEXT,
+            heartbeat_at REAL,
+            created_at REAL,
+            started_at REAL,
+            finished_at REAL
+        )
+        """
+    )
+    ensure_column(conn, "jobs", "result_path", "TEXT")
+    ensure_column(conn, "jobs", "worker_id", "TEXT")
+    ensure_column(conn, "jobs", "heartbeat_at", "REAL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+
+
+def submit_job_op(conn, job_id: str, kind: str, params: Dict, session_id: str):
+    conn.execute(
+        "INSERT INTO jobs (id, kind, params, session_id, created_at) VALUES (?, ?, ?, ?, ?)",
+        (job_id, kind, json.dumps(params), session_id, time.time()),
+    )
+
+
+def claim_job_op(conn, worker_id: str) -> Optional[Dict]:
+    now = time.time()
+    row = conn.execute(
+        """
+        UPDATE jobs SET status = 'running', started_at = ?, worker_id = ?, heartbeat_at = ?
+        WHERE id = (
+            SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1
+        )
+        RETURNING id, kind, params, session_id
+        """,
+        (now, worker_id, now),
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def update_job_op(conn, job_id: str, **fields):
+    cols = ", ".join(f"{k} = ?" for k in fields)
+    conn.execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+
+
+def cancel_job_op(conn, job_id: str):
+    conn.execute(
+        "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+        (time.time(), job_id),
+    )
+    conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+
+
+def purge_jobs_op(conn, older_than: float) -> int:
+    cur = conn.execute(
+        "DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND finished_at < ?",
+        (older_than,),
+    )
+    return cur.rowcount
+
+
+def heartbeat_jobs_op(conn, job_ids: List[str]):
+    conn.execute(
+        "UPDATE jobs SET heartbeat_at = ? WHERE status = 'running' AND id IN (SELECT value FROM json_each(?))",
+        (time.time(), json.dumps(job_ids)),
+    )
+
+
+def requeue_orphaned_jobs_op(conn, stale_before: float) -> int:
+    """
+    Running jobs whose worker stopped beating (dead process) go back to the
+    queue; jobs still owned by a live worker – in this or another process – stay.
+    """
+    cur = conn.execute(
+        """
+        UPDATE jobs SET status = 'queued', started_at = NULL, progress = 0.0, worker_id = NULL, heartbeat_at = NULL
+        WHERE status = 'running' AND COALESCE(heartbeat_at, started_at, 0) < ?
+        """,
+        (stale_before,),
+    )
+    return cur.rowcount
+
+
+def has_queued_jobs() -> bool:
+    conn = get_conn()
+    row = conn.execute("SELECT 1 FROM jobs WHERE status = 'queued' LIMIT 1").fetchone()
+    conn.close()
+    return row is not None
+
+
+def fetch_jobs(limit: int = 100) -> pd.DataFrame:
+    conn = get_conn()
+    df = pd.read_sql_query(
+        """
+        SELECT id, kind, status, progress, message, error, result_name,
+               created_at, started_at, finished_at, cancel_requested
+        FROM jobs ORDER BY created_at DESC LIMIT ?
+        """,
+        conn,
+        params=(limit,),
+    )
+    conn.close()
+    return df
+
+
+def fetch_job_result(job_id: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """(text, download name, file path) – file results are streamed to disk instead of stored."""
+    conn = get_conn()
+    row = conn.execute("SELECT result, result_name, result_path FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    conn.close()
+    return (row["result"], row["result_name"], row["result_path"]) if row else (None, None, None)
+
+
+class JobContext:
+    """Handed to job handlers: progress reporting + cooperative cancellation."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+
+    def progress(self, fraction: float, message: str = ""):
+        self.check_cancelled()
+        submit_write(update_job_op, self.job_id, progress=min(1.0, max(0.0, fraction)), message=message)
+
+    def check_cancelled(self):
+        conn = get_conn()
+        row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (self.job_id,)).fetchone()
+        conn.close()
+        if row and row["cancel_requested"]:
+            raise JobCancelled()
+
+
+def job_ad_variants(ctx: JobContext, params: Dict) -> Dict:
+    """Generate + save N ad variants (the Ad Builder's multi-variant run)."""
+    hooks = params["hook_styles"]
+    provider = params["provider"]
+    if params.get("batch") and provider in AI_PROVIDERS:
+        ctx.progress(0.0, f"Asking {provider} for {len(hooks)} variants")
+        gens = generate_ad_variants_with_ai(
+            provider, params["offer_name"], params["offer_type"], params["audience"], params["promise"], hooks,
+            hedge_provider=params.get("hedge_provider"),
+        )
     else:
-        headline = f"Explore Trusted {category_phrase.title()}"
+        gens = []
+        for i, hs in enumerate(hooks):
+            ctx.progress(i / len(hooks), f"Generating variant {i + 1} of {len(hooks)}")
+            gens.append(
+                generate_ad_with_ai(
+                    provider, params["offer_name"], params["offer_type"], params["audience"], params["promise"], hs,
+                    hedge_provider=params.get("hedge_provider"),
+                )
+            )
+    ctx.progress(0.9, "Saving")
+    pending = []
+    for i, (hs, gen) in enumerate(zip(hooks, gens), start=1):
+        pending.append(
+            submit_write(
+                insert_ad_op,
+                program_id=params["program_id"],
+                title=f"{params['title']} – {hs} v{i}" if params.get("mixed") else f"{params['title']} v{i}",
+                angle=hs,
+                headline=gen["headline"],
+                body=gen["body"],
+                call_to_action=params.get("cta") or gen["cta"],
+                placement_type=params["placement_type"],
+                traffic_source=params["traffic_source"],
+                campaign_notes=params["campaign_notes"],
+            )
+        )
+    created_ids = [fut.result() for fut in pending]
+    result = {"ad_ids": created_ids}
+    scores = score_creatives(
+        [
+            {"headline": g["headline"], "call_to_action": params.get("cta") or g["cta"],
+             "traffic_source": params["traffic_source"], "placement_type": params["placement_type"]}
+            for g in gens
+        ]
+    )
+    if scores:
+        best = max(range(len(scores)), key=scores.__getitem__)
+        result.update(best_ad_id=created_ids[best], best_predicted_ctr=scores[best])
+    return result
 
-    body_lines = [
-        f"{offer_name} is for {audience} who want to {promise}.",
-        f"Browse trusted {category_phrase} with fast, discreet service.",
-        "No pressure, no drama — just adults choosing what works for them.",
+
+def job_export_ads_csv(ctx: JobContext, params: Dict) -> Dict:
+    """Ads & metrics CSV, read and written chunk by chunk so progress can be reported."""
+    sql, columns = build_ads_metrics_sql(None, False)
+    conn = get_conn()
+    total = conn.execute("SELECT COUNT(*) FROM ad_creatives").fetchone()[0]
+    out = io.StringIO()
+    done = 0
+    for chunk in pd.read_sql_query(sql, conn, chunksize=params.get("chunksize", 5_000)):
+        chunk.to_csv(out, index=False, header=(done == 0))
+        done += len(chunk)
+        ctx.progress(done / max(1, total), f"{done} of {total} rows")
+    conn.close()
+    if params.get("include_archived"):
+        archived = archived_metrics_df(columns, False)
+        if not archived.empty:
+            archived.to_csv(out, index=False, header=(done == 0))
+            done += len(archived)
+    return {"text": out.getvalue(), "name": "xxx_ads_with_performance.csv", "rows": done}
+
+
+def job_import_metrics_csv(ctx: JobContext, params: Dict) -> Dict:
+    """Upsert ad_id + metric columns from a CSV, in writer batches."""
+    df = pd.read_csv(io.StringIO(params["csv"]))
+    missing = [c for c in ["ad_id"] + METRIC_COLUMNS if c not in df.columns]
+    if missing:
+        raise ValueError(f"CSV is missing columns: {', '.join(missing)}")
+    df = df[["ad_id"] + METRIC_COLUMNS].dropna(subset=["ad_id"]).fillna(0)
+    conn = get_conn()
+    known = {r[0] for r in conn.execute("SELECT id FROM ad_creatives")}
+    conn.close()
+    n_read = len(df)
+    df = df[df["ad_id"].astype(int).isin(known)]
+    rows = [
+        (int(a), int(i), int(c), int(l), int(s), float(r))
+        for a, i, c, l, s, r in df.itertuples(index=False, name=None)
     ]
-    body = " ".join(body_lines)
+    step = 1_000
+    for start in range(0, len(rows), step):
+        ctx.progress(start / max(1, len(rows)), f"{start} of {len(rows)} rows")
+        bulk_update_performance(rows[start : start + step], evaluate_rules=False)
+    if rows:
+        queue_rule_evaluation([r[0] for r in rows])  # once for the whole file
+    return {"rows": len(rows), "skipped": n_read - len(rows)}
+
+
+def job_import_cohort_csv(ctx: JobContext, params: Dict) -> Dict:
+    """Signups / rev-share payouts from a CSV into the cohort matrices, in writer batches."""
+    signups, payouts = parse_cohort_csv(params["csv"])
+    step = 5_000
+    totals = {"signups": 0, "payouts": 0, "skipped": 0}
+    for start in range(0, max(len(signups), len(payouts)), step):
+        ctx.progress(start / max(1, len(signups), len(payouts)), f"{start} rows")
+        done = record_cohort_events(
+            signups[start : start + step], payouts[start : start + step], params.get("add_to_totals", True)
+        )
+        for k in totals:
+            totals[k] += done[k]
+    return totals
 
-    cta = "Tap to explore today’s offers."
 
-    return {
-        "headline": headline,
-        "body": textwrap.fill(body, width=70),
-        "cta": cta,
-    }
+def job_evaluate_rules(ctx: JobContext, params: Dict) -> Dict:
+    ad_ids = params.get("ad_ids")
+    ctx.progress(0.0, f"Evaluating rules on {len(ad_ids)} ads" if ad_ids else "Evaluating rules on all ads")
+    applied = apply_rules(ad_ids)
+    return {"changes": len(applied)}
 
 
-# =========================
-# AI-powered generator
-# =========================
+def job_compliance_rescan(ctx: JobContext, params: Dict) -> Dict:
+    ctx.progress(0.0, "Linting creatives")
+    return rescan_compliance(progress=ctx.progress)
 
-def generate_ad_with_ai(
-    provider: str,
-    offer_name: str,
-    offer_type: str,
-    audience: str,
-    promise: str,
-    hook_style: str,
-) -> Dict[str, str]:
-    """
-    Use OpenAI / Claude / Gemini if keys are configured.
-    Falls back to local generator if anything fails.
-    """
-    base = generate_ad_from_brief(offer_name, offer_type, audience, promise, hook_style)
 
-    if provider == "Built-in (no API)":
-        return base
+def job_render_banners(ctx: JobContext, params: Dict) -> Dict:
+    ids = set(params["ad_ids"]) if params.get("ad_ids") else None
+    ads = [a for a in fetch_ads() if ids is None or a["id"] in ids]
+    ctx.progress(0.0, f"Rendering banners for {len(ads)} ads")
+    started = time.perf_counter()
+    results = render_banners(ads, params["sizes"], params.get("format", "PNG"), progress=ctx.progress)
+    rendered = [r["ms"] for r in results if not r["cached"]]
+    return {
+        "banners": len(results),
+        "rendered": len(rendered),
+        "cached": len(results) - len(rendered),
+        "avg_render_ms": round(statistics.fmean(rendered), 1) if rendered else 0.0,
+        "ms": round((time.perf_counter() - started) * 1000, 1),
+    }
 
-    brief = f'''
-You are an experienced adult affiliate copywriter. Write a short, non-explicit ad
-for an adult offer. Focus on benefits, privacy, and discretion. NO explicit words.
 
-Offer name: {offer_name}
-Offer type: {offer_type}
-Audience: {audience}
-Main promise: {promise}
-Hook style: {hook_style}
+def job_bulk_export(ctx: JobContext, params: Dict) -> Dict:
+    """Stream a network bulk-upload file to EXPORT_DIR (never held in memory)."""
+    fmt = params["format"]
+    name = bulk_export_filename(fmt)
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f"{ctx.job_id}_{name}")
+    started = time.perf_counter()
+    kind, _ = BULK_EXPORT_FORMATS[fmt]
+    with open(path, "w", encoding="utf-8", newline="") if kind == "csv" else open(path, "wb") as f:
+        rows = run_bulk_export(fmt, f, params.get("filters"), progress=ctx.progress)
+    return {"path": path, "name": name, "rows": rows, "ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+def job_train_ctr_model(ctx: JobContext, params: Dict) -> Dict:
+    ctx.progress(0.0, "Training CTR scorer")
+    return get_ctr_scorer().fit(full=params.get("full", True))
+
+
+def job_backup(ctx: JobContext, params: Dict) -> Dict:
+    meta = run_backup(progress=lambda f: ctx.progress(f, "Copying pages"), label="manual")
+    return {"snapshot": meta["id"], "ms": round(meta["total_ms"], 1)}
+
+
+# kind -> handler(ctx, params) -> result dict. A result may carry "text" (or
+# "path" to a file it wrote) + "name" to offer a download on the Jobs page.
+JOB_HANDLERS: Dict[str, Callable[[JobContext, Dict], Dict]] = {
+    "ad_variants": job_ad_variants,
+    "export_ads_csv": job_export_ads_csv,
+    "import_metrics_csv": job_import_metrics_csv,
+    "import_cohort_csv": job_import_cohort_csv,
+    "evaluate_rules": job_evaluate_rules,
+    "compliance_rescan": job_compliance_rescan,
+    "render_banners": job_render_banners,
+    "bulk_export": job_bulk_export,
+    "train_ctr_model": job_train_ctr_model,
+    "backup": job_backup,
+}
 
-Return ONLY valid JSON with keys: headline, body, cta.
-'''
 
-    try:
-        if provider == "OpenAI":
-            api_key = st.secrets.get("OPENAI_API_KEY")
-            if not api_key:
-                return base
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-            }
-            payload = {
-                "model": "gpt-4.1-mini",
-                "messages": [
-                    {"role": "system", "content": "You write short, clean ad copy."},
-                    {"role": "user", "content": brief.strip()},
-                ],
-                "temperature": 0.7,
-            }
-            resp = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=15,
-            )
-            data = resp.json()
-            content = data["choices"][0]["message"]["content"]
-            parsed = json.loads(content)
-            return {
-                "headline": parsed.get("headline", base["headline"]),
-                "body": parsed.get("body", base["body"]),
-                "cta": parsed.get("cta", base["cta"]),
+class JobRunner:
+    """Worker pool pulling jobs from the SQLite queue (one pool per process)."""
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.wake = threading.Event()
+        self.active: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.last_purge = 0.0
+        self.last_requeue = time.time()
+        self.runner_id = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        submit_write(requeue_orphaned_jobs_op, time.time() - JOB_STALE_SECONDS).result()
+        for i in range(workers):
+            threading.Thread(target=self._loop, args=(f"{self.runner_id}/{i}",), name=f"xxx-job-{i}", daemon=True).start()
+        threading.Thread(target=self._heartbeat, name="xxx-job-heartbeat", daemon=True).start()
+
+    def notify(self):
+        self.wake.set()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+            with self._lock:
+                running = list(self.active)
+            try:
+                if running:
+                    submit_write(heartbeat_jobs_op, running).result()
+                if time.time() - self.last_requeue >= JOB_STALE_SECONDS:
+                    self.last_requeue = time.time()
+                    if submit_write(requeue_orphaned_jobs_op, time.time() - JOB_STALE_SECONDS).result():
+                        self.notify()
+            except Exception:
+                pass
+
+    def _loop(self, worker_id: str):
+        while True:
+            try:
+                # Cheap read first so idle workers don't queue empty writes.
+                job = submit_write(claim_job_op, worker_id).result() if has_queued_jobs() else None
+            except Exception:
+                job = None
+            if job is None:
+                self._maybe_purge()
+                self.wake.wait(JOB_POLL_SECONDS)
+                self.wake.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job: Dict):
+        job_id = job["id"]
+        with self._lock:
+            self.active[job_id] = threading.current_thread().name
+        _job_context.session_id = job.get("session_id")
+        _job_context.warnings = []
+        fields = {}
+        try:
+            handler = JOB_HANDLERS[job["kind"]]
+            result = handler(JobContext(job_id), json.loads(job["params"] or "{}")) or {}
+            text = result.pop("text", None)
+            name = result.pop("name", None)
+            path = result.pop("path", None)
+            message = f"Finished · {json.dumps(result)}" if result else "Finished"
+            if _job_context.warnings:
+                message += " · " + "; ".join(dict.fromkeys(_job_context.warnings))
+            fields = {
+                "status": "done",
+                "progress": 1.0,
+                "message": message,
+                "result": text if text is not None else json.dumps(result),
+                "result_name": name,
+                "result_path": path,
             }
+        except JobCancelled:
+            fields = {"status": "cancelled", "message": "Cancelled"}
+        except Exception as e:
+            fields = {"status": "failed", "error": str(e)}
+        finally:
+            del _job_context.session_id, _job_context.warnings
+            fields["finished_at"] = time.time()
+            submit_write(update_job_op, job_id, **fields).result()
+            with self._lock:
+                self.active.pop(job_id, None)
+
+    def _maybe_purge(self):
+        if time.time() - self.last_purge < 600:
+            return
+        self.last_purge = time.time()
+        retention = float(get_secret("JOB_RETENTION_HOURS", JOB_RETENTION_HOURS)) * 3600
+        submit_write(purge_jobs_op, time.time() - retention)
+        prune_export_files(time.time() - retention)
+
+
+@st.cache_resource
+def get_job_runner() -> JobRunner:
+    init_db()
+    return JobRunner(int(get_secret("JOB_WORKERS", JOB_WORKERS)))
 
-        elif provider == "Claude (Anthropic)":
-            api_key = st.secrets.get("ANTHROPIC_API_KEY")
-            if not api_key:
-                return base
-            headers = {
-                "x-api-key": api_key,
-                "anthropic-version": "2023-06-01",
-                "content-type": "application/json",
-            }
-            payload = {
-                "model": "claude-3-haiku-20240307",
-                "max_tokens": 400,
-                "messages": [
-                    {"role": "user", "content": brief.strip()},
-                ],
-            }
-            resp = requests.post(
-                "https://api.anthropic.com/v1/messages",
-                headers=headers,
-                json=payload,
-                timeout=20,
-            )
-            data = resp.json()
-            text_blocks = [
-                block.get("text", "")
-                for block in data.get("content", [])
-                if block.get("type") == "text"
-            ]
-            content = "".join(text_blocks)
-            parsed = json.loads(content)
-            return {
-                "headline": parsed.get("headline", base["headline"]),
-                "body": parsed.get("body", base["body"]),
-                "cta": parsed.get("cta", base["cta"]),
-            }
 
-        elif provider == "Gemini":
-            api_key = st.secrets.get("GEMINI_API_KEY")
-            if not api_key:
-                return base
-            url = (
-                "https://generativelanguage.googleapis.com/v1beta/"
-                "models/gemini-1.5-flash:generateContent"
-            )
-            params = {"key": api_key}
-            payload = {
-                "contents": [
-                    {
-                        "parts": [
-                            {"text": brief.strip()}
-                        ]
-                    }
-                ]
-            }
-            resp = requests.post(url, params=params, json=payload, timeout=20)
-            data = resp.json()
-            text = (
-                data.get("candidates", [{}])[0]
-                .get("content", {})
-                .get("parts", [{}])[0]
-                .get("text", "")
-            )
-            parsed = json.loads(text)
-            return {
-                "headline": parsed.get("headline", base["headline"]),
-                "body": parsed.get("body", base["body"]),
-                "cta": parsed.get("cta", base["cta"]),
-            }
-        else:
-            return base
-    except Exception as e:
-        st.warning(f"AI generation failed ({provider}): {e}")
-        return base
+def submit_job(kind: str, params: Dict) -> str:
+    """Queue a job and wake a worker; returns the job id."""
+    job_id = uuid.uuid4().hex[:12]
+    submit_write(submit_job_op, job_id, kind, params, current_session_id()).result()
+    get_job_runner().notify()
+    return job_id
+
+
+def cancel_job(job_id: str):
+    submit_write(cancel_job_op, job_id).result()
 
 
 # =========================
@@ -747,21 +6582,21 @@ def page_dashboard():
 
     with col2:
         programs = fetch_programs()
-        ads = fetch_ads()
+        include_archived = st.checkbox("Include archived creatives", value=True, key="dashboard_archived")
+        ads = fetch_ads(include_archived=include_archived)
 
         st.markdown('<div class="xxx-card">', unsafe_allow_html=True)
         st.markdown("### Snapshot", unsafe_allow_html=True)
         st.write(f"**Programs tracked:** {len(programs)}")
         st.write(f"**Ad creatives saved:** {len(ads)}")
 
-        df_ads = fetch_ads_with_metrics_df()
-        if not df_ads.empty:
-            df_ads_filled = df_ads.fillna(0)
-            total_impr = int(df_ads_filled["impressions"].sum())
-            total_clicks = int(df_ads_filled["clicks"].sum())
-            total_leads = int(df_ads_filled["leads"].sum())
-            total_sales = int(df_ads_filled["sales"].sum())
-            total_revenue = float(df_ads_filled["revenue"].sum())
+        if ads:
+            totals = fetch_kpi_totals(include_archived)
+            total_impr = totals["impressions"]
+            total_clicks = totals["clicks"]
+            total_leads = totals["leads"]
+            total_sales = totals["sales"]
+            total_revenue = totals["revenue"]
 
             st.write(f"**Total impressions logged:** {total_impr}")
             st.write(f"**Total clicks logged:** {total_clicks}")
@@ -909,6 +6744,19 @@ def page_ad_builder():
             help="Built-in requires no keys. The others need API keys in Streamlit secrets.",
         )
 
+        hedge_choice = st.selectbox(
+            "Hedge with (fastest wins)",
+            ["Off"] + list(AI_PROVIDERS),
+            help="If the main engine is slower than its usual (median) latency, the brief is also "
+            "sent to this engine and the first valid answer is used.",
+        )
+
+        stream_output = st.checkbox(
+            "Stream AI output live",
+            value=True,
+            help="Show headline/body as the AI writes them (external engines only).",
+        )
+
         auto_generate = st.checkbox("Auto-generate copy from this brief", value=True)
 
         manual_headline = st.text_input("Headline (optional, overrides auto for single ad)")
@@ -930,15 +6778,46 @@ def page_ad_builder():
             value=1,
             help="Use 1 for a single ad, or generate multiple variants with different angles.",
         )
+        batch_variants = st.checkbox(
+            "Generate all variants in one AI request",
+            value=True,
+            help="Sends the brief once and asks for every variant as a JSON array (fewer calls and tokens). "
+            "The request is hedged if a hedge engine is set; it is not streamed.",
+        )
+        run_in_background = st.checkbox(
+            "Run multi-variant generation in the background",
+            value=False,
+            help="Queues the run as a job – it keeps going if you switch pages or close the tab. "
+            "Track it on the Jobs page.",
+        )
 
         submitted = st.form_submit_button("✨ Generate & Save")
 
     if submitted:
+        if ai_provider in AI_PROVIDERS and get_ai_breakers().get(ai_provider).is_open():
+            st.info(f"{ai_provider} is failing right now (circuit open) – skipping it until it recovers.")
+        hedge_provider = None if hedge_choice == "Off" else hedge_choice
+        on_partial = None
+        if stream_output and ai_provider in AI_PROVIDERS and not hedge_provider:
+            live = st.container()
+            live_meta = live.empty()
+            live_headline = live.empty()
+            live_body = live.empty()
+
+            def on_partial(fields, ttft):
+                live_meta.caption(f"Streaming from {ai_provider} · first token after {ttft * 1000:.0f} ms")
+                if fields.get("headline"):
+                    live_headline.markdown(f"**{fields['headline']}**")
+                if fields.get("body"):
+                    live_body.text(fields["body"])
+
         if num_variants == 1:
             # Single ad
             if auto_generate:
                 gen = generate_ad_with_ai(
-                    ai_provider, offer_name, offer_type, audience, promise, hook_style
+                    ai_provider, offer_name, offer_type, audience, promise, hook_style,
+                    on_partial=on_partial,
+                    hedge_provider=hedge_provider,
                 )
                 headline = manual_headline.strip() or gen["headline"]
                 body = manual_body.strip() or gen["body"]
@@ -973,6 +6852,16 @@ def page_ad_builder():
                 },
             )
             st.success("Ad creative generated and saved.")
+            lint = fetch_compliance(ad_id)
+            if lint and lint["issues"]:
+                st.markdown(f"**Compliance: {lint['status'].upper()}** – saved, but review before uploading:")
+                show_compliance_issues(lint["issues"])
+            scores = score_creatives(
+                [{"headline": headline, "call_to_action": cta, "traffic_source": traffic_source.strip(),
+                  "placement_type": placement_type.strip()}]
+            )
+            if scores:
+                st.caption(f"Predicted CTR (local model): {scores[0]:.2f}%")
         else:
             # Multi-variant generator
             if not auto_generate:
@@ -987,11 +6876,57 @@ def page_ad_builder():
             else:
                 hooks_sequence = [hook_style for _ in range(num_variants)]
 
-            created_ids = []
-            for i, hs in enumerate(hooks_sequence, start=1):
-                gen = generate_ad_with_ai(
-                    ai_provider, offer_name, offer_type, audience, promise, hs
+            if run_in_background:
+                job_id = submit_job(
+                    "ad_variants",
+                    {
+                        "provider": ai_provider,
+                        "hedge_provider": hedge_provider,
+                        "batch": batch_variants,
+                        "offer_name": offer_name,
+                        "offer_type": offer_type,
+                        "audience": audience,
+                        "promise": promise,
+                        "hook_styles": hooks_sequence,
+                        "mixed": hook_style == "Mix: Use multiple angles",
+                        "program_id": chosen_program_id,
+                        "title": ad_title.strip(),
+                        "cta": manual_cta.strip(),
+                        "placement_type": placement_type.strip(),
+                        "traffic_source": traffic_source.strip(),
+                        "campaign_notes": campaign_notes.strip(),
+                    },
+                )
+                st.success(f"Queued job `{job_id}` for {num_variants} variants – see the Jobs page.")
+                render_footer()
+                return
+
+            if batch_variants and ai_provider in AI_PROVIDERS:
+                if on_partial is not None:
+                    st.caption("Live streaming is off for one-request batches – all variants arrive together.")
+                gens = generate_ad_variants_with_ai(
+                    ai_provider, offer_name, offer_type, audience, promise, hooks_sequence,
+                    hedge_provider=hedge_provider,
                 )
+                from_ai = sum(1 for g in gens if g["source"] == "ai")
+                if from_ai < len(gens):
+                    st.info(
+                        f"{from_ai} of {len(gens)} variants came from {ai_provider}; "
+                        "the rest were filled by the built-in generator."
+                    )
+            else:
+                gens = [
+                    generate_ad_with_ai(
+                        ai_provider, offer_name, offer_type, audience, promise, hs,
+                        on_partial=on_partial,
+                        hedge_provider=hedge_provider,
+                    )
+                    for hs in hooks_sequence
+                ]
+
+            # Queue every insert first so the writer commits them as one batch.
+            pending = []
+            for i, (hs, gen) in enumerate(zip(hooks_sequence, gens), start=1):
                 headline = gen["headline"]
                 body = gen["body"]
                 cta = manual_cta.strip() or gen["cta"]
@@ -1001,18 +6936,21 @@ def page_ad_builder():
                 else:
                     title_variant = f"{ad_title.strip()} v{i}"
 
-                ad_id = insert_ad(
-                    program_id=chosen_program_id,
-                    title=title_variant,
-                    angle=hs,
-                    headline=headline,
-                    body=body,
-                    call_to_action=cta,
-                    placement_type=placement_type.strip(),
-                    traffic_source=traffic_source.strip(),
-                    campaign_notes=campaign_notes.strip(),
+                pending.append(
+                    submit_write(
+                        insert_ad_op,
+                        program_id=chosen_program_id,
+                        title=title_variant,
+                        angle=hs,
+                        headline=headline,
+                        body=body,
+                        call_to_action=cta,
+                        placement_type=placement_type.strip(),
+                        traffic_source=traffic_source.strip(),
+                        campaign_notes=campaign_notes.strip(),
+                    )
                 )
-                created_ids.append(ad_id)
+            created_ids = [fut.result() for fut in pending]
 
             trigger_zap(
                 "bulk_ads_created",
@@ -1024,17 +6962,30 @@ def page_ad_builder():
                 },
             )
             st.success(f"{num_variants} ad variants generated and saved.")
+            flagged = [c for c in map(fetch_compliance, created_ids) if c and c["status"] != "pass"]
+            if flagged:
+                st.warning(
+                    f"{len(flagged)} of {len(created_ids)} variants were flagged by the compliance linter "
+                    "(see the Compliance page)."
+                )
+            show_variant_ranking(created_ids)
 
     st.markdown("---")
     st.markdown("### Saved Ad Creatives")
 
-    ads = fetch_ads()
+    include_archived = st.checkbox("Include archived creatives", value=False, key="builder_archived")
+    ads = fetch_ads(include_archived=include_archived)
     if not ads:
         st.info("No ads yet. Use the form above to generate your first creative.")
     else:
+        perfs = get_performance_for_ads([ad["id"] for ad in ads if "archived_at" not in ad])
         for ad in ads:
-            perf = get_performance_for_ad(ad["id"])
-            with st.expander(f"{ad['title']} · {ad['program_name'] or 'Unknown Program'}"):
+            # Archived rows already carry their metrics.
+            perf = ad if "archived_at" in ad else perfs[ad["id"]]
+            status = "Archived" if "archived_at" in ad else ad["status"]
+            with st.expander(
+                f"{ad['title']} · {ad['program_name'] or 'Unknown Program'} · {status or 'Active'}"
+            ):
                 st.write(f"**Program:** {ad['program_name']}")
                 st.write(f"**Placement:** {ad['placement_type']}")
                 st.write(f"**Traffic Source:** {ad['traffic_source'] or 'N/A'}")
@@ -1059,19 +7010,123 @@ def page_ad_builder():
     render_footer()
 
 
-def page_performance():
-    render_header()
-    st.subheader("📊 Performance Tracker")
-    st.markdown(
-        "Log impressions, clicks, leads, sales, and revenue per ad creative so you can see "
-        "what’s working by angle and traffic source."
+BULK_GRID_PAGE_SIZES = [50, 100, 200, 500]
+
+
+@st.fragment
+def render_bulk_metrics_grid():
+    """
+    Spreadsheet-style editor over all ads. Edits are diffed against the
+    frame that was loaded and only changed rows are upserted – in one
+    transaction, with one webhook event.
+    """
+    grid = fetch_ads_with_metrics_df(
+        columns=["ad_id", "program_name", "traffic_source", "title", "status"] + METRIC_COLUMNS
+    )
+    if grid.empty:
+        st.info("No ads to edit.")
+        return
+    grid[METRIC_COLUMNS] = grid[METRIC_COLUMNS].fillna(0)
+    grid[COUNTER_COLUMNS] = grid[COUNTER_COLUMNS].astype("int64")
+
+    f1, f2, f3 = st.columns([1, 1, 1.4])
+    with f1:
+        programs = sorted(grid["program_name"].dropna().unique().tolist())
+        program_pick = st.multiselect("Program", programs, key="bulk_program")
+    with f2:
+        sources = sorted(grid["traffic_source"].dropna().unique().tolist())
+        source_pick = st.multiselect("Traffic source", sources, key="bulk_source")
+    with f3:
+        title_q = st.text_input("Title contains", key="bulk_title")
+    if program_pick:
+        grid = grid[grid["program_name"].isin(program_pick)]
+    if source_pick:
+        grid = grid[grid["traffic_source"].isin(source_pick)]
+    if title_q:
+        grid = grid[grid["title"].fillna("").str.contains(title_q, case=False, regex=False)]
+
+    p1, p2 = st.columns([1, 1])
+    with p1:
+        page_size = st.selectbox("Rows per page", BULK_GRID_PAGE_SIZES, key="bulk_page_size")
+    n_pages = max(1, -(-len(grid) // page_size))
+    with p2:
+        page_no = st.number_input("Page", min_value=1, max_value=n_pages, value=1, step=1, key="bulk_page")
+    loaded = grid.iloc[(page_no - 1) * page_size : page_no * page_size].reset_index(drop=True)
+    st.caption(f"{len(grid)} ads match · page {page_no} of {n_pages}. Save before switching pages or filters.")
+
+    # Keyed on this session's save count: the editor resets after our own save,
+    # not whenever any other write moves the data version.
+    edited = st.data_editor(
+        loaded,
+        key=f"bulk_grid_{st.session_state.get('bulk_grid_saves', 0)}",
+        hide_index=True,
+        width="stretch",
+        num_rows="fixed",
+        disabled=["ad_id", "program_name", "traffic_source", "title", "status"],
+        column_config={
+            **{
+                col: st.column_config.NumberColumn(col.capitalize(), min_value=0, step=1, format="%d")
+                for col in COUNTER_COLUMNS
+            },
+            "revenue": st.column_config.NumberColumn("Revenue ($)", min_value=0.0, step=0.01, format="%.2f"),
+        },
     )
 
-    ads = fetch_ads()
-    if not ads:
-        st.info("No ads yet. Create some on the 'Ad Builder' page first.")
-        render_footer()
+    saved = st.session_state.pop("bulk_saved", None)
+    if saved:
+        st.success(f"Saved {saved} row(s) in one transaction – rules are evaluated in a background job.")
+
+    changes = diff_metrics(loaded, edited)
+    if changes.empty:
+        st.caption("No unsaved edits.")
         return
+    st.write(f"**{len(changes)} row(s) changed.**")
+    if st.button("💾 Save All Changes", key="bulk_save"):
+        rows = list(changes[["ad_id"] + METRIC_COLUMNS].itertuples(index=False, name=None))
+        rows = [(int(a), int(i), int(c), int(l), int(s), float(r)) for a, i, c, l, s, r in rows]
+        bulk_update_performance(rows)
+        trigger_zap(
+            "performance_bulk_updated",
+            {"count": len(rows), "rows": [dict(zip(["ad_id"] + METRIC_COLUMNS, r)) for r in rows]},
+        )
+        st.session_state["bulk_saved"] = len(rows)
+        st.session_state["bulk_grid_saves"] = st.session_state.get("bulk_grid_saves", 0) + 1
+        safe_rerun()
+
+
+@metered_cache("metrics_df", show_spinner=False, max_entries=8)
+def cached_metrics_df(data_version: int, columns: Tuple[str, ...], include_archived: bool = False) -> pd.DataFrame:
+    """Compact metrics frame, re-read only when data_version moves."""
+    return fetch_ads_with_metrics_df(
+        columns=list(columns),
+        compact=True,
+        chunksize=METRICS_CHUNK_ROWS,
+        include_archived=include_archived,
+    )
+
+
+@metered_cache("ads", show_spinner=False, max_entries=4)
+def cached_ads(data_version: int) -> List[Dict]:
+    return [dict(ad) for ad in fetch_ads()]
+
+
+def flash(key: str, message: str):
+    """Show `message` after the full rerun triggered by a save."""
+    st.session_state[f"flash_{key}"] = message
+    safe_rerun()
+
+
+def show_flash(key: str):
+    message = st.session_state.pop(f"flash_{key}", None)
+    if message:
+        st.success(message)
+
+
+@st.fragment
+def perf_editor_fragment():
+    """Ad selector + status + totals form; only this block reruns while picking ads."""
+    ads = cached_ads(get_data_version())
+    show_flash("perf_editor")
 
     ad_labels = [
         f"{ad['id']} – {ad['title']} ({ad['program_name'] or 'Unknown Program'})"
@@ -1082,7 +7137,7 @@ def page_performance():
     ad_choice = st.selectbox("Select Ad to Update", ad_labels)
     idx = ad_labels.index(ad_choice)
     chosen_ad_id = ad_ids[idx]
-    chosen_ad = [a for a in ads if a["id"] == chosen_ad_id][0]
+    chosen_ad = ads[idx]
 
     perf = get_performance_for_ad(chosen_ad_id)
 
@@ -1094,6 +7149,25 @@ def page_performance():
         st.write(f"**Campaign Notes:** {chosen_ad['campaign_notes']}")
     st.write(f"**Headline:** {chosen_ad['headline']}")
 
+    current_status = chosen_ad["status"] if chosen_ad["status"] in AD_STATUSES else "Active"
+    col_status, col_status_btn = st.columns([2, 1])
+    with col_status:
+        new_status = st.selectbox(
+            "Status",
+            AD_STATUSES,
+            index=AD_STATUSES.index(current_status),
+            help=(
+                f"{' / '.join(ARCHIVE_STATUSES)} creatives are moved to the archive by the background job "
+                f"once idle for {ARCHIVE_AFTER_DAYS} days."
+            ),
+        )
+    with col_status_btn:
+        st.write("")
+        if st.button("Update Status") and new_status != current_status:
+            update_ad_status(chosen_ad_id, new_status)
+            trigger_zap("ad_status_changed", {"ad_id": chosen_ad_id, "status": new_status})
+            flash("perf_editor", f"Status set to {new_status}.")
+
     st.markdown("---")
     st.markdown("### Update Performance (Totals)")
 
@@ -1136,7 +7210,7 @@ def page_performance():
         )
 
     if st.button("💾 Save Metrics"):
-        update_performance(chosen_ad_id, impressions, clicks, leads, sales, revenue)
+        rule_changes = update_performance(chosen_ad_id, impressions, clicks, leads, sales, revenue)
         trigger_zap(
             "performance_updated",
             {
@@ -1148,131 +7222,251 @@ def page_performance():
                 "revenue": revenue,
             },
         )
-        st.success("Performance updated.")
+        msg = "Performance updated."
+        for ch in rule_changes:
+            msg += f" Rule '{ch['rule']}' set it to {ch['status']}."
+        # Full rerun so the tables below pick up the new numbers.
+        flash("perf_editor", msg)
+
+
+PER_AD_COLUMNS = (
+    "ad_id",
+    "program_name",
+    "traffic_source",
+    "title",
+    "campaign_notes",
+    "impressions",
+    "clicks",
+    "leads",
+    "sales",
+    "revenue",
+)
 
-    st.markdown("---")
-    st.markdown("### Per-Ad Overview")
 
-    df = fetch_ads_with_metrics_df()
+@st.fragment
+def per_ad_table_fragment():
+    df = cached_metrics_df(get_data_version(), PER_AD_COLUMNS)
     if df.empty:
         st.info("No performance data yet.")
-    else:
-        df_show = df.copy().fillna(0)
-        df_show["CTR_%"] = df_show.apply(
-            lambda r: (r["clicks"] / r["impressions"] * 100) if r["impressions"] else 0.0,
-            axis=1,
-        )
-        df_show["CR_sales_%"] = df_show.apply(
-            lambda r: (r["sales"] / r["clicks"] * 100) if r["clicks"] else 0.0,
-            axis=1,
-        )
-        df_show["EPC"] = df_show.apply(
-            lambda r: (r["revenue"] / r["clicks"]) if r["clicks"] else 0.0,
-            axis=1,
-        )
-        st.dataframe(
-            df_show[
-                [
-                    "ad_id",
-                    "program_name",
-                    "traffic_source",
-                    "title",
-                    "campaign_notes",
-                    "impressions",
-                    "clicks",
-                    "leads",
-                    "sales",
-                    "revenue",
-                    "CTR_%",
-                    "CR_sales_%",
-                    "EPC",
-                ]
+        return
+    df_show = add_kpi_columns(df)
+    st.dataframe(df_show[list(PER_AD_COLUMNS) + ["CTR_%", "CR_sales_%", "EPC"]])
+
+
+@st.fragment
+def network_summary_fragment():
+    grouped = get_rollup(["traffic_source"])
+    if grouped.empty:
+        st.info("No data yet for network summaries.")
+        return
+    st.dataframe(
+        grouped[
+            [
+                "traffic_source",
+                "impressions",
+                "clicks",
+                "leads",
+                "sales",
+                "revenue",
+                "CTR_%",
+                "CR_sales_%",
+                "EPC",
             ]
+        ]
+    )
+
+
+@st.fragment
+def rollup_explorer_fragment():
+    if not cached_ads(get_data_version()):
+        st.info("No data yet for rollups.")
+        return
+
+    dims = st.multiselect(
+        "Group by",
+        list(CUBE_DIMENSIONS),
+        default=["program_name", "traffic_source"],
+        help="Aggregated in SQLite and cached until the data changes – any combination is instant.",
+    )
+    rollup = get_rollup(dims)
+
+    # Optional filters on the grouped dimensions
+    if dims:
+        filter_cols = st.columns(len(dims))
+        for col, dim in zip(filter_cols, dims):
+            with col:
+                values = sorted(rollup[dim].dropna().unique().tolist())
+                picked = st.multiselect(f"Filter {dim}", values)
+                if picked:
+                    rollup = rollup[rollup[dim].isin(picked)]
+
+    st.dataframe(rollup, width="stretch")
+
+    if len(dims) == 2:
+        kpi = st.selectbox("Pivot KPI", ["revenue", "clicks", "EPC", "CTR_%", "CR_sales_%"])
+        st.dataframe(
+            rollup.pivot_table(index=dims[0], columns=dims[1], values=kpi, aggfunc="sum").fillna(0),
+            width="stretch",
         )
 
+
+@st.fragment
+def campaign_dimensions_fragment():
+    """Group/filter by the GEO, device, bid and daypart parsed from campaign notes."""
+    version = get_data_version()
+    values = fetch_campaign_dimension_values(version)
+    dims = st.multiselect(
+        "Group by campaign dimension",
+        CAMPAIGN_DIMENSIONS,
+        default=["geo", "device"],
+        key="campaign_dims",
+    )
+    filter_cols = st.columns(len(CAMPAIGN_DIMENSIONS))
+    filters = []
+    for col, dim in zip(filter_cols, CAMPAIGN_DIMENSIONS):
+        with col:
+            picked = st.selectbox(f"{dim}", ["All"] + values[dim], key=f"campaign_filter_{dim}")
+            if picked != "All":
+                filters.append((dim, picked))
+    df = fetch_campaign_breakdown(version, tuple(dims), tuple(filters), active_engine_name())
+    if df.empty:
+        st.info("No ads match these campaign dimensions.")
+        return
+    st.dataframe(df, width="stretch", hide_index=True)
+    st.caption(
+        "Parsed from Campaign Notes (e.g. “US mobile only, SmartCPM $0.15, evenings 6–11pm”). "
+        "Ads without a recognisable value show as Unknown."
+    )
+
+
+def page_performance():
+    render_header()
+    st.subheader("📊 Performance Tracker")
+    st.markdown(
+        "Log impressions, clicks, leads, sales, and revenue per ad creative so you can see "
+        "what’s working by angle and traffic source."
+    )
+
+    if not cached_ads(get_data_version()):
+        st.info("No ads yet. Create some on the 'Ad Builder' page first.")
+        render_footer()
+        return
+
+    # Each block is a fragment: widgets inside one only rerun that block.
+    perf_editor_fragment()
+
+    st.markdown("---")
+    st.markdown("### Bulk Edit Metrics (Grid)")
+    render_bulk_metrics_grid()
+
+    with st.expander("Import metrics from CSV (background job)"):
+        st.caption(f"Columns: ad_id, {', '.join(METRIC_COLUMNS)}. Unknown ad ids are skipped.")
+        uploaded = st.file_uploader("Metrics CSV", type=["csv"], key="metrics_csv")
+        if uploaded is not None and st.button("Queue import"):
+            job_id = submit_job("import_metrics_csv", {"csv": uploaded.getvalue().decode("utf-8", "replace")})
+            st.success(f"Queued job `{job_id}` – see the Jobs page.")
+
+    st.markdown("---")
+    st.markdown("### Per-Ad Overview")
+    per_ad_table_fragment()
+
     st.markdown("---")
     st.markdown("### Per-Network Summary (CTR, CR, EPC)")
+    network_summary_fragment()
 
-    if df.empty:
-        st.info("No data yet for network summaries.")
-    else:
-        df_net = df.copy().fillna(0)
-        df_net["traffic_source"] = df_net["traffic_source"].replace("", "Unknown")
-        grouped = df_net.groupby("traffic_source", dropna=False).agg(
-            impressions=("impressions", "sum"),
-            clicks=("clicks", "sum"),
-            leads=("leads", "sum"),
-            sales=("sales", "sum"),
-            revenue=("revenue", "sum"),
-        )
-        grouped = grouped.reset_index()
+    st.markdown("---")
+    st.markdown("### Rollup Explorer (Program × Source × Angle × Placement)")
+    rollup_explorer_fragment()
 
-        grouped["CTR_%"] = grouped.apply(
-            lambda r: (r["clicks"] / r["impressions"] * 100) if r["impressions"] else 0.0,
-            axis=1,
-        )
-        grouped["CR_sales_%"] = grouped.apply(
-            lambda r: (r["sales"] / r["clicks"] * 100) if r["clicks"] else 0.0,
-            axis=1,
-        )
-        grouped["EPC"] = grouped.apply(
-            lambda r: (r["revenue"] / r["clicks"]) if r["clicks"] else 0.0,
-            axis=1,
+    st.markdown("---")
+    st.markdown("### Campaign Dimensions (GEO × Device × Bid × Daypart)")
+    campaign_dimensions_fragment()
+
+    render_footer()
+
+
+@st.fragment
+def ab_comparison_fragment(df: pd.DataFrame, selected_ids: List[int]):
+    """KPI picker + winner + table; changing the KPI reruns only this block."""
+    metric_choice = st.selectbox(
+        "Primary KPI",
+        ["CTR_%", "CR_sales_%", "EPC"],
+        help="CTR = clicks/impressions; CR = sales/clicks; EPC = revenue/click.",
+    )
+
+    df_sel = add_kpi_columns(df[df["ad_id"].isin(selected_ids)])
+
+    if not df_sel.empty:
+        winner_idx = df_sel[metric_choice].idxmax()
+        winner_row = df_sel.loc[winner_idx]
+        st.success(
+            f"🏆 Current winner on **{metric_choice}**: "
+            f"Ad #{int(winner_row['ad_id'])} – {winner_row['title']}"
         )
 
-        st.dataframe(
-            grouped[
-                [
-                    "traffic_source",
-                    "impressions",
-                    "clicks",
-                    "leads",
-                    "sales",
-                    "revenue",
-                    "CTR_%",
-                    "CR_sales_%",
-                    "EPC",
-                ]
+    st.markdown("### Comparison Table")
+    st.dataframe(
+        df_sel[
+            [
+                "ad_id",
+                "program_name",
+                "traffic_source",
+                "geo",
+                "device",
+                "bid_model",
+                "title",
+                "impressions",
+                "clicks",
+                "leads",
+                "sales",
+                "revenue",
+                "CTR_%",
+                "CR_sales_%",
+                "EPC",
             ]
-        )
-
-    render_footer()
-
-
-def page_ab_split():
-    render_header()
-    st.subheader("🧪 A/B Split Tester")
-    st.markdown(
-        "Use this to compare multiple creatives on **CTR, CR and EPC**.\n\n"
-        "You still run traffic in the ad network — this is your analysis board "
-        "to see which IDs are actually winning."
+        ]
     )
 
-    df = fetch_ads_with_metrics_df()
+
+@st.fragment
+def ab_selector_fragment():
+    """Filters + ad selection; reruns itself and the comparison nested in it."""
+    include_archived = st.checkbox("Include archived creatives", value=False, key="ab_archived")
+    df = cached_metrics_df(get_data_version(), tuple(REPORT_COLUMNS), include_archived)
     if df.empty:
         st.info("No ads or metrics yet. Create ads and log performance first.")
-        render_footer()
         return
 
-    df = df.fillna(0)
-
-    programs = fetch_programs()
+    programs = sorted(df["program_name"].astype(str).unique().tolist())
     program_filter = st.selectbox(
         "Filter by Program",
-        ["All programs"] + [p["name"] for p in programs],
+        ["All programs"] + programs,
     )
 
     if program_filter != "All programs":
         df = df[df["program_name"] == program_filter]
 
-    traffic_sources = ["All sources"] + sorted(list(set(df["traffic_source"].fillna("Unknown"))))
+    traffic_sources = ["All sources"] + sorted(df["traffic_source"].astype(str).unique().tolist())
     src_filter = st.selectbox("Filter by Traffic Source", traffic_sources)
     if src_filter != "All sources":
         df = df[df["traffic_source"] == src_filter]
 
+    geo_col, device_col = st.columns(2)
+    with geo_col:
+        geos = {code for label in df["geo"].dropna().astype(str) for code in label.split(",")}
+        geo_filter = st.selectbox("Filter by GEO", ["All GEOs"] + sorted(geos))
+    with device_col:
+        device_filter = st.selectbox(
+            "Filter by Device", ["All devices"] + sorted(df["device"].astype(str).unique().tolist())
+        )
+    if geo_filter != "All GEOs":
+        df = df[df["geo"].astype(str).str.split(",").map(lambda codes: geo_filter in codes)]
+    if device_filter != "All devices":
+        df = df[df["device"] == device_filter]
+
     ad_options = [
-        f"{int(row.ad_id)} – {row.title} ({row.program_name or 'Unknown'})"
-        for _, row in df.iterrows()
+        f"{int(ad_id)} – {title} ({program_name or 'Unknown'})"
+        for ad_id, title, program_name in zip(df["ad_id"], df["title"], df["program_name"])
     ]
     selected_labels = st.multiselect(
         "Select 2–6 ads to compare",
@@ -1285,57 +7479,106 @@ def page_ab_split():
 
     if len(selected_ids) < 2:
         st.info("Pick at least 2 ads to run a comparison.")
-        render_footer()
         return
 
-    metric_choice = st.selectbox(
-        "Primary KPI",
-        ["CTR_%", "CR_sales_%", "EPC"],
-        help="CTR = clicks/impressions; CR = sales/clicks; EPC = revenue/click.",
-    )
+    ab_comparison_fragment(df, selected_ids)
 
-    df_sel = df[df["ad_id"].isin(selected_ids)].copy()
-    df_sel["CTR_%"] = df_sel.apply(
-        lambda r: (r["clicks"] / r["impressions"] * 100) if r["impressions"] else 0.0,
-        axis=1,
-    )
-    df_sel["CR_sales_%"] = df_sel.apply(
-        lambda r: (r["sales"] / r["clicks"] * 100) if r["clicks"] else 0.0,
-        axis=1,
-    )
-    df_sel["EPC"] = df_sel.apply(
-        lambda r: (r["revenue"] / r["clicks"]) if r["clicks"] else 0.0,
-        axis=1,
+
+def page_cohorts():
+    render_header()
+    st.subheader("📆 Cohorts & LTV – Rev-Share Backend Money")
+    st.markdown(
+        "Rev-share payouts keep arriving for months after the signup. Record signups by acquisition "
+        "date and each payout with its payout date; revenue is bucketed by the signup's age in days "
+        "and LTV curves use only cohorts old enough to have reached each age."
     )
+    version = get_cohort_version()
+    signups, revenue = load_cohort_rollups(version)
 
-    if not df_sel.empty:
-        winner_idx = df_sel[metric_choice].idxmax()
-        winner_row = df_sel.loc[winner_idx]
-        st.success(
-            f"🏆 Current winner on **{metric_choice}**: "
-            f"Ad #{int(winner_row['ad_id'])} – {winner_row['title']}"
+    if signups.empty:
+        st.info("No cohort data yet – record signups and payouts below or import a CSV.")
+    else:
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Signups", f"{int(signups['signups'].sum()):,}")
+        c2.metric("Rev-share revenue", f"${revenue['revenue'].sum():,.2f}")
+        c3.metric("Cohort months", signups["cohort_month"].nunique())
+
+        st.markdown("### LTV per signup by traffic source")
+        st.dataframe(cohort_ltv_table(version), width="stretch", hide_index=True)
+        st.caption(
+            f"* = projected: the last {COHORT_PROJECTION_WINDOW} days' revenue continued with its "
+            f"{COHORT_PROJECTION_WINDOW}-day decay rate."
         )
 
-    st.markdown("### Comparison Table")
-    st.dataframe(
-        df_sel[
-            [
-                "ad_id",
-                "program_name",
-                "traffic_source",
-                "title",
-                "impressions",
-                "clicks",
-                "leads",
-                "sales",
-                "revenue",
-                "CTR_%",
-                "CR_sales_%",
-                "EPC",
-            ]
-        ]
+        sources = sorted(signups["traffic_source"].unique())
+        chosen = st.multiselect("Sources to chart", sources, default=sources[:5])
+        curves = {
+            src: ltv_curve(signups[signups["traffic_source"] == src], revenue[revenue["traffic_source"] == src])
+            for src in chosen
+        }
+        curves = {k: v for k, v in curves.items() if not v.empty}
+        if curves:
+            st.line_chart(pd.DataFrame(curves), x_label="age (days)", y_label="LTV per signup ($)")
+
+        st.markdown("### Cohort triangle")
+        source = st.selectbox("Traffic source", ["All"] + sources)
+        s = signups if source == "All" else signups[signups["traffic_source"] == source]
+        r = revenue if source == "All" else revenue[revenue["traffic_source"] == source]
+        st.dataframe(cohort_triangle(s, r), width="stretch")
+        st.caption("Cumulative revenue per signup at each age, by acquisition month.")
+
+    st.markdown("---")
+    st.markdown("### Record signups / payouts")
+    ads = fetch_ads()
+    if ads:
+        labels = {f"{a['id']} – {a['title']} ({a['traffic_source'] or 'n/a'})": a["id"] for a in ads}
+        with st.form("cohort_event", clear_on_submit=True):
+            ad_label = st.selectbox("Ad", list(labels))
+            c1, c2, c3, c4 = st.columns(4)
+            acquired = c1.date_input("Acquired (signup date)")
+            new_signups = c2.number_input("Signups", min_value=0, value=0, step=1)
+            paid_on = c3.date_input("Payout date")
+            amount = c4.number_input("Payout ($)", min_value=0.0, value=0.0, step=1.0)
+            add_to_totals = st.checkbox("Also add payouts to the ad's revenue total", value=True)
+            if st.form_submit_button("💾 Record"):
+                ad_id = labels[ad_label]
+                if paid_on < acquired and amount:
+                    st.error("Payout date can't be before the signup date.")
+                else:
+                    done = record_cohort_events(
+                        [(ad_id, acquired, int(new_signups))] if new_signups else [],
+                        [(ad_id, acquired, paid_on, float(amount))] if amount else [],
+                        add_to_totals,
+                    )
+                    st.success(f"Recorded {done['signups']} signup row(s) and {done['payouts']} payout(s).")
+
+    uploaded = st.file_uploader(
+        "Import CSV (ad_id, acquired, signups and/or paid_on + revenue)", type=["csv"], key="cohort_csv"
+    )
+    add_csv_totals = st.checkbox("Add imported payouts to ad revenue totals", value=True, key="cohort_csv_totals")
+    if uploaded is not None and st.button("⏳ Import in background"):
+        job_id = submit_job(
+            "import_cohort_csv",
+            {"csv": uploaded.getvalue().decode("utf-8", "replace"), "add_to_totals": add_csv_totals},
+        )
+        st.success(f"Queued job `{job_id}` – see the Jobs page.")
+    if st.button("🔧 Rebuild source rollups"):
+        submit_write(rebuild_cohort_rollups_op).result()
+        st.success("Rollups rebuilt from the cohort matrices.")
+    render_footer()
+
+
+def page_ab_split():
+    render_header()
+    st.subheader("🧪 A/B Split Tester")
+    st.markdown(
+        "Use this to compare multiple creatives on **CTR, CR and EPC**.\n\n"
+        "You still run traffic in the ad network — this is your analysis board "
+        "to see which IDs are actually winning."
     )
 
+    ab_selector_fragment()
+
     st.info(
         "Tip: You can treat the top 1–2 winners as your **‘keep scaling’** group and "
         "pause the others in the ad network UI."
@@ -1374,27 +7617,72 @@ def page_export_copy():
             st.write(f"**Campaign Notes:** {chosen_ad['campaign_notes']}")
         st.write(f"**Angle:** {chosen_ad['angle']}")
 
-        block = textwrap.dedent(
-            f"""
-            [{chosen_ad['program_name']}] – {chosen_ad['title']}
-
-            TRAFFIC / CAMPAIGN:
-            Source: {chosen_ad['traffic_source'] or 'N/A'}
-            Notes: {chosen_ad['campaign_notes'] or 'n/a'}
-
-            HEADLINE:
-            {chosen_ad['headline']}
-
-            BODY:
-            {chosen_ad['body']}
+        st.text_area("Copy-ready block", ad_text_block(chosen_ad), height=260)
+        st.info("Select all and copy this block into your traffic source or ad manager.")
 
-            CTA:
-            {chosen_ad['call_to_action']}
-            """
-        ).strip()
+        st.markdown("### 🖼️ Banners")
+        if Image is None:
+            st.caption("Install Pillow (`pip install pillow`) to render image banners.")
+        else:
+            c1, c2 = st.columns([3, 1])
+            sizes = c1.multiselect(
+                "Sizes",
+                list(BANNER_SIZES),
+                default=PLACEMENT_BANNER_SIZES.get(chosen_ad["placement_type"], ["300x250"]),
+            )
+            fmt = c2.radio("Format", list(BANNER_FORMATS), horizontal=True)
+            b1, b2 = st.columns(2)
+            if b1.button("Render banners", disabled=not sizes):
+                results = render_banners([chosen_ad], sizes, fmt)
+                for r in results:
+                    note = "cached" if r["cached"] else f"{r['ms']:.0f} ms"
+                    st.image(r["path"], caption=f"{r['size']} · {fmt} · {note}")
+                st.download_button(
+                    "⬇️ Download banners (ZIP)",
+                    data=banners_zip(results),
+                    file_name=f"ad{chosen_ad_id}_banners.zip",
+                    mime="application/zip",
+                )
+            if b2.button("⏳ Render for all ads (background job)", disabled=not sizes):
+                job_id = submit_job("render_banners", {"sizes": sizes, "format": fmt})
+                st.success(f"Queued job `{job_id}` – unchanged creatives are served from the cache.")
 
-        st.text_area("Copy-ready block", block, height=260)
-        st.info("Select all and copy this block into your traffic source or ad manager.")
+    st.markdown("---")
+    st.markdown("### Bulk Export (network upload formats)")
+    st.caption(
+        "All matching creatives in one file: a network bulk-upload CSV, or a ZIP with one "
+        "copy-ready text block per ad. Rows are streamed straight from the database."
+    )
+    fmt = st.selectbox("Format", list(BULK_EXPORT_FORMATS), key="bulk_export_format")
+    conn = get_conn()
+    options = {
+        col: [r[0] for r in conn.execute(f"SELECT DISTINCT {col} FROM ad_creatives WHERE {col} IS NOT NULL ORDER BY 1")]
+        for col in ["traffic_source", "status", "placement_type"]
+    }
+    conn.close()
+    c1, c2, c3 = st.columns(3)
+    filters = {
+        "traffic_source": c1.multiselect("Traffic source", options["traffic_source"], key="bulk_export_src"),
+        "status": c2.multiselect("Status", options["status"], key="bulk_export_status"),
+        "placement_type": c3.multiselect("Placement", options["placement_type"], key="bulk_export_placement"),
+    }
+    matching = count_export_ads(filters)
+    st.write(f"**{matching}** creative(s) match (all if no filter is set).")
+    too_big = matching > EXPORT_INLINE_MAX_ADS
+    if too_big:
+        st.caption(f"More than {EXPORT_INLINE_MAX_ADS:,} creatives: build it in the background instead.")
+    b1, b2 = st.columns(2)
+    with b1:
+        st.download_button(
+            f"⬇️ Download {fmt}",
+            data=functools.partial(bulk_export_bytes, fmt, filters),  # built only when clicked
+            file_name=bulk_export_filename(fmt),
+            mime="application/zip" if fmt.endswith("(ZIP)") else "text/csv",
+            disabled=matching == 0 or too_big,
+        )
+    if b2.button("⏳ Build bulk export in background", disabled=matching == 0):
+        job_id = submit_job("bulk_export", {"format": fmt, "filters": filters})
+        st.success(f"Queued job `{job_id}` – download it from the Jobs page when done.")
 
     st.markdown("---")
     st.markdown("### CSV Export")
@@ -1413,7 +7701,8 @@ def page_export_copy():
                 mime="text/csv",
             )
     with col2:
-        df_ads = fetch_ads_with_metrics_df()
+        include_archived = st.checkbox("Include archived creatives", value=False, key="export_archived")
+        df_ads = fetch_ads_with_metrics_df(include_archived=include_archived)
         if df_ads.empty:
             st.write("No ads / metrics to export yet.")
         else:
@@ -1424,6 +7713,532 @@ def page_export_copy():
                 file_name="xxx_ads_with_performance.csv",
                 mime="text/csv",
             )
+            if st.button("⏳ Build export in background"):
+                job_id = submit_job("export_ads_csv", {"include_archived": include_archived})
+                st.success(f"Queued job `{job_id}` – download it from the Jobs page when done.")
+
+    render_footer()
+
+
+def page_ctr_scorer():
+    render_header()
+    st.subheader("🎯 CTR Scorer – Predict Before You Spend")
+    st.markdown(
+        "A small local model trained on your own history: headline / CTA n-grams plus traffic source "
+        f"and placement → CTR, fitted on every ad with at least {CTR_MIN_IMPRESSIONS:,} impressions. "
+        f"Every {CTR_HOLDOUT_EVERY}th ad (by id) is held out and only used to measure accuracy. "
+        "The model refits incrementally as metrics change and ranks new variants in the Ad Builder."
+    )
+    scorer = get_ctr_scorer()
+    scorer.refresh()
+    stats = scorer.stats
+    if stats.get("error"):
+        st.info(stats["error"])
+    elif not scorer.trained:
+        st.info("Training the model in a background job – reload this page in a few seconds.")
+    elif stats:
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric(
+            "Pairwise accuracy (held out)",
+            f"{stats['pairwise_accuracy'] * 100:.1f}%" if stats.get("pairwise_accuracy") is not None else "–",
+            help="How often the model orders two held-out ads the same way their real CTRs are ordered (50% = coin flip).",
+        )
+        c2.metric("Spearman ρ", stats.get("spearman", "–"))
+        c3.metric("Log-loss vs. flat CTR", f"{stats.get('logloss_gain_pct', 0):+.2f}%")
+        c4.metric("Train / held-out ads", f"{stats['train_ads']} / {stats['holdout_ads']}")
+        st.caption(
+            f"Last {stats['mode']} fit at {stats['trained_at']} in {stats['fit_ms']:.0f} ms "
+            f"(features {stats['featurize_ms']:.0f} ms)."
+        )
+    if st.button("🔁 Full retrain (background job)"):
+        job_id = submit_job("train_ctr_model", {"full": True})
+        st.info(f"Queued job `{job_id}` – see the Jobs page.")
+
+    if scorer.trained:
+        st.markdown("### Score headlines")
+        c1, c2 = st.columns(2)
+        source = c1.selectbox("Traffic source", ["ExoClick", "JuicyAds", "TrafficJunky", "Adsterra", "Other / Mixed"])
+        placement = c2.selectbox("Placement", list(PLACEMENT_LENGTH_LIMITS), key="ctr_placement")
+        cta = st.text_input("Call to action", value="Join Now")
+        lines = st.text_area("Headlines (one per line)", height=140)
+        headlines = [h.strip() for h in lines.splitlines() if h.strip()]
+        if headlines:
+            started = time.perf_counter()
+            scores = [scorer.score(h, cta, source, placement) * 100 for h in headlines]
+            us = (time.perf_counter() - started) * 1e6 / len(headlines)
+            ranked = pd.DataFrame({"headline": headlines, "predicted_ctr_%": np.round(scores, 3)})
+            st.dataframe(
+                ranked.sort_values("predicted_ctr_%", ascending=False), width="stretch", hide_index=True
+            )
+            st.caption(f"{us:.0f} µs per headline.")
+
+        with st.expander("Strongest features"):
+            st.dataframe(scorer.top_features(), width="stretch", hide_index=True)
+    render_footer()
+
+
+def page_rules():
+    render_header()
+    st.subheader("🤖 Rules – Auto Pause / Promote")
+    st.markdown(
+        "Rules run automatically for every ad whose metrics change (Performance editor, bulk grid, "
+        "CSV import). Only **Active** / **Winner** creatives are touched, the first matching rule "
+        "(lowest priority number) wins, and every change is logged below and sent as a "
+        "`rules_applied` webhook."
+    )
+    with st.expander("Rule syntax"):
+        st.markdown(
+            "- `pause if clicks > 500 and cr < 0.2%`\n"
+            "- `loser if impressions >= 20000 and ctr < 0.1% and traffic_source = ExoClick`\n"
+            "- `promote top 2 by epc per traffic_source where clicks >= 100`\n"
+            "- `pause bottom 1 by epc per program where clicks >= 1000`\n\n"
+            f"Actions: {', '.join(RULE_ACTIONS)}. Metrics: {', '.join(RULE_METRICS)} "
+            "(ctr / cr in %, epc in $). Dimensions: "
+            f"{', '.join(sorted(set(RULE_DIMENSIONS)))}. "
+            "A `promote top N` rule moves ads it promoted back to Active when they drop out of the top N. "
+            "A `pause` / `loser` top/bottom-N rule holds at most N ads per group – ads it already moved "
+            "(archived ones included) keep their place in the ranking."
+        )
+
+    with st.form("rule_form", clear_on_submit=True):
+        definition = st.text_input("Rule", placeholder="pause if clicks > 500 and cr < 0.2%")
+        c1, c2 = st.columns([3, 1])
+        name = c1.text_input("Name (optional)")
+        priority = c2.number_input("Priority", min_value=0, max_value=10_000, value=100, step=10)
+        if st.form_submit_button("➕ Add Rule"):
+            try:
+                add_rule(name, definition, int(priority))
+                st.success("Rule added.")
+            except ValueError as e:
+                st.error(f"Rule not saved: {e}")
+
+    rules = fetch_rules()
+    if not rules:
+        st.info("No rules yet.")
+    else:
+        st.markdown("### Rules")
+        rules_df = pd.DataFrame(rules)[["id", "priority", "name", "definition", "enabled", "created_at"]]
+        rules_df["enabled"] = rules_df["enabled"].astype(bool)
+        rules_df["delete"] = False
+        edited = st.data_editor(
+            rules_df,
+            hide_index=True,
+            width="stretch",
+            disabled=["id", "priority", "name", "definition", "created_at"],
+            key=f"rules_editor_{get_rules_version()}",
+        )
+        if st.button("💾 Save Rule Changes"):
+            for before, after in zip(rules_df.itertuples(), edited.itertuples()):
+                if after.delete:
+                    submit_write(delete_rule_op, int(after.id)).result()
+                elif after.enabled != before.enabled:
+                    submit_write(set_rule_enabled_op, int(after.id), bool(after.enabled)).result()
+            safe_rerun()
+
+        engine = get_rule_engine()
+        engine.refresh()
+        for rule_id, err in engine.errors.items():
+            st.warning(f"Rule #{rule_id} is skipped: {err}")
+
+        c1, c2 = st.columns(2)
+        if c1.button("🔍 Preview on all ads (dry run)"):
+            started = time.perf_counter()
+            proposed = engine.evaluate()
+            ms = (time.perf_counter() - started) * 1000
+            if proposed:
+                st.dataframe(pd.DataFrame(proposed), width="stretch", hide_index=True)
+            st.caption(f"{len(proposed)} change(s) would be made · evaluated in {ms:.0f} ms.")
+        if c2.button("▶️ Apply to all ads now (background job)"):
+            job_id = submit_job("evaluate_rules", {})
+            st.info(f"Queued job `{job_id}` – see the Jobs page.")
+
+    st.markdown("### Recent rule actions")
+    hits = fetch_rule_hits()
+    if hits.empty:
+        st.caption("No rule has changed an ad yet.")
+    else:
+        st.dataframe(hits, width="stretch", hide_index=True)
+    render_footer()
+
+
+def fetch_compliance_summary() -> Tuple[Dict[str, int], pd.DataFrame]:
+    """Status counts (incl. unchecked / stale) and the flagged ads, worst first."""
+    conn = get_conn()
+    version = conn.execute("SELECT value FROM app_meta WHERE key = 'compliance_version'").fetchone()[0]
+    counts = dict(
+        conn.execute(
+            """
+            SELECT COALESCE(c.status, 'unchecked'), COUNT(*)
+            FROM ad_creatives a LEFT JOIN ad_compliance c ON c.ad_id = a.id
+            GROUP BY 1
+            """
+        ).fetchall()
+    )
+    counts["stale"] = conn.execute(
+        "SELECT COUNT(*) FROM ad_compliance WHERE list_version < ?", (version,)
+    ).fetchone()[0]
+    flagged = pd.read_sql_query(
+        """
+        SELECT a.id AS ad_id, a.title, a.traffic_source, a.placement_type, a.status AS ad_status,
+               c.status AS compliance, c.issues, c.checked_at
+        FROM ad_compliance c JOIN ad_creatives a ON a.id = c.ad_id
+        WHERE c.status != 'pass'
+        ORDER BY c.status = 'fail' DESC, a.id DESC
+        LIMIT 500
+        """,
+        conn,
+    )
+    conn.close()
+    flagged["issues"] = flagged["issues"].map(
+        lambda raw: "; ".join(f"{i['field']}: {i['message']}" for i in json.loads(raw or "[]"))
+    )
+    return counts, flagged
+
+
+def page_compliance():
+    render_header()
+    st.subheader("🛡️ Compliance Linter")
+    st.markdown(
+        "Every creative is linted when it is saved (AI output and manual copy alike) against the "
+        "banned-term lists, the claim patterns and the per-placement length limits below. "
+        "**block** issues mark an ad as *fail*, everything else as *warn* – the ad is still saved, "
+        "fix it before uploading. Terms match whole words plus -s/-es/-ed/-ing "
+        "endings (`teens`), case-insensitive, and catch simple leetspeak (`t33n`, `@nal`)."
+    )
+
+    counts, flagged = fetch_compliance_summary()
+    c1, c2, c3, c4, c5 = st.columns(5)
+    c1.metric("Pass", counts.get("pass", 0))
+    c2.metric("Warn", counts.get("warn", 0))
+    c3.metric("Fail", counts.get("fail", 0))
+    c4.metric("Unchecked", counts.get("unchecked", 0))
+    c5.metric("Stale", counts.get("stale", 0), help="Checked against an older version of the lists.")
+    if st.button("🔄 Rescan all creatives (background job)"):
+        job_id = submit_job("compliance_rescan", {})
+        st.info(f"Queued job `{job_id}` – see the Jobs page.")
+
+    st.markdown("### Flagged creatives")
+    if flagged.empty:
+        st.caption("Nothing flagged.")
+    else:
+        st.dataframe(flagged, width="stretch", hide_index=True)
+
+    st.markdown("### Test copy")
+    with st.form("compliance_test"):
+        c1, c2 = st.columns(2)
+        network = c1.selectbox("Traffic source", ["ExoClick", "JuicyAds", "TrafficJunky", "Adsterra", "Other / Mixed"])
+        placement = c2.selectbox("Placement", list(PLACEMENT_LENGTH_LIMITS))
+        headline = st.text_input("Headline")
+        body = st.text_area("Body", height=80)
+        cta = st.text_input("Call to action")
+        if st.form_submit_button("Check"):
+            issues = lint_creative(
+                {
+                    "headline": headline,
+                    "body": body,
+                    "call_to_action": cta,
+                    "placement_type": placement,
+                    "traffic_source": network,
+                }
+            )
+            if issues:
+                show_compliance_issues(issues)
+            else:
+                st.success("No issues found.")
+
+    st.markdown("### Lists")
+    st.caption(
+        "Network `*` applies to every traffic source; otherwise use the traffic source name. "
+        "Saving replaces the lists and rescans all creatives in the background."
+    )
+    conn = get_conn()
+    terms_df = pd.read_sql_query("SELECT network, term, severity FROM compliance_terms ORDER BY network, term", conn)
+    patterns_df = pd.read_sql_query(
+        "SELECT network, pattern, message, severity FROM compliance_patterns ORDER BY id", conn
+    )
+    conn.close()
+    severity_col = st.column_config.SelectboxColumn("severity", options=COMPLIANCE_SEVERITIES, required=True)
+    t1, t2 = st.tabs([f"Banned terms ({len(terms_df)})", f"Claim patterns ({len(patterns_df)})"])
+    with t1:
+        new_terms = st.data_editor(
+            terms_df,
+            num_rows="dynamic",
+            hide_index=True,
+            width="stretch",
+            column_config={"severity": severity_col},
+            key="compliance_terms_editor",
+        )
+    with t2:
+        new_patterns = st.data_editor(
+            patterns_df,
+            num_rows="dynamic",
+            hide_index=True,
+            width="stretch",
+            column_config={"severity": severity_col},
+            key="compliance_patterns_editor",
+        )
+    if st.button("💾 Save Lists & Rescan"):
+        terms = [
+            ((r.network or "*").strip(), r.term.strip(), r.severity or "block")
+            for r in new_terms.itertuples()
+            if isinstance(r.term, str) and r.term.strip()
+        ]
+        patterns, bad = [], []
+        for r in new_patterns.itertuples():
+            if not isinstance(r.pattern, str) or not r.pattern.strip():
+                continue
+            try:
+                re.compile(r.pattern)
+            except re.error as e:
+                bad.append(f"`{r.pattern}`: {e}")
+                continue
+            patterns.append(((r.network or "*").strip(), r.pattern, r.message or "", r.severity or "warn"))
+        if bad:
+            st.error("Invalid pattern(s), nothing saved:\n\n" + "\n\n".join(bad))
+        else:
+            submit_write(replace_compliance_lists_op, terms, patterns).result()
+            job_id = submit_job("compliance_rescan", {})
+            st.success(f"Lists saved ({len(terms)} terms, {len(patterns)} patterns). Rescan job `{job_id}` queued.")
+
+    st.markdown("### Length limits (characters)")
+    st.dataframe(pd.DataFrame(PLACEMENT_LENGTH_LIMITS).T, width="stretch")
+    render_footer()
+
+
+def page_jobs():
+    render_header()
+    st.subheader("⏳ Background Jobs")
+    st.markdown(
+        "Long variant runs, exports and imports run here in a worker pool – they keep going "
+        f"across page changes and closed tabs. Finished jobs are kept for {JOB_RETENTION_HOURS}h."
+    )
+
+    @st.fragment(run_every=2)
+    def jobs_table():
+        jobs = fetch_jobs()
+        if jobs.empty:
+            st.info("No jobs yet.")
+            return
+        for col in ["created_at", "started_at", "finished_at"]:
+            jobs[col] = pd.to_datetime(jobs[col], unit="s")
+        st.dataframe(
+            jobs.drop(columns=["cancel_requested"]),
+            width="stretch",
+            hide_index=True,
+            column_config={"progress": st.column_config.ProgressColumn("Progress", min_value=0.0, max_value=1.0)},
+        )
+        active = jobs[jobs["status"].isin(["queued", "running"])]
+        for _, job in active.iterrows():
+            c1, c2 = st.columns([3, 1])
+            c1.write(f"`{job['id']}` · {job['kind']} · {job['status']} · {job['message'] or ''}")
+            if c2.button("Cancel", key=f"cancel_{job['id']}", disabled=bool(job["cancel_requested"])):
+                cancel_job(job["id"])
+                st.rerun(scope="fragment")
+
+    jobs_table()
+
+    st.markdown("---")
+    st.markdown("### Results")
+    jobs = fetch_jobs()
+    ready = jobs[(jobs["status"] == "done") & jobs["result_name"].notna()] if not jobs.empty else jobs
+    if ready.empty:
+        st.caption("No downloadable results yet.")
+    for _, job in ready.iterrows():
+        text, name, path = fetch_job_result(job["id"])
+        if path:
+            if not os.path.exists(path):
+                st.caption(f"{name} ({job['id']}) – file no longer on disk.")
+                continue
+            size = os.path.getsize(path)
+            if size > DOWNLOAD_INLINE_MAX_BYTES:
+                st.caption(
+                    f"{name} ({job['id']}) – {size / 1e6:,.0f} MB, too large to serve through the page; "
+                    f"it is on the server at `{os.path.abspath(path)}`."
+                )
+                continue
+            data = functools.partial(read_file_bytes, path)  # read only when clicked
+        else:
+            data = (text or "").encode("utf-8")
+        st.download_button(
+            f"⬇️ {name} ({job['id']})",
+            data=data,
+            file_name=name,
+            mime="application/zip" if name.endswith(".zip") else "text/csv",
+            key=f"dl_{job['id']}",
+        )
+
+    render_footer()
+
+
+def page_backups():
+    render_header()
+    st.subheader("💾 Backups")
+    st.markdown(
+        "Online snapshots of the main database and the archive, taken with SQLite's backup API "
+        "in small steps so the app keeps writing meanwhile. Each snapshot is verified with "
+        f"`PRAGMA integrity_check`, gzip-compressed, and the newest {BACKUP_KEEP} are kept."
+    )
+
+    scheduler = start_backup_scheduler()
+    if scheduler["last_error"]:
+        st.warning(f"Last scheduled backup failed: {scheduler['last_error']}")
+
+    if st.button("💾 Back up now"):
+        job_id = submit_job("backup", {})
+        st.success(f"Backup queued as job `{job_id}` – it shows up below once finished.")
+
+    snapshots = list_backups()
+    if not snapshots:
+        st.info("No snapshots yet.")
+        render_footer()
+        return
+
+    rows = []
+    for meta in snapshots:
+        files = meta["files"].values()
+        rows.append(
+            {
+                "snapshot": meta["id"],
+                "created_at": meta["created_at"],
+                "label": meta.get("label", ""),
+                "files": ", ".join(meta["files"]),
+                "db_MB": sum(f["raw_bytes"] for f in files) / 1e6,
+                "gz_MB": sum(f["gz_bytes"] for f in files) / 1e6,
+                "copy_ms": sum(f["copy_ms"] for f in files),
+                "verify_ms": sum(f["verify_ms"] for f in files),
+                "compress_ms": sum(f["compress_ms"] for f in files),
+                "total_ms": meta["total_ms"],
+                "integrity": ", ".join(f["integrity"] for f in files),
+            }
+        )
+    st.dataframe(pd.DataFrame(rows), width="stretch", hide_index=True)
+
+    st.markdown("### Restore")
+    st.caption(
+        "Restoring copies the snapshot back over the live database. The current state is "
+        "snapshotted first, so a restore can itself be undone."
+    )
+    snap_id = st.selectbox("Snapshot", [m["id"] for m in snapshots])
+    confirm = st.checkbox(f"Yes, replace the live data with snapshot {snap_id}")
+    if st.button("♻️ Restore snapshot", disabled=not confirm):
+        result = restore_backup(snap_id)
+        st.success(
+            f"Restored {result['restored']} in {result['ms']:.0f} ms "
+            f"(previous state saved as {result['safety_snapshot']})."
+        )
+
+    render_footer()
+
+
+def page_archive():
+    render_header()
+    st.subheader("🗄️ Archive (Cold Storage)")
+    st.markdown(
+        f"Creatives marked **{' / '.join(ARCHIVE_STATUSES)}** with no status change or metrics update "
+        f"for **{get_secret('ARCHIVE_AFTER_DAYS', ARCHIVE_AFTER_DAYS)} days** are moved with their metrics "
+        "into a compressed archive file by a background job, so every page only loads live creatives. "
+        "Archived creatives can still be included in reports and exports, and restored at any time."
+    )
+
+    scheduler = start_archive_scheduler()
+    candidates = find_archive_candidates()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Waiting to archive", len(candidates))
+    archived = load_archived_ads()
+    col2.metric("Archived creatives", len(archived))
+    archive_size = os.path.getsize(ARCHIVE_DB_PATH) if os.path.exists(ARCHIVE_DB_PATH) else 0
+    col3.metric("Archive file size", f"{archive_size / 1024:,.1f} KB")
+
+    if scheduler["last_run"]:
+        run = scheduler["last_run"]
+        st.caption(f"Last background run: {run['at']} · {run['archived']} archived in {run['ms']:.0f} ms")
+    if scheduler["last_error"]:
+        st.warning(f"Last background archive error: {scheduler['last_error']}")
+
+    if st.button("📦 Archive now"):
+        result = run_archive_job()
+        st.success(f"Archived {result['archived']} creative(s) in {result['ms']:.0f} ms.")
+        safe_rerun()
+
+    st.markdown("---")
+    st.markdown("### Archived Creatives")
+
+    if not archived:
+        st.info("Nothing archived yet.")
+    else:
+        df_arch = pd.DataFrame(
+            [
+                {
+                    "ad_id": a["id"],
+                    "title": a["title"],
+                    "program_name": a["program_name"],
+                    "traffic_source": a["traffic_source"],
+                    "status": a["status"],
+                    "archived_at": a["archived_at"],
+                    "clicks": a["clicks"],
+                    "sales": a["sales"],
+                    "revenue": a["revenue"],
+                }
+                for a in archived
+            ]
+        )
+        st.dataframe(df_arch, width="stretch")
+
+        labels = [f"{a['id']} – {a['title']} ({a['program_name'] or 'Unknown'})" for a in archived]
+        to_restore = st.multiselect("Restore creatives", labels)
+        if st.button("♻️ Restore selected") and to_restore:
+            ids = [int(label.split("–")[0].strip()) for label in to_restore]
+            restored = restore_ads(ids)
+            st.success(f"Restored {restored} creative(s) as Active.")
+            safe_rerun()
+
+    render_footer()
+
+
+def page_search():
+    render_header()
+    st.subheader("🔎 Search Creatives & Programs")
+    st.markdown(
+        "Full-text search over headlines, body copy, CTAs, campaign notes and program notes. "
+        "Results are ranked by relevance; matching words are **highlighted**."
+    )
+
+    query = st.text_input(
+        "Search",
+        placeholder='e.g. discreet shipping, "SmartCPM", evenings',
+    )
+    scope = st.radio(
+        "Search in",
+        ["Ad creatives", "Affiliate programs"],
+        horizontal=True,
+    )
+
+    if not query.strip():
+        st.info("Type a word or phrase to search. The last word also matches as a prefix.")
+        render_footer()
+        return
+
+    if scope == "Ad creatives":
+        results = search_creatives(query)
+        st.caption(f"{len(results)} matching creative(s)")
+        for r in results:
+            with st.container():
+                st.markdown(
+                    f"**#{r['id']} – {r['title']}** · {r['program_name'] or 'Unknown Program'} · "
+                    f"{r['traffic_source'] or 'N/A'} · {r['angle']}"
+                )
+                st.markdown(f"> {r['headline_hl']}")
+                if r["snippet"]:
+                    st.markdown(r["snippet"])
+                st.markdown("---")
+    else:
+        results = search_programs(query)
+        st.caption(f"{len(results)} matching program(s)")
+        for r in results:
+            st.markdown(f"**{r['name_hl']}** · {r['status']} · [Open]({r['signup_url']})")
+            if r["snippet"]:
+                st.markdown(r["snippet"])
+            st.markdown("---")
 
     render_footer()
 
@@ -1702,6 +8517,152 @@ def page_integrations():
         trigger_zap("test_ping", {"message": "test_ping_from_xxx_ad_poster"})
         st.info("Test event sent. Check your Zap history in Zapier.")
 
+    st.markdown("---")
+    st.markdown("### 🗄️ Database Writer")
+    st.markdown(
+        "All writes go through one background writer per server process, which "
+        "group-commits whatever is queued."
+    )
+    w = get_db_writer().stats()
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Queue depth", w["queue_depth"])
+    c2.metric("Commits / ops", f"{w['commits']} / {w['ops']}")
+    c3.metric("Avg batch", f"{w['avg_batch']:.1f}")
+    c4.metric(
+        "Commit latency",
+        f"{w['avg_commit_ms']:.1f} ms",
+        help=f"last {w['last_commit_ms']:.1f} ms · max {w['max_commit_ms']:.1f} ms",
+    )
+    if w["failed_ops"] or w["failed_commits"]:
+        st.warning(f"Failed ops: {w['failed_ops']} · failed commits: {w['failed_commits']}")
+
+    st.markdown("---")
+    st.markdown("### 🧹 Database Maintenance")
+    st.markdown(
+        "A background check runs `PRAGMA optimize` daily, `incremental_vacuum` when free pages pass "
+        f"{MAINT_FREELIST_RATIO:.0%} of the file, and `wal_checkpoint(TRUNCATE)` when the WAL passes "
+        f"{MAINT_WAL_BYTES // (1024 * 1024)} MB – only while the app is idle. Cached banner images "
+        f"no ad uses any more are deleted daily (once {BANNER_PRUNE_HOURS}h old)."
+    )
+    fs = db_file_stats()
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("DB file", f"{fs['db_bytes'] / 1e6:,.2f} MB")
+    m2.metric("WAL file", f"{fs['wal_bytes'] / 1e6:,.2f} MB")
+    m3.metric("Free pages", f"{fs['freelist_count']:,} / {fs['page_count']:,}")
+    m4.metric("auto_vacuum", fs["auto_vacuum"])
+    due = maintenance_due(fs)
+    st.caption(f"Due now: {', '.join(due) if due else 'nothing'}")
+    maint = start_maintenance_scheduler()
+    if maint["last_error"]:
+        st.warning(f"Last maintenance error: {maint['last_error']}")
+    if st.button("Run maintenance now"):
+        entry = run_maintenance(["optimize", "vacuum", "checkpoint", "prune_banners"], reason="manual")
+        st.success(
+            f"{entry['actions']} in {entry['ms']:.0f} ms · "
+            f"{entry['db_bytes_before'] / 1e6:,.2f} → {entry['db_bytes_after'] / 1e6:,.2f} MB · "
+            f"probe queries {entry['query_ms_before']:.1f} → {entry['query_ms_after']:.1f} ms"
+        )
+    log = fetch_maintenance_log()
+    if not log.empty:
+        st.dataframe(log, width="stretch", hide_index=True)
+
+    st.markdown("---")
+    st.markdown("### 📈 Analytics Engine")
+    st.markdown(
+        "Reporting queries (dashboard totals, rollups, exports) can run on DuckDB "
+        "(`pip install duckdb`) instead of SQLite. Any DuckDB error falls back to SQLite. "
+        "You can also set `ANALYTICS_ENGINE` (auto / sqlite / duckdb) in Streamlit secrets."
+    )
+    current = st.session_state.get("analytics_engine") or get_secret("ANALYTICS_ENGINE", "auto")
+    engine_choice = st.selectbox(
+        "Engine",
+        ANALYTICS_ENGINES,
+        index=ANALYTICS_ENGINES.index(current) if current in ANALYTICS_ENGINES else 0,
+    )
+    st.session_state["analytics_engine"] = engine_choice
+    active = active_engine_name()
+    if active == "duckdb":
+        st.write(f"**Active:** DuckDB ({get_engine('duckdb').mode})")
+    else:
+        if engine_choice == "duckdb" and duckdb is None:
+            st.warning("DuckDB is not installed – using SQLite.")
+        st.write("**Active:** SQLite")
+    st.dataframe(get_analytics_stats().snapshot())
+
+    bench_ads = st.number_input(
+        "Benchmark size (synthetic ads)", min_value=1_000, max_value=2_000_000, value=50_000, step=10_000
+    )
+    if st.button("Run engine benchmark"):
+        with st.spinner("Generating synthetic data and timing both engines…"):
+            st.dataframe(benchmark_analytics_engines(int(bench_ads)))
+
+    st.markdown("---")
+    st.markdown("### 🚦 AI Rate Limits")
+    st.markdown(
+        "AI calls are paced per provider/model with requests-per-minute and tokens-per-minute "
+        "budgets shared by all sessions (served round-robin). 429 responses are waited out "
+        "instead of falling back. Override limits in secrets, e.g. `OPENAI_RPM`, `OPENAI_TPM`."
+    )
+    limits = pd.DataFrame(
+        [
+            {
+                "provider": name,
+                "model": spec["model"],
+                "rpm": float(get_secret(f"{spec['limit_prefix']}_RPM", spec["rpm"])),
+                "tpm": float(get_secret(f"{spec['limit_prefix']}_TPM", spec["tpm"])),
+            }
+            for name, spec in AI_PROVIDERS.items()
+        ]
+    )
+    st.dataframe(limits, width="stretch")
+    usage = get_ai_rate_limiter().snapshot()
+    if usage.empty:
+        st.caption("No AI calls made yet in this server process.")
+    else:
+        st.dataframe(usage, width="stretch")
+
+    st.markdown("### 🔌 AI Circuit Breakers")
+    st.caption(
+        f"A provider is cut off after {AI_BREAKER_FAILURES} consecutive failures; after "
+        f"{AI_BREAKER_RESET_S:.0f}s one probe call is let through to test recovery. "
+        "While open, generation falls straight back to the built-in generator."
+    )
+    breakers = get_ai_breakers()
+    st.dataframe(breakers.snapshot(), width="stretch")
+    if st.button("Reset all breakers"):
+        for provider in AI_PROVIDERS:
+            breakers.get(provider).reset()
+        st.success("Breakers closed.")
+
+    st.markdown("### 📈 Prometheus Metrics")
+    server = start_metrics_server()
+    if server["url"]:
+        st.write(f"Scrape endpoint: `{server['url']}`")
+        st.caption(
+            "Page render time, SQL and commit latency, AI latency/errors/fallbacks, webhook "
+            "results, cache hit rates and DB file sizes. Set METRICS_PORT / METRICS_HOST in "
+            "secrets to move it (METRICS_PORT = 0 disables)."
+        )
+    elif server["error"]:
+        st.warning(f"Metrics endpoint not started: {server['error']}")
+    else:
+        st.caption("Metrics endpoint disabled (METRICS_PORT = 0).")
+    with st.expander("Current metrics (text format)"):
+        st.code(get_metrics().render(), language="text")
+
+    st.markdown("### ⏱️ AI Latency & Hedging")
+    latency = get_ai_latency_stats()
+    lat_df = latency.snapshot()
+    if lat_df.empty:
+        st.caption("No AI latency recorded yet in this server process.")
+    else:
+        st.dataframe(lat_df, width="stretch")
+    h = latency.hedge
+    st.write(
+        f"**Hedged calls:** {h['hedged_calls']} · **hedges fired:** {h['hedges_fired']} · "
+        f"**primary won:** {h['primary_won']} · **hedge won:** {h['hedge_won']}"
+    )
+
     st.markdown("---")
     st.markdown("### 🤖 AI APIs for Copy")
 
@@ -1841,6 +8802,12 @@ This combo gives you:
 # =========================
 
 def main_app():
+    start_archive_scheduler()
+    start_backup_scheduler()
+    start_maintenance_scheduler()
+    start_metrics_server()
+    get_job_runner()
+
     with st.sidebar:
         st.markdown(
             '<div class="sidebar-logo">THE XXX AD POSTER</div>',
@@ -1854,8 +8821,16 @@ def main_app():
                 "Affiliate Programs (Tracker)",
                 "Ad Builder",
                 "Performance",
+                "Cohorts & LTV",
                 "A/B Split Tester",
+                "CTR Scorer",
+                "Rules",
+                "Compliance",
                 "Export / Copy",
+                "Search",
+                "Archive",
+                "Jobs",
+                "Backups",
                 "Strategy",
                 "Affiliate Program Directory",
                 "Links & Resources",
@@ -1868,28 +8843,48 @@ def main_app():
             st.session_state["auth_ok"] = False
             safe_rerun()
 
-    if page == "Dashboard":
-        page_dashboard()
-    elif page == "Affiliate Programs (Tracker)":
-        page_affiliate_programs()
-    elif page == "Ad Builder":
-        page_ad_builder()
-    elif page == "Performance":
-        page_performance()
-    elif page == "A/B Split Tester":
-        page_ab_split()
-    elif page == "Export / Copy":
-        page_export_copy()
-    elif page == "Strategy":
-        page_strategy()
-    elif page == "Affiliate Program Directory":
-        page_affiliate_directory()
-    elif page == "Links & Resources":
-        page_links_resources()
-    elif page == "Integrations":
-        page_integrations()
-    else:
-        page_dashboard()
+    started = time.perf_counter()
+    try:
+        if page == "Dashboard":
+            page_dashboard()
+        elif page == "Affiliate Programs (Tracker)":
+            page_affiliate_programs()
+        elif page == "Ad Builder":
+            page_ad_builder()
+        elif page == "Performance":
+            page_performance()
+        elif page == "Cohorts & LTV":
+            page_cohorts()
+        elif page == "A/B Split Tester":
+            page_ab_split()
+        elif page == "CTR Scorer":
+            page_ctr_scorer()
+        elif page == "Rules":
+            page_rules()
+        elif page == "Compliance":
+            page_compliance()
+        elif page == "Export / Copy":
+            page_export_copy()
+        elif page == "Search":
+            page_search()
+        elif page == "Jobs":
+            page_jobs()
+        elif page == "Backups":
+            page_backups()
+        elif page == "Archive":
+            page_archive()
+        elif page == "Strategy":
+            page_strategy()
+        elif page == "Affiliate Program Directory":
+            page_affiliate_directory()
+        elif page == "Links & Resources":
+            page_links_resources()
+        elif page == "Integrations":
+            page_integrations()
+        else:
+            page_dashboard()
+    finally:
+        get_metrics().observe("xxx_page_render_seconds", time.perf_counter() - started, page=page)
 
 
 # =========================
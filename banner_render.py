@@ -0,0 +1,156 @@
+"""
+Banner drawing for THE XXX AD POSTER, kept apart from app.py so the
+render worker processes only need Pillow – no Streamlit, DB or secrets.
+Everything here is a pure function of its arguments.
+"""
+
+import functools
+import io
+import os
+import time
+from typing import List, Optional, Tuple
+
+try:
+    from PIL import Image, ImageDraw, ImageFont  # optional banner renderer
+except ImportError:
+    Image = ImageDraw = ImageFont = None
+
+BANNER_SIZES = {
+    "300x250": (300, 250),
+    "300x100": (300, 100),
+    "728x90": (728, 90),
+    "160x600": (160, 600),
+    "320x50": (320, 50),
+}
+BANNER_FORMATS = {"PNG": "png", "WEBP": "webp"}
+BANNER_COLORS = {"bg_top": (60, 0, 26), "bg_bottom": (5, 5, 6), "text": (245, 245, 245), "accent": (255, 77, 148)}
+# Size -> boxes (x0, y0, x1, y1 as fractions) for headline / body / CTA button.
+# A missing body box means the size is too small to carry body copy.
+BANNER_LAYOUTS = {
+    "300x250": {"headline": (0.06, 0.06, 0.94, 0.34), "body": (0.06, 0.37, 0.94, 0.68), "cta": (0.18, 0.75, 0.82, 0.92)},
+    "300x100": {"headline": (0.04, 0.08, 0.64, 0.52), "body": (0.04, 0.56, 0.64, 0.92), "cta": (0.68, 0.26, 0.96, 0.74)},
+    "728x90": {"headline": (0.02, 0.08, 0.72, 0.52), "body": (0.02, 0.56, 0.72, 0.92), "cta": (0.76, 0.22, 0.98, 0.78)},
+    "160x600": {"headline": (0.08, 0.05, 0.92, 0.30), "body": (0.08, 0.33, 0.92, 0.78), "cta": (0.10, 0.84, 0.90, 0.93)},
+    "320x50": {"headline": (0.03, 0.10, 0.70, 0.90), "cta": (0.73, 0.18, 0.97, 0.82)},
+}
+
+
+@functools.lru_cache(maxsize=256)
+def _banner_font(path: Optional[str], size: int):
+    return ImageFont.truetype(path, size) if path else ImageFont.load_default(size=size)
+
+
+def _wrap_text(text: str, font, width: float) -> List[str]:
+    lines, line = [], ""
+    for word in text.split():
+        candidate = f"{line} {word}".strip()
+        if line and font.getlength(candidate) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = candidate
+    return lines + ([line] if line else [])
+
+
+def _clip_line(line: str, font, width: float, mark: str = "…") -> str:
+    while line and font.getlength(line + mark) > width:
+        line = line[:-1]
+    return line.rstrip() + mark
+
+
+def fit_text(text: str, width: int, height: int, font_path: Optional[str], max_size: int = 64, min_size: int = 9):
+    """Largest font size whose word-wrapped text fits the box -> (font, lines, line height)."""
+    text = " ".join((text or "").split())
+    lo, hi, best = min_size, max_size, None
+    while lo <= hi:  # binary search on the font size
+        size = (lo + hi) // 2
+        font = _banner_font(font_path, size)
+        lines = _wrap_text(text, font, width)
+        line_h = int(size * 1.2)
+        if len(lines) * line_h <= height and all(font.getlength(l) <= width for l in lines):
+            best = (font, lines, line_h)
+            lo = size + 1
+        else:
+            hi = size - 1
+    if best is None:
+        # Doesn't fit even at min_size: keep the lines that do, clip any line
+        # still wider than the box (one long word) and mark every cut.
+        font = _banner_font(font_path, min_size)
+        line_h = int(min_size * 1.2)
+        wrapped = _wrap_text(text, font, width)
+        lines = wrapped[: max(1, height // line_h)]
+        cut_after = len(lines) < len(wrapped)
+        lines = [
+            _clip_line(l, font, width)
+            if font.getlength(l) > width or (cut_after and i == len(lines) - 1)
+            else l
+            for i, l in enumerate(lines)
+        ]
+        best = (font, lines, line_h)
+    return best
+
+
+def render_banner_bytes(
+    headline: str, body: str, cta: str, size: str, fmt: str = "PNG", font_path: Optional[str] = None
+) -> bytes:
+    """Render one banner image (font_path None = Pillow's bundled font)."""
+    if Image is None:
+        raise RuntimeError("Banner rendering needs Pillow: pip install pillow")
+    w, h = BANNER_SIZES[size]
+    layout = BANNER_LAYOUTS[size]
+    colors = BANNER_COLORS
+
+    img = Image.new("RGB", (w, h))
+    draw = ImageDraw.Draw(img)
+    top, bottom = colors["bg_top"], colors["bg_bottom"]
+    for y in range(h):  # vertical gradient
+        t = y / max(1, h - 1)
+        draw.line([(0, y), (w, y)], fill=tuple(int(a + (b - a) * t) for a, b in zip(top, bottom)))
+    draw.rectangle([0, 0, w - 1, h - 1], outline=colors["accent"])
+
+    def box(name):
+        x0, y0, x1, y1 = layout[name]
+        return int(x0 * w), int(y0 * h), int(x1 * w), int(y1 * h)
+
+    def draw_text(name, text, fill, max_size, align_center=False):
+        x0, y0, x1, y1 = box(name)
+        font, lines, line_h = fit_text(text, x1 - x0, y1 - y0, font_path, max_size=max_size)
+        y = y0 + ((y1 - y0) - len(lines) * line_h) // 2
+        for line in lines:
+            x = x0 + ((x1 - x0) - font.getlength(line)) / 2 if align_center else x0
+            draw.text((x, y), line, font=font, fill=fill)
+            y += line_h
+
+    draw_text("headline", headline, colors["text"], max_size=48)
+    if "body" in layout and body:
+        draw_text("body", body, (210, 210, 215), max_size=24)
+    x0, y0, x1, y1 = box("cta")
+    draw.rounded_rectangle([x0, y0, x1, y1], radius=(y1 - y0) // 3, fill=colors["accent"])
+    pad = max(2, (y1 - y0) // 8)
+    cta_box = (x0 + pad * 2, y0 + pad, x1 - pad * 2, y1 - pad)
+    font, lines, line_h = fit_text(cta or "Learn More", cta_box[2] - cta_box[0], cta_box[3] - cta_box[1], font_path, 28)
+    y = cta_box[1] + ((cta_box[3] - cta_box[1]) - len(lines) * line_h) // 2
+    for line in lines:
+        draw.text((x0 + ((x1 - x0) - font.getlength(line)) / 2, y), line, font=font, fill=(255, 255, 255))
+        y += line_h
+
+    out = io.BytesIO()
+    if fmt == "WEBP":
+        img.save(out, "WEBP", quality=85, method=4)
+    else:
+        img.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+
+def render_banner_task(task: Tuple[str, str, str, str, str, str, Optional[str]]) -> Tuple[str, float]:
+    """Worker entry point: render + write atomically; returns (path, render ms)."""
+    path, headline, body, cta, size, fmt, font_path = task
+    started = time.perf_counter()
+    data = render_banner_bytes(headline, body, cta, size, fmt, font_path)
+    ms = (time.perf_counter() - started) * 1000
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return path, ms
@@ -0,0 +1,492 @@
+"""
+Concurrent-session load test for THE XXX AD POSTER.
+
+Starts `streamlit run app.py` against a scratch DB (or targets a server you
+already run via --url) and drives N concurrent headless sessions over the
+same websocket protocol the browser uses, so all sessions share one server
+process: its st.cache_resource objects, the DB writer thread and the
+schedulers. (streamlit.testing's AppTest cannot be used here: it swaps a
+process-global Runtime and st.secrets on every run, so parallel AppTests
+trip over each other.)
+
+Flows:
+  login        – fresh session, fill the login form, land on the Dashboard
+  ad_builder   – Ad Builder, generate (built-in engine) and save one ad
+  performance  – Performance, pick a random ad, save new metrics
+  ab_compare   – A/B Split Tester, compare 2–4 random ads
+
+Reports per flow: runs, errors, DB lock errors, throughput and p50/p95/p99
+latency (wall time of all script runs in the flow, as a user would wait).
+
+Needs the dev requirements (the `websockets` client is not an app
+dependency):
+
+    pip install -r requirements-dev.txt
+    python loadtest.py --sessions 8 --duration 60
+    python loadtest.py --sessions 16 --iterations 20 --flows performance,ab_compare
+    python loadtest.py --url http://127.0.0.1:8501 --sessions 4   # writes to that server's DB!
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+import pandas as pd
+from streamlit.proto.Alert_pb2 import Alert
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+try:
+    import websockets
+except ImportError:  # dev requirement only (requirements-dev.txt)
+    websockets = None
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+DB_NAME = "xxx_ad_poster.db"
+ADMIN_USERNAME = "loadtest"
+ADMIN_PASSWORD = "loadtest-pw"
+NAV_LABEL = ""  # the sidebar page radio has an empty label
+FLOW_WEIGHTS = {"login": 1, "ad_builder": 2, "performance": 4, "ab_compare": 3}
+LOCK_MARKERS = ("database is locked", "database table is locked", "sqlite_busy")
+RUN_TIMEOUT = 60.0
+SERVER_START_TIMEOUT = 60.0
+
+WIDGET_TYPES = ("button", "checkbox", "multiselect", "number_input", "radio", "selectbox", "text_area", "text_input")
+FINISHED = {
+    ForwardMsg.FINISHED_SUCCESSFULLY,
+    ForwardMsg.FINISHED_WITH_COMPILE_ERROR,
+    ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY,
+}
+
+
+class FlowError(Exception):
+    pass
+
+
+# =========================
+# Websocket session (a headless browser tab)
+# =========================
+
+class Widget:
+    def __init__(self, kind: str, proto, fragment_id: str):
+        self.kind = kind
+        self.proto = proto
+        self.fragment_id = fragment_id
+
+    @property
+    def id(self) -> str:
+        return self.proto.id
+
+    @property
+    def options(self) -> List[str]:
+        return list(self.proto.options)
+
+
+class Session:
+    """One websocket connection = one Streamlit session with its own session_state."""
+
+    def __init__(self, ws_url: str):
+        self.ws_url = ws_url
+        self.ws = None
+        self.page_hash = ""
+        self.widgets: Dict[str, Widget] = {}  # label -> widget from the latest run
+        self.values: Dict[str, WidgetState] = {}  # id -> value we set (kept while the widget exists)
+        self.errors: List[str] = []
+        self.successes: List[str] = []
+
+    async def connect(self):
+        self.ws = await websockets.connect(self.ws_url, subprotocols=["streamlit"], max_size=None)
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+    def widget(self, label: str) -> Widget:
+        w = self.widgets.get(label)
+        if w is None:
+            raise FlowError(f"widget not found: {label!r}")
+        return w
+
+    def set(self, label: str, value) -> Widget:
+        w = self.widget(label)
+        state = WidgetState(id=w.id)
+        if w.kind == "multiselect":
+            state.string_array_value.data.extend(value)
+        elif w.kind == "number_input":
+            state.double_value = float(value)
+        elif w.kind == "checkbox":
+            state.bool_value = bool(value)
+        else:
+            state.string_value = value
+        self.values[w.id] = state
+        return w
+
+    async def run(self, trigger: Optional[str] = None, fragment_id: str = "") -> float:
+        """Send one rerun (optionally clicking `trigger`) and wait for the script to finish."""
+        msg = BackMsg()
+        client_state = msg.rerun_script
+        client_state.page_script_hash = self.page_hash
+        client_state.fragment_id = fragment_id
+        client_state.widget_states.widgets.extend(self.values.values())
+        if trigger is not None:
+            client_state.widget_states.widgets.append(WidgetState(id=self.widget(trigger).id, trigger_value=True))
+        self.errors, self.successes = [], []
+        started = time.perf_counter()
+        await self.ws.send(msg.SerializeToString())
+        while True:
+            raw = await asyncio.wait_for(self.ws.recv(), RUN_TIMEOUT)
+            fwd = ForwardMsg()
+            fwd.ParseFromString(raw)
+            kind = fwd.WhichOneof("type")
+            if kind == "new_session":
+                self.page_hash = fwd.new_session.page_script_hash or self.page_hash
+                if not fwd.new_session.fragment_ids_this_run:
+                    self.widgets = {}
+            elif kind == "delta":
+                self._collect(fwd.delta)
+            elif kind == "script_finished" and fwd.script_finished in FINISHED:
+                break
+        elapsed = time.perf_counter() - started
+        live = {w.id for w in self.widgets.values()}
+        self.values = {wid: state for wid, state in self.values.items() if wid in live}
+        return elapsed
+
+    async def click(self, label: str) -> float:
+        return await self.run(trigger=label, fragment_id=self.widget(label).fragment_id)
+
+    def _collect(self, delta):
+        if delta.WhichOneof("type") != "new_element":
+            return
+        el = delta.new_element
+        kind = el.WhichOneof("type")
+        if kind in WIDGET_TYPES:
+            proto = getattr(el, kind)
+            self.widgets[proto.label] = Widget(kind, proto, delta.fragment_id)
+        elif kind == "exception":
+            self.errors.append(f"{el.exception.type}: {el.exception.message}")
+        elif kind == "alert":
+            if el.alert.format == Alert.ERROR:
+                self.errors.append(el.alert.body)
+            elif el.alert.format == Alert.SUCCESS:
+                self.successes.append(el.alert.body)
+
+    def check(self):
+        if self.errors:
+            raise FlowError(self.errors[0])
+
+
+# =========================
+# Flows
+# =========================
+
+async def goto(sess: Session, page: str) -> float:
+    sess.set(NAV_LABEL, page)
+    elapsed = await sess.run()
+    sess.check()
+    return elapsed
+
+
+async def flow_login(sess: Optional[Session], ws_url: str, rng: random.Random):
+    if sess is not None:
+        await sess.close()
+    sess = Session(ws_url)
+    await sess.connect()
+    elapsed = await sess.run()
+    sess.check()
+    sess.set("Username", ADMIN_USERNAME)
+    sess.set("Password", ADMIN_PASSWORD)
+    # safe_rerun() after a good login → the same request ends on the Dashboard
+    elapsed += await sess.click("Log In")
+    sess.check()
+    if NAV_LABEL not in sess.widgets:
+        raise FlowError("login rejected")
+    return sess, elapsed
+
+
+async def flow_ad_builder(sess: Session, ws_url: str, rng: random.Random):
+    elapsed = await goto(sess, "Ad Builder")
+    sess.set("Attach Ad To Program", rng.choice(sess.widget("Attach Ad To Program").options))
+    elapsed += await sess.run()
+    sess.set("AI Engine for Copy", "Built-in (no API)")
+    sess.set("Internal Ad Name / Label", f"Load test ad {rng.randrange(10**6)}")
+    elapsed += await sess.click("✨ Generate & Save")
+    sess.check()
+    if not any("saved" in s for s in sess.successes):
+        raise FlowError("ad not saved")
+    return sess, elapsed
+
+
+async def flow_performance(sess: Session, ws_url: str, rng: random.Random):
+    elapsed = await goto(sess, "Performance")
+    ads = sess.set("Select Ad to Update", rng.choice(sess.widget("Select Ad to Update").options))
+    elapsed += await sess.run(fragment_id=ads.fragment_id)
+    sess.check()
+    impressions = rng.randint(1_000, 100_000)
+    clicks = rng.randint(0, impressions // 20)
+    sales = rng.randint(0, max(1, clicks // 30))
+    sess.set("Impressions", impressions)
+    sess.set("Clicks", clicks)
+    sess.set("Sales", sales)
+    sess.set("Revenue ($)", sales * 35)
+    elapsed += await sess.click("💾 Save Metrics")
+    sess.check()
+    return sess, elapsed
+
+
+async def flow_ab_compare(sess: Session, ws_url: str, rng: random.Random):
+    elapsed = await goto(sess, "A/B Split Tester")
+    options = sess.widget("Select 2–6 ads to compare").options
+    picker = sess.set("Select 2–6 ads to compare", rng.sample(options, min(len(options), rng.randint(2, 4))))
+    elapsed += await sess.run(fragment_id=picker.fragment_id)
+    sess.check()
+    return sess, elapsed
+
+
+FLOWS = {
+    "login": flow_login,
+    "ad_builder": flow_ad_builder,
+    "performance": flow_performance,
+    "ab_compare": flow_ab_compare,
+}
+
+
+# =========================
+# Scratch server & DB
+# =========================
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_healthy(base_url: str, proc: Optional[subprocess.Popen] = None):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise SystemExit(f"streamlit exited with code {proc.returncode}")
+        try:
+            with urllib.request.urlopen(f"{base_url}/_stcore/health", timeout=2) as resp:
+                if resp.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"{base_url} did not become healthy in {SERVER_START_TIMEOUT:.0f}s")
+
+
+def seed_db(db_path: str, n_programs: int, n_ads: int):
+    """Programs, ads and one metrics row per ad, on the schema init_db() created."""
+    rng = random.Random(7)
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO affiliate_programs (name, niche, geo_focus, signup_url, status, notes) "
+        "VALUES (?, 'Other Adult', 'US', 'https://example.com', 'Approved', '')",
+        [(f"Load program {i}",) for i in range(n_programs)],
+    )
+    conn.executemany(
+        "INSERT INTO ad_creatives (program_id, title, angle, headline, body, call_to_action, "
+        "placement_type, traffic_source, campaign_notes) "
+        "VALUES (?, ?, 'Curiosity', ?, 'Discreet adult offers.', 'Tap to explore.', "
+        "'Native / Widget', ?, '')",
+        [
+            (rng.randint(1, n_programs), f"Load ad {i}", f"Headline {i}", rng.choice(["ExoClick", "JuicyAds"]))
+            for i in range(n_ads)
+        ],
+    )
+    conn.executemany(
+        "INSERT INTO ad_performance (ad_id, impressions, clicks, leads, sales, revenue) "
+        "VALUES (?, 10000, ?, 0, ?, ?)",
+        [(ad_id, rng.randint(50, 500), sales, sales * 35.0)
+         for ad_id, sales in ((ad_id, rng.randint(0, 10)) for ad_id in range(1, n_ads + 1))],
+    )
+    conn.commit()
+    conn.close()
+
+
+def start_server(workdir: str, port: int, db_path: Optional[str]) -> subprocess.Popen:
+    """`streamlit run app.py` from a scratch dir (DB, backups, secrets all live there)."""
+    os.makedirs(os.path.join(workdir, ".streamlit"), exist_ok=True)
+    with open(os.path.join(workdir, ".streamlit", "secrets.toml"), "w", encoding="utf-8") as f:
+        f.write(
+            f'ADMIN_USERNAME = "{ADMIN_USERNAME}"\nADMIN_PASSWORD = "{ADMIN_PASSWORD}"\n'
+            'ZAPIER_WEBHOOK_URL = ""\nMETRICS_PORT = 0\n'
+        )
+    if db_path:
+        src = sqlite3.connect(db_path)
+        dest = sqlite3.connect(os.path.join(workdir, DB_NAME))
+        src.backup(dest)
+        dest.close()
+        src.close()
+    cmd = [
+        sys.executable, "-m", "streamlit", "run", APP_PATH,
+        "--server.headless", "true",
+        "--server.address", "127.0.0.1",
+        "--server.port", str(port),
+        "--browser.gatherUsageStats", "false",
+        "--server.fileWatcherType", "none",
+    ]
+    log = open(os.path.join(workdir, "streamlit.log"), "wb")
+    return subprocess.Popen(cmd, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def init_schema(ws_url: str):
+    """One login-page render so init_db() creates the schema before seeding."""
+    sess = Session(ws_url)
+    await sess.connect()
+    await sess.run()
+    await sess.close()
+
+
+# =========================
+# Runner & report
+# =========================
+
+class Results:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.lock_errors: Dict[str, int] = {}
+        self.last_error: Dict[str, str] = {}
+
+    def record(self, flow: str, seconds: float, error: Optional[str]):
+        self.samples.setdefault(flow, []).append(seconds)
+        if error:
+            self.errors[flow] = self.errors.get(flow, 0) + 1
+            self.last_error[flow] = error[:200]
+            if any(m in error.lower() for m in LOCK_MARKERS):
+                self.lock_errors[flow] = self.lock_errors.get(flow, 0) + 1
+
+
+def percentile(values: List[float], q: int) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+async def run_session(idx: int, ws_url: str, flows: List[str], deadline: float, iterations: int, results: Results):
+    rng = random.Random(idx)
+    weights = [FLOW_WEIGHTS[f] for f in flows]
+    sess = None
+    done = 0
+    while time.monotonic() < deadline and (not iterations or done < iterations):
+        # Every session logs in first (and again after a broken one); later picks are weighted.
+        flow = "login" if sess is None else rng.choices(flows, weights)[0]
+        started = time.perf_counter()
+        error = None
+        try:
+            sess, _ = await FLOWS[flow](sess, ws_url, rng)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if flow == "login" or isinstance(e, (asyncio.TimeoutError, websockets.ConnectionClosed)):
+                sess = None
+        results.record(flow, time.perf_counter() - started, error)
+        done += 1
+    if sess is not None:
+        await sess.close()
+
+
+def report(results: Results, wall: float) -> pd.DataFrame:
+    rows = []
+    for flow, samples in sorted(results.samples.items()):
+        rows.append(
+            {
+                "flow": flow,
+                "runs": len(samples),
+                "errors": results.errors.get(flow, 0),
+                "lock_errors": results.lock_errors.get(flow, 0),
+                "throughput_per_s": round(len(samples) / wall, 2),
+                "p50_ms": round(percentile(samples, 50) * 1000, 1),
+                "p95_ms": round(percentile(samples, 95) * 1000, 1),
+                "p99_ms": round(percentile(samples, 99) * 1000, 1),
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+async def run_load(ws_url: str, args, flows: List[str]) -> Results:
+    results = Results()
+    deadline = time.monotonic() + args.duration if not args.iterations else float("inf")
+    await asyncio.gather(
+        *(run_session(i, ws_url, flows, deadline, args.iterations, results) for i in range(args.sessions))
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent sessions")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    parser.add_argument("--iterations", type=int, default=0, help="flows per session (0 = until --duration)")
+    parser.add_argument("--flows", default=",".join(FLOWS), help="comma-separated subset of: " + ", ".join(FLOWS))
+    parser.add_argument("--url", help="drive an already running server instead of starting one")
+    parser.add_argument("--db", help="start the scratch server on a copy of this DB instead of seeding one")
+    parser.add_argument("--programs", type=int, default=10)
+    parser.add_argument("--ads", type=int, default=200)
+    parser.add_argument("--json", help="also write the report rows to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = parser.parse_args()
+
+    if websockets is None:
+        parser.error("the 'websockets' package is required: pip install -r requirements-dev.txt")
+    flows = [f.strip() for f in args.flows.split(",") if f.strip()]
+    unknown = set(flows) - set(FLOWS)
+    if unknown:
+        parser.error(f"unknown flows: {', '.join(sorted(unknown))}")
+
+    proc, workdir = None, None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        workdir = tempfile.mkdtemp(prefix="xxx_load_")
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        proc = start_server(workdir, port, args.db)
+    ws_url = base_url.replace("http", "ws", 1) + "/_stcore/stream"
+
+    try:
+        wait_healthy(base_url, proc)
+        if proc is not None and not args.db:
+            asyncio.run(init_schema(ws_url))
+            seed_db(os.path.join(workdir, DB_NAME), args.programs, args.ads)
+        print(f"Target {base_url} · {args.sessions} sessions · flows: {', '.join(flows)}")
+
+        started = time.monotonic()
+        results = asyncio.run(run_load(ws_url, args, flows))
+        wall = time.monotonic() - started
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    df = report(results, wall)
+    total = int(df["runs"].sum()) if not df.empty else 0
+    print(f"\nWall time {wall:.1f}s · {total} flows · {total / wall:.2f} flows/s\n")
+    print(df.to_string(index=False))
+    for flow, msg in sorted(results.last_error.items()):
+        print(f"  last {flow} error: {msg}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"sessions": args.sessions, "wall_s": wall, "flows": df.to_dict("records")}, f, indent=2)
+
+    if workdir and not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    elif workdir:
+        print(f"\nScratch dir kept: {workdir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# app.py uses relative paths (DB, archive, banners, exports): run in a scratch dir.
+os.chdir(tempfile.mkdtemp(prefix="xxx_tests_"))
+sys.path.insert(0, ROOT)
+
+import app  # noqa: E402
+
+app.init_db()
+
+DATA_TABLES = [
+    "rule_hits",
+    "rules",
+    "ad_compliance",
+    "banner_renders",
+    "cohort_signups",
+    "cohort_revenue",
+    "cohort_source_signups",
+    "cohort_source_revenue",
+    "ad_performance",
+    "ad_creatives",
+    "affiliate_programs",
+]
+
+
+def _wipe(conn):
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table in DATA_TABLES:
+        if table in existing:
+            conn.execute(f"DELETE FROM {table}")
+
+
+@pytest.fixture
+def db():
+    """The app module on an emptied database (schema and meta counters kept)."""
+    app.submit_write(_wipe).result()
+    if os.path.exists(app.ARCHIVE_DB_PATH):
+        cold = app.get_archive_conn()
+        cold.execute("DELETE FROM archived_ads")
+        cold.commit()
+        cold.close()
+    return app
+
+
+@pytest.fixture
+def program(db):
+    return db.insert_program("Test Program", "Dating", "US", "https://example.com", "Approved", "")
+
+
+@pytest.fixture
+def make_ad(db, program):
+    def make(headline="Headline", body="Body", cta="Join", placement="Text Only", source="ExoClick", notes="", **kw):
+        return db.insert_ad(
+            kw.get("program_id", program), kw.get("title", headline), kw.get("angle", "Curiosity"),
+            headline, body, cta, placement, source, notes,
+        )
+
+    return make
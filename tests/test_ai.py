@@ -0,0 +1,180 @@
+import json
+
+import pytest
+
+KEYS = {"OPENAI_API_KEY": "sk-test", "ANTHROPIC_API_KEY": "ak-test", "GEMINI_API_KEY": "gk-test"}
+
+
+@pytest.fixture
+def ai(db, monkeypatch):
+    monkeypatch.setattr(db.st, "secrets", KEYS)
+    return db
+
+
+class _Resp:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+@pytest.mark.parametrize(
+    "provider, body, limit",
+    [
+        ("OpenAI", {"choices": [{"message": {"content": "x"}}]}, lambda p: p["max_tokens"]),
+        ("Gemini", {"candidates": [{}]}, lambda p: p["generationConfig"]["maxOutputTokens"]),
+        ("Claude (Anthropic)", {"content": []}, lambda p: p["max_tokens"]),
+    ],
+)
+def test_every_provider_sends_the_max_tokens_override(ai, monkeypatch, provider, body, limit):
+    sent = []
+    monkeypatch.setattr(ai.requests, "post", lambda url, **kw: sent.append(kw["json"]) or _Resp(body))
+    ai.call_ai_provider(provider, "key", "prompt", max_tokens=1234)
+    assert limit(sent[0]) == 1234
+
+
+def test_batch_variants_are_hedged_with_the_scaled_token_limit(ai, monkeypatch):
+    calls = []
+    answer = json.dumps([{"headline": f"H{i}", "body": f"B{i}", "cta": "Go"} for i in range(3)])
+
+    def fake_call(provider, api_key, prompt, session_id=None, max_tokens=None):
+        calls.append((provider, max_tokens))
+        if provider == "OpenAI":
+            raise RuntimeError("primary down")
+        return answer
+
+    monkeypatch.setattr(ai, "rate_limited_call", fake_call)
+    variants = ai.generate_ad_variants_with_ai(
+        "OpenAI", "Offer", "Dating", "Adults", "Fun", ["Curiosity"] * 3, hedge_provider="Gemini"
+    )
+    assert [v["headline"] for v in variants] == ["H0", "H1", "H2"]
+    assert all(v["source"] == "ai" for v in variants)
+    assert sorted(calls) == [("Gemini", 1200), ("OpenAI", 1200)]
+
+
+AD = {"headline": 'Meet "local" singles 😀', "body": "Line one\nline two – tonight\\now", "cta": "Join"}
+
+
+def test_partial_parser_matches_the_final_json_for_any_split(ai):
+    text = "```json\n" + json.dumps(AD) + "\n```"
+    for size in (1, 2, 3, 5, 7, 64):
+        parser = ai.PartialAdParser()
+        for i in range(0, len(text), size):
+            fields = parser.feed(text[i:i + size])
+            assert all(AD[k].startswith(v) for k, v in fields.items())
+        assert fields == AD
+
+
+def test_streamed_generation_against_a_stub_sse_server(ai, monkeypatch):
+    import http.server
+    import threading
+
+    payload = json.dumps(AD)
+    deltas = [payload[i:i + 4] for i in range(0, len(payload), 4)]
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for d in deltas:
+                chunk = {"choices": [{"delta": {"content": d}}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.write(b"data: [DONE]\n\n")
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(ai.st, "secrets", {**KEYS, "OPENAI_BASE_URL": f"http://127.0.0.1:{server.server_port}"})
+    seen = []
+    try:
+        ad = ai.generate_ad_with_ai(
+            "OpenAI", "Offer", "Dating", "Adults", "Fun", "Curiosity",
+            on_partial=lambda fields, ttft: seen.append(fields),
+        )
+    finally:
+        server.shutdown()
+    assert ad == AD
+    assert len(seen) == len(deltas)
+    assert seen[-1] == AD
+    assert any(0 < len(f.get("headline", "")) < len(AD["headline"]) for f in seen)
+
+
+def test_token_bucket_waits_refills_and_drains(ai):
+    bucket = ai.TokenBucket(capacity=2, per_second=10)
+    assert bucket.wait_time(2) == 0
+    bucket.take(2)
+    assert bucket.wait_time(1) == pytest.approx(0.1, abs=0.02)
+    assert bucket.wait_time(50) == pytest.approx(0.2, abs=0.02)  # capped at capacity
+    bucket.drain(3)  # e.g. a 429 with Retry-After: 3
+    assert bucket.wait_time(1) == pytest.approx(3, abs=0.02)
+
+
+def test_breaker_opens_probes_once_and_closes(ai):
+    import time
+
+    breaker = ai.CircuitBreaker("OpenAI", failures=2, reset_s=0.05)
+    breaker.record_failure()
+    breaker.check()
+    breaker.record_failure()
+    with pytest.raises(ai.AICircuitOpen):
+        breaker.check()
+    time.sleep(0.06)
+    breaker.check()  # the half-open probe
+    assert breaker.state == "half-open"
+    with pytest.raises(ai.AICircuitOpen):
+        breaker.check()  # only one probe at a time
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.trips == 2
+    time.sleep(0.06)
+    breaker.check()
+    breaker.record_success()
+    breaker.check()
+    assert breaker.state == "closed" and breaker.short_circuits == 2
+
+
+def test_hedge_fires_after_the_delay_and_the_fastest_answer_wins(ai, monkeypatch):
+    import time
+
+    monkeypatch.setattr(ai.st, "secrets", {**KEYS, "AI_HEDGE_DELAY_S": "0.05"})
+    fast = json.dumps({"headline": "H", "body": "B", "cta": "Go"})
+
+    def fake_call(provider, api_key, prompt, session_id=None, max_tokens=None):
+        if provider == "OpenAI":
+            time.sleep(0.5)
+        return fast
+
+    monkeypatch.setattr(ai, "rate_limited_call", fake_call)
+    before = dict(ai.get_ai_latency_stats().hedge)
+    started = time.perf_counter()
+    result, provider = ai.hedged_ai_call("OpenAI", "k1", "Gemini", "k2", "prompt")
+    assert time.perf_counter() - started < 0.4
+    assert provider == "Gemini" and result["headline"] == "H"
+    after = ai.get_ai_latency_stats().hedge
+    assert {k: after[k] - before[k] for k in after} == {
+        "hedged_calls": 1, "hedges_fired": 1, "primary_won": 0, "hedge_won": 1,
+    }
+
+
+def test_missing_secrets_file_falls_back_without_an_error(db, monkeypatch):
+    class NoSecretsFile:
+        def get(self, key, default=None):
+            raise FileNotFoundError("secrets.toml")
+
+    monkeypatch.setattr(db.st, "secrets", NoSecretsFile())
+    warnings = []
+    monkeypatch.setattr(db, "ui_warning", warnings.append)
+    base = db.generate_ad_from_brief("Offer", "Dating", "Adults", "Fun", "Curiosity")
+    assert db.generate_ad_with_ai("OpenAI", "Offer", "Dating", "Adults", "Fun", "Curiosity") == base
+    assert db.generate_ad_variants_with_ai("OpenAI", "Offer", "Dating", "Adults", "Fun", ["Curiosity"] * 2)
+    assert warnings == []
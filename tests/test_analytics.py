@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+
+
+def test_stats_counters_add_up_across_threads(db):
+    stats = db.AnalyticsStats()
+
+    def hammer():
+        for _ in range(2_000):
+            stats.observe("sqlite", 0.001)
+
+    threads = [threading.Thread(target=hammer) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert stats.snapshot().loc["sqlite", "queries"] == 16_000
+
+
+def test_sync_mode_queries_survive_concurrent_resyncs(db, make_ad):
+    ad = make_ad()
+    engine = db.DuckDBEngine(db.DB_PATH)
+    engine.mode = "sync"
+    errors, done = [], threading.Event()
+
+    def reader():
+        while not done.is_set():
+            try:
+                engine.query("SELECT COUNT(*) AS n FROM ad_performance")
+            except Exception as e:  # e.g. "table was dropped" mid-query
+                errors.append(e)
+
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    for t in readers:
+        t.start()
+    for i in range(20):
+        db.update_performance(ad, 100 + i, 1, 0, 0, 0.0)  # bumps data_version -> resync
+        engine.query("SELECT 1")
+    done.set()
+    for t in readers:
+        t.join()
+    assert not errors
+    assert engine.synced_version == db.get_data_version()
+    assert int(engine.query("SELECT impressions FROM ad_performance").iloc[0, 0]) == 119
@@ -0,0 +1,101 @@
+def _count(app, table, ad_id):
+    conn = app.get_conn()
+    n = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE ad_id = ?", (ad_id,)).fetchone()[0]
+    conn.close()
+    return n
+
+
+def _archive(app, ad_id):
+    app.update_ad_status(ad_id, "Paused")
+    assert app.archive_ads([ad_id]) == 1
+
+
+def test_archiving_drops_hot_only_rows(db, make_ad):
+    ad = make_ad()
+    hit = "INSERT INTO rule_hits (rule_id, ad_id, old_status, new_status) VALUES (1, ?, ?, ?)"
+    db.submit_write(
+        lambda conn: (
+            conn.execute(hit, (ad, "Active", "Paused")),
+            conn.execute(hit, (ad, "Paused", "Active")),
+            conn.execute(hit, (ad, "Active", "Paused")),
+            conn.execute("INSERT INTO banner_renders (ad_id, size, format, asset_key) VALUES (?, '300x250', 'PNG', 'k')", (ad,)),
+        )
+    ).result()
+    _archive(db, ad)
+    assert _count(db, "banner_renders", ad) == 0
+    # Only the latest hit survives: it keeps counting towards a bottom-N rule's N.
+    assert _count(db, "rule_hits", ad) == 1
+
+
+def test_fetch_ads_returns_dicts_for_hot_and_archived(db, make_ad):
+    hot, cold = make_ad(headline="hot"), make_ad(headline="cold")
+    _archive(db, cold)
+    ads = db.fetch_ads(include_archived=True)
+    assert [a["id"] for a in ads] == [cold, hot]
+    assert all(type(a) is dict for a in ads)
+    assert "archived_at" in ads[0] and "archived_at" not in ads[1]
+
+
+def test_performance_lookup_reads_the_archive_once(db, make_ad, monkeypatch):
+    hot = make_ad()
+    db.update_performance(hot, 100, 5, 0, 0, 0.0)
+    archived = [make_ad() for _ in range(3)]
+    for i, ad in enumerate(archived):
+        db.update_performance(ad, 1000 + i, 10, 1, 0, 2.5)
+    for ad in archived:
+        db.update_ad_status(ad, "Loser")
+    assert db.archive_ads(archived) == 3
+
+    loads = []
+    real = db.load_archived_ads
+    monkeypatch.setattr(db, "load_archived_ads", lambda ids=None: loads.append(ids) or real(ids))
+    perf = db.get_performance_for_ads([hot, *archived, 999_999])
+    assert len(loads) == 1 and sorted(loads[0]) == sorted([*archived, 999_999])
+    assert perf[hot]["impressions"] == 100
+    assert [perf[a]["impressions"] for a in archived] == [1000, 1001, 1002]
+    assert perf[999_999]["impressions"] == 0
+
+
+def _backdate(app, ad_id, days):
+    app.submit_write(
+        lambda conn: conn.execute(
+            "UPDATE ad_creatives SET last_active_at = datetime('now', ?) WHERE id = ?", (f"-{days} days", ad_id)
+        )
+    ).result()
+
+
+def test_only_idle_ads_are_archive_candidates(db, make_ad):
+    ad = make_ad()
+    db.update_ad_status(ad, "Paused")
+    assert db.find_archive_candidates() == []
+    _backdate(db, ad, db.ARCHIVE_AFTER_DAYS + 1)
+    assert db.find_archive_candidates() == [ad]
+    db.update_performance(ad, 100, 1, 0, 0, 0.0)  # fresh metrics restart the clock
+    assert db.find_archive_candidates() == []
+
+
+def test_updates_racing_the_archiver_stay_hot(db, make_ad, monkeypatch):
+    ad = make_ad()
+    db.update_ad_status(ad, "Paused")
+    real = db.get_archive_conn
+
+    def racing():
+        # Lands after the snapshot was read, before the hot rows are deleted.
+        db.update_performance(ad, 500, 50, 0, 0, 0.0)
+        return real()
+
+    monkeypatch.setattr(db, "get_archive_conn", racing)
+    assert db.archive_ads([ad]) == 0
+    monkeypatch.setattr(db, "get_archive_conn", real)
+    assert db.get_performance_for_ad(ad)["impressions"] == 500
+    assert db.load_archived_ads([ad]) == []
+
+
+def test_kpi_totals_include_archived_metrics(db, make_ad):
+    hot, cold = make_ad(), make_ad()
+    db.update_performance(hot, 100, 10, 1, 1, 5.0)
+    db.update_performance(cold, 1000, 20, 2, 2, 7.5)
+    _archive(db, cold)
+    assert db.fetch_kpi_totals()["revenue"] == 5.0
+    totals = db.fetch_kpi_totals(include_archived=True)
+    assert totals["impressions"] == 1100 and totals["revenue"] == 12.5
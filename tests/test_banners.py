@@ -0,0 +1,51 @@
+import os
+import time
+
+import pytest
+
+from banner_render import Image, fit_text
+
+pytestmark = pytest.mark.skipif(Image is None, reason="Pillow not installed")
+
+
+def test_fit_text_uses_the_largest_size_that_fits():
+    font, lines, line_h = fit_text("Meet singles tonight", 200, 60, None, max_size=48)
+    assert len(lines) * line_h <= 60
+    assert all(font.getlength(l) <= 200 for l in lines)
+    bigger = fit_text("Meet singles tonight", 200, 60, None, max_size=font.size + 1)[0]
+    assert bigger.size == font.size  # max_size wasn't what stopped it
+
+
+def test_fit_text_fallback_clips_every_line_to_the_box():
+    text = "Supercalifragilisticexpialidocious offers " + "word " * 40 + "Pneumonoultramicroscopic end"
+    font, lines, line_h = fit_text(text, 60, 30, None, max_size=20, min_size=9)
+    assert font.size == 9
+    assert len(lines) * line_h <= 30 or len(lines) == 1
+    assert all(font.getlength(l) <= 60 for l in lines)
+    assert lines[0].endswith("…") and lines[-1].endswith("…")
+
+
+def _ad(ad_id, headline="Discreet dating", body="Local singles", cta="Join free"):
+    return {"id": ad_id, "headline": headline, "body": body, "call_to_action": cta}
+
+
+def test_render_banners_reuses_cached_assets(db, make_ad):
+    ad = _ad(make_ad())
+    first = db.render_banners([ad], ["300x250", "320x50"], "PNG", workers=1)
+    assert [r["cached"] for r in first] == [False, False]
+    assert all(os.path.exists(r["path"]) for r in first)
+    again = db.render_banners([ad], ["300x250"], "PNG", workers=1)
+    assert again[0]["cached"] and again[0]["path"] == first[0]["path"]
+
+
+def test_prune_banner_cache_keeps_referenced_and_recent_assets(db, make_ad, tmp_path):
+    ad = _ad(make_ad(), headline="Kept banner")
+    (kept,) = db.render_banners([ad], ["300x250"], "PNG", workers=1)
+    orphan_old, orphan_new = tmp_path / "ab" / "old.png", tmp_path / "ab" / "new.png"
+    orphan_old.parent.mkdir()
+    orphan_old.write_bytes(b"x")
+    orphan_new.write_bytes(b"x")
+    os.utime(orphan_old, (time.time() - 48 * 3600,) * 2)
+    assert db.prune_banner_cache(str(tmp_path)) == 1
+    assert not orphan_old.exists() and orphan_new.exists()
+    assert os.path.exists(kept["path"])
@@ -0,0 +1,74 @@
+import pytest
+
+
+@pytest.mark.parametrize(
+    "notes, geo, bid_model, bid_amount",
+    [
+        ("US mobile only, SmartCPM $0.15, evenings 6–11pm", "US", "SmartCPM", 0.15),
+        ("UK + IE desktop, CPC $0.04", "IE,UK", "CPC", 0.04),
+        ("DE, AT, CH all devices, CPM 0.80 USD, 24/7", "AT,CH,DE", "CPM", 0.80),
+        ("Tier 1 mobile, CPA $25, nights", "T1", "CPA", 25.0),
+        ("Budget $50/day, CPC bid 0.12", None, "CPC", 0.12),
+        ("daily cap $20, bid of $0.30", None, None, 0.30),
+        ("Budget $50/day, $0.10", None, None, 0.10),
+        ("Budget $50/day", None, None, None),
+    ],
+)
+def test_parse_campaign_notes(db, notes, geo, bid_model, bid_amount):
+    dims = db.parse_campaign_notes(notes)
+    assert (dims["geo"], dims["bid_model"], dims["bid_amount"]) == (geo, bid_model, bid_amount)
+
+
+@pytest.mark.parametrize(
+    "notes, geo",
+    [
+        ("NO popups, IT works on mobile, ID required", None),
+        ("IN stock offers, BE quick", None),
+        ("US/NO desktop", "NO,US"),
+        ("GEO: IT", "IT"),
+        ("Targeting IN and ID, mobile", "ID,IN"),
+    ],
+)
+def test_geo_codes_that_are_words_need_context(db, notes, geo):
+    assert db.parse_campaign_notes(notes)["geo"] == geo
+
+
+def test_daypart_and_device(db):
+    dims = db.parse_campaign_notes("US mobile only, SmartCPM $0.15, evenings 6–11pm")
+    assert dims["device"] == "Mobile"
+    assert (dims["daypart_start"], dims["daypart_end"]) == (18, 23)
+
+
+def test_geo_filter_matches_multi_geo_ads(db, make_ad):
+    us = make_ad(notes="US mobile, CPC $0.10")
+    both = make_ad(notes="US, CA desktop, CPC $0.10")
+    make_ad(notes="DE mobile, CPC $0.10")
+    df = db.fetch_campaign_breakdown(db.get_data_version(), ("device",), (("geo", "US"),), "sqlite")
+    assert int(df["ads"].sum()) == 2
+    assert "US" in db.fetch_campaign_dimension_values(db.get_data_version())["geo"]
+
+    # Editing the notes keeps the GEO rows in step.
+    db.submit_write(lambda conn: conn.execute("UPDATE ad_creatives SET geo = 'CA' WHERE id = ?", (both,))).result()
+    df = db.fetch_campaign_breakdown(db.get_data_version(), (), (("geo", "US"),), "sqlite")
+    assert int(df["ads"].sum()) == 1
+    conn = db.get_conn()
+    assert conn.execute("SELECT geo FROM ad_geos WHERE ad_id = ?", (us,)).fetchall()[0][0] == "US"
+    conn.close()
+
+
+def test_rule_geo_clause_matches_multi_geo_ads(db, make_ad):
+    both = make_ad(notes="US, CA desktop")
+    other = make_ad(notes="DE desktop")
+    for ad in (both, other):
+        db.update_performance(ad, 1000, 0, 0, 0, 0.0)
+    db.add_rule("geo pause", "pause if geo = US and clicks < 1", 10)
+    assert [c["ad_id"] for c in db.apply_rules()] == [both]
+
+
+def test_rank_rule_geo_clause_matches_multi_geo_ads(db, make_ad):
+    both = make_ad(notes="US, CA desktop")
+    other = make_ad(notes="DE desktop")
+    for ad in (both, other):
+        db.update_performance(ad, 1000, 0, 0, 0, 0.0)
+    db.add_rule("", "pause bottom 1 by clicks per program where geo = US", 10)
+    assert [c["ad_id"] for c in db.apply_rules()] == [both]
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+
+def _rollups(app):
+    conn = app.get_conn()
+    signups = {tuple(r[:2]): r[2] for r in conn.execute("SELECT traffic_source, cohort_month, signups FROM cohort_source_signups")}
+    revenue = {
+        tuple(r[:3]): r[3]
+        for r in conn.execute("SELECT traffic_source, cohort_month, age_days, revenue FROM cohort_source_revenue")
+    }
+    conn.close()
+    return signups, revenue
+
+
+def _revenue_total(app, ad_id):
+    conn = app.get_conn()
+    row = conn.execute("SELECT revenue FROM ad_performance WHERE ad_id = ?", (ad_id,)).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def test_payout_creates_revenue_total_without_performance_row(db, make_ad):
+    ad = make_ad(source="TrafficJunky")
+    done = db.record_cohort_events([(ad, "2026-01-05", 10)], [(ad, "2026-01-05", "2026-01-20", 12.5)])
+    assert done["payouts"] == 1 and done["skipped"] == 0
+    assert _revenue_total(db, ad) == 12.5
+    db.record_cohort_events([], [(ad, "2026-01-05", "2026-01-21", 2.5)])
+    assert _revenue_total(db, ad) == 15.0
+
+
+def test_archived_ad_keeps_cohorts_and_accepts_late_payouts(db, make_ad):
+    ad = make_ad(source="ExoClick")
+    db.record_cohort_events([(ad, "2026-01-05", 10)], [(ad, "2026-01-05", "2026-01-06", 5.0)])
+    db.update_ad_status(ad, "Paused")
+    assert db.archive_ads([ad]) == 1
+
+    done = db.record_cohort_events([], [(ad, "2026-01-05", "2026-02-04", 7.0)])
+    assert done["payouts"] == 1 and done["skipped"] == 0
+    signups, revenue = _rollups(db)
+    assert signups[("ExoClick", "2026-01")] == 10
+    assert revenue[("ExoClick", "2026-01", 30)] == 7.0
+    # The late payout lands in the archived ad's stored metrics, too.
+    assert db.load_archived_ads([ad])[0]["revenue"] == 12.0
+
+    db.submit_write(db.rebuild_cohort_rollups_op).result()
+    assert _rollups(db) == (signups, revenue)
+
+
+def test_rebuild_picks_up_source_change_for_live_ads(db, make_ad):
+    ad = make_ad(source="ExoClick")
+    db.record_cohort_events([(ad, "2026-03-01", 4)], [])
+    db.submit_write(
+        lambda conn: conn.execute("UPDATE ad_creatives SET traffic_source = 'PropellerAds' WHERE id = ?", (ad,))
+    ).result()
+    db.submit_write(db.rebuild_cohort_rollups_op).result()
+    signups, _ = _rollups(db)
+    assert signups == {("PropellerAds", "2026-03"): 4}
+
+
+def _geometric_cohort(daily: float, q: float, days: int):
+    signups = pd.DataFrame({"cohort_month": ["2025-01"], "signups": [100]})
+    ages = np.arange(days)
+    revenue = pd.DataFrame({"cohort_month": "2025-01", "age_days": ages, "revenue": 100 * daily * q**ages})
+    return signups, revenue
+
+
+def test_ltv_curve_matches_cumulative_revenue_per_signup(db):
+    signups, revenue = _geometric_cohort(0.5, 0.98, 120)
+    curve = db.ltv_curve(signups, revenue, today=pd.Timestamp("2026-01-01"))
+    truth = np.cumsum(0.5 * 0.98 ** np.arange(120))
+    assert np.allclose(curve.loc[:119].to_numpy(), truth)
+
+
+def test_ltv_curve_ignores_cohorts_too_young_for_an_age(db):
+    signups = pd.DataFrame({"cohort_month": ["2025-01", "2025-12"], "signups": [10, 10]})
+    revenue = pd.DataFrame({"cohort_month": ["2025-01", "2025-01"], "age_days": [0, 60], "revenue": [10.0, 10.0]})
+    curve = db.ltv_curve(signups, revenue, today=pd.Timestamp("2026-01-31"))
+    # Day 0: both cohorts observed; day 60: only January (December is 31 days old).
+    assert curve.loc[0] == 0.5
+    assert curve.loc[60] == 2.0
+
+
+def test_project_ltv_continues_geometric_decay(db):
+    q = 0.99
+    signups, revenue = _geometric_cohort(0.5, q, 91)
+    curve = db.ltv_curve(signups, revenue, today=pd.Timestamp("2025-05-01"))
+    assert int(curve.index.max()) == 90
+    out = db.project_ltv(curve, [30, 180])
+    assert out[30] == (curve.loc[30], False)
+    value, projected = out[180]
+    truth = 0.5 * (1 - q**181) / (1 - q)
+    assert projected and abs(value - truth) / truth < 0.01
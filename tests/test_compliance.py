@@ -0,0 +1,47 @@
+import pytest
+
+TERMS = [("*", "teen", "block"), ("*", "escort", "warn"), ("*", "ass", "block"), ("ExoClick", "click here", "block")]
+PATTERNS = [("*", r"\bguaranteed?\b", "Unsubstantiated guarantee", "warn")]
+
+
+@pytest.fixture
+def linter(db):
+    return db.ComplianceLinter(TERMS, PATTERNS)
+
+
+def _terms(linter, headline, source="TrafficJunky"):
+    return [i["match"] for i in linter.check({"headline": headline, "traffic_source": source}) if i["kind"] == "term"]
+
+
+@pytest.mark.parametrize(
+    "headline, matches",
+    [
+        ("Hot teen chat", ["teen"]),
+        ("Teens online now", ["Teens"]),
+        ("Escorts near you", ["Escorts"]),
+        ("Escorted tours", ["Escorted"]),
+        ("Escorting service", ["Escorting"]),
+        ("T33N$ online", ["T33N$"]),
+        ("First class service", []),
+        ("Teenage years", []),
+        ("Canteen menu", []),
+        ("Assorted offers", []),
+    ],
+)
+def test_terms_match_words_and_inflections(linter, headline, matches):
+    assert _terms(linter, headline) == matches
+
+
+def test_network_specific_terms(linter):
+    assert _terms(linter, "Click here now", "ExoClick") == ["Click here"]
+    assert _terms(linter, "Click here now", "TrafficJunky") == []
+
+
+def test_claims_and_length_limits(db, linter):
+    issues = linter.check(
+        {"headline": "Guaranteed dates " + "x" * 40, "placement_type": "Banner (300x250 / 300x100 / 728x90)"}
+    )
+    assert {i["kind"] for i in issues} == {"claim", "length"}
+    assert db.compliance_status(issues) == "warn"
+    assert db.compliance_status(linter.check({"headline": "teen"})) == "fail"
+    assert db.compliance_status(linter.check({"headline": "Fresh offers"})) == "pass"
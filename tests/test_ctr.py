@@ -0,0 +1,56 @@
+import threading
+
+import numpy as np
+
+
+def _seed(db, make_ad, n=60):
+    """Half the ads say 'free' and get 3x the CTR of the rest."""
+    for i in range(n):
+        free = i % 2 == 0
+        ad = make_ad(headline=f"{'Free' if free else 'Paid'} chat tonight {i}", cta="Join")
+        db.update_performance(ad, 2_000, 120 if free else 40, 0, 0, 0.0)
+
+
+def test_fit_learns_the_lifting_token(db, make_ad):
+    _seed(db, make_ad)
+    scorer = db.CTRScorer()
+    stats = scorer.fit(full=True)
+    assert "error" not in stats and stats["train_ads"] > 0
+    assert scorer.trained
+    assert scorer.score("Free chat tonight", "Join") > scorer.score("Paid chat tonight", "Join")
+
+
+def test_scoring_during_a_fit_only_sees_published_models(db, make_ad):
+    _seed(db, make_ad)
+    scorer = db.CTRScorer()
+    scorer.fit(full=True)
+    old = scorer.theta
+    published, before = {id(old)}, old.copy()
+    seen, stop = [], threading.Event()
+
+    def read():
+        while not stop.is_set():
+            theta, _ = scorer.model()
+            seen.append(id(theta))
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    scorer.fit(full=True)
+    stop.set()
+    reader.join()
+    published.add(id(scorer.theta))
+    assert set(seen) <= published
+    assert np.array_equal(old, before)  # the previous model was never touched in place
+
+
+def test_refresh_queues_a_training_job_instead_of_fitting(db, make_ad, monkeypatch):
+    _seed(db, make_ad, n=4)
+    queued = []
+    monkeypatch.setattr(db, "submit_job", lambda kind, params: queued.append((kind, params)) or "job")
+    scorer = db.CTRScorer()
+    monkeypatch.setattr(scorer, "fit", lambda full=False: (_ for _ in ()).throw(AssertionError("fit on caller")))
+
+    assert scorer.refresh() is False
+    assert scorer.refresh() is False  # throttled: one job per window
+    assert queued == [("train_ctr_model", {"full": True})]
+    assert not np.any(scorer.theta)
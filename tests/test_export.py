@@ -0,0 +1,20 @@
+import csv
+import io
+import zipfile
+
+
+def test_network_csv_follows_the_layout_and_filters(db, make_ad):
+    exo = make_ad(headline="Exo headline", source="ExoClick")
+    make_ad(headline="Juicy headline", source="JuicyAds")
+    data = db.bulk_export_bytes("JuicyAds CSV", {"traffic_source": ["ExoClick"]})
+    rows = list(csv.reader(io.StringIO(data.decode("utf-8"))))
+    assert rows[0] == [header for header, _ in db.NETWORK_EXPORT_LAYOUTS["JuicyAds"]]
+    assert len(rows) == 2
+    assert rows[1][1] == "Exo headline" and rows[1][-1] == f"ad{exo}"
+
+
+def test_text_block_zip_has_one_file_per_ad(db, make_ad):
+    ids = [make_ad(headline=f"h{i}") for i in range(3)]
+    with zipfile.ZipFile(io.BytesIO(db.bulk_export_bytes("Text blocks (ZIP)"))) as zf:
+        assert sorted(zf.namelist()) == sorted(f"ad{i}.txt" for i in ids)
+        assert "HEADLINE:\nh0" in zf.read(f"ad{ids[0]}.txt").decode("utf-8")
@@ -0,0 +1,42 @@
+import time
+
+
+def _status(app, job_id):
+    conn = app.get_conn()
+    row = conn.execute("SELECT status, worker_id FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    conn.close()
+    return tuple(row)
+
+
+def test_only_jobs_with_a_stale_heartbeat_are_requeued(db):
+    db.submit_write(lambda conn: conn.execute("DELETE FROM jobs")).result()
+    for job_id in ("live", "dead"):
+        db.submit_write(db.submit_job_op, job_id, "noop", {}, "s").result()
+        assert db.submit_write(db.claim_job_op, f"w-{job_id}").result()["id"] == job_id
+    db.submit_write(
+        lambda conn: conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = 'dead'", (time.time() - 600,))
+    ).result()
+    db.submit_write(db.heartbeat_jobs_op, ["live"]).result()
+
+    assert db.submit_write(db.requeue_orphaned_jobs_op, time.time() - db.JOB_STALE_SECONDS).result() == 1
+    assert _status(db, "live") == ("running", "w-live")
+    assert _status(db, "dead") == ("queued", None)
+
+
+def test_job_threads_use_the_submitting_session(db, monkeypatch):
+    def handler(ctx, params):
+        db.ui_warning("provider down")
+        return {"text": db.current_session_id()}
+
+    monkeypatch.setitem(db.JOB_HANDLERS, "session_probe", handler)
+    db.submit_write(lambda conn: conn.execute("DELETE FROM jobs")).result()
+    db.submit_write(db.submit_job_op, "probe", "session_probe", {}, "browser-session").result()
+    db.get_job_runner().notify()
+    deadline = time.time() + 10
+    while _status(db, "probe")[0] != "done" and time.time() < deadline:
+        time.sleep(0.05)
+    text, _, _ = db.fetch_job_result("probe")
+    assert text == "browser-session"
+    conn = db.get_conn()
+    assert "provider down" in conn.execute("SELECT message FROM jobs WHERE id = 'probe'").fetchone()[0]
+    conn.close()
@@ -0,0 +1,38 @@
+import sqlite3
+
+
+def _fragmented(path, auto_vacuum):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute(f"PRAGMA auto_vacuum={auto_vacuum}")
+    conn.execute("CREATE TABLE t (x BLOB)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(b"x" * 4000,) for _ in range(500)])
+    conn.execute("DELETE FROM t")
+    return conn
+
+
+def test_incremental_vacuum_frees_up_to_the_page_budget_in_one_statement(db, tmp_path):
+    conn = _fragmented(str(tmp_path / "inc.db"), "INCREMENTAL")
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    assert free > 300
+
+    assert db.incremental_vacuum_op(conn, 300) == 300
+    assert db.incremental_vacuum_op(conn, 10_000) == free - 300
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+
+
+def test_full_vacuum_switches_the_file_to_incremental(db, tmp_path):
+    conn = _fragmented(str(tmp_path / "none.db"), "NONE")
+    db.full_vacuum_op(conn)
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+
+
+def test_maintenance_runs_vacuum_and_checkpoint_on_the_writer(db, monkeypatch):
+    ops = []
+    real = db.submit_exclusive_write
+    monkeypatch.setattr(db, "submit_exclusive_write", lambda op, *a: ops.append(op) or real(op, *a))
+    stats = db.db_file_stats
+    monkeypatch.setattr(db, "db_file_stats", lambda: {**stats(), "auto_vacuum": "none"})
+    entry = db.run_maintenance(["vacuum", "checkpoint"], reason="test")
+    assert "vacuum (enabled incremental)" in entry["actions"]
+    assert ops == [db.full_vacuum_op, db.wal_checkpoint_op]
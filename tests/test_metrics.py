@@ -0,0 +1,15 @@
+def test_registry_renders_prometheus_text(db):
+    reg = db.MetricsRegistry()
+    reg.inc("xxx_ai_errors_total", provider='Open"AI')
+    reg.inc("xxx_ai_errors_total", 2, provider='Open"AI')
+    reg.observe("xxx_db_commit_seconds", 0.02)
+    reg.gauge("xxx_queue_depth", "Queued writes.", lambda: {(("queue", "db"),): 3})
+    text = reg.render()
+    assert '# TYPE xxx_ai_errors_total counter' in text
+    assert 'xxx_ai_errors_total{provider="Open\\"AI"} 3' in text
+    assert 'xxx_db_commit_seconds_bucket{le="0.01"} 0' in text
+    assert 'xxx_db_commit_seconds_bucket{le="0.025"} 1' in text
+    assert 'xxx_db_commit_seconds_bucket{le="+Inf"} 1' in text
+    assert "xxx_db_commit_seconds_count 1" in text
+    assert 'xxx_queue_depth{queue="db"} 3' in text
+    assert text.endswith("\n")
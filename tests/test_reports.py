@@ -0,0 +1,47 @@
+import pandas as pd
+
+
+def _seed(db, make_ad):
+    rows = [
+        ("ExoClick", "Curiosity", 1000, 10, 1, 0.5),
+        ("ExoClick", "Limited-Time", 2000, 30, 3, 1.5),
+        ("JuicyAds", "Curiosity", 500, 5, 0, 0.0),
+        ("", "Curiosity", 100, 1, 0, 0.0),
+    ]
+    for source, angle, imps, clicks, sales, revenue in rows:
+        ad = make_ad(source=source, angle=angle)
+        db.update_performance(ad, imps, clicks, 0, sales, revenue)
+
+
+def test_rollup_cube_matches_a_pandas_groupby(db, make_ad):
+    _seed(db, make_ad)
+    cube = db.run_analytics_query(db.build_rollup_sql(), engine_name="sqlite")
+    assert len(cube["grouping_id"].unique()) == 1 << len(db.CUBE_DIMENSIONS)
+
+    flat = db.fetch_ads_with_metrics_df(["traffic_source", "angle"] + db.METRIC_COLUMNS)
+    flat["traffic_source"] = flat["traffic_source"].replace("", "Unknown")
+    expected = flat.groupby("traffic_source")["clicks"].sum().sort_index()
+    by_source = db.slice_cube(cube, ["traffic_source"]).set_index("traffic_source")["clicks"].sort_index()
+    pd.testing.assert_series_equal(by_source.astype("int64"), expected.astype("int64"), check_names=False)
+    total = cube[cube["grouping_id"] == 0].iloc[0]
+    assert total["ads"] == 4 and total["impressions"] == 3600
+
+
+def test_compact_frame_uses_categories_and_small_ints(db, make_ad):
+    _seed(db, make_ad)
+    df = db.fetch_ads_with_metrics_df(["traffic_source", "angle"] + db.METRIC_COLUMNS, compact=True)
+    assert set(df.columns) == {"ad_id", "traffic_source", "angle", *db.METRIC_COLUMNS}
+    assert df["traffic_source"].dtype == "category"
+    assert "Unknown" in set(df["traffic_source"])
+    assert df["impressions"].dtype.itemsize <= 2 and not df[db.METRIC_COLUMNS].isna().any().any()
+
+
+def test_diff_metrics_returns_only_changed_rows(db):
+    cols = ["ad_id"] + db.METRIC_COLUMNS
+    loaded = pd.DataFrame([[1, 10, 1, 0, 0, 1.0], [2, 20, 2, 0, 0, 2.0]], columns=cols)
+    edited = loaded.copy()
+    edited.loc[1, "clicks"] = 5
+    edited.loc[0, "revenue"] = 1.001  # below the grid's 2-decimal precision
+    out = db.diff_metrics(loaded, edited)
+    assert out["ad_id"].tolist() == [2] and out["clicks"].tolist() == [5]
+    assert out["clicks"].dtype == "int64"
@@ -0,0 +1,105 @@
+import pytest
+
+
+@pytest.mark.parametrize(
+    "bad",
+    ["pause if", "explode if clicks > 1", "pause if foo > 1", "promote top 2 by title", "pause if clicks > abc"],
+)
+def test_parse_rule_rejects_bad_definitions(db, bad):
+    with pytest.raises(ValueError):
+        db.parse_rule(bad)
+
+
+def test_parse_rule_threshold_and_rank(db):
+    rule = db.Rule(1, "r", "Pause IF clicks > 500 and CR < 0.2%", 10)
+    assert rule.kind == "threshold" and rule.status == "Paused"
+    rank = db.Rule(2, "r", "promote top 2 by EPC per network where clicks >= 100", 10)
+    assert rank.kind == "rank" and rank.top and rank.n == 2 and rank.group_by == "traffic_source"
+
+
+def test_threshold_rule_pauses_matching_ad(db, make_ad):
+    ad = make_ad()
+    db.add_rule("kill", "pause if clicks > 500 and cr < 0.2%", 10)
+    changes = db.update_performance(ad, 10_000, 600, 0, 0, 0.0)
+    assert [(c["ad_id"], c["status"]) for c in changes] == [(ad, "Paused")]
+
+
+def _statuses(db, ids):
+    conn = db.get_conn()
+    rows = dict(conn.execute("SELECT id, status FROM ad_creatives").fetchall())
+    conn.close()
+    return [rows.get(i) for i in ids]
+
+
+def test_bottom_n_pause_is_idempotent_on_repeated_evaluation(db, make_ad):
+    ids = [make_ad(headline=f"h{i}") for i in range(5)]
+    db.add_rule("", "pause bottom 1 by epc per program where clicks >= 10", 10)
+    # epc = revenue / clicks: ids[0] worst ... ids[4] best
+    for i, ad in enumerate(ids):
+        db.update_performance(ad, 1_000, 100, 0, 1, float(i + 1))
+    for _ in range(5):
+        for ad in ids:
+            db.update_performance(ad, 1_000, 100, 0, 1, float(ids.index(ad) + 1))
+        db.apply_rules()
+    assert _statuses(db, ids) == ["Paused", "Active", "Active", "Active", "Active"]
+
+
+def test_bottom_n_pause_moves_on_when_a_worse_ad_arrives(db, make_ad):
+    ids = [make_ad(headline=f"h{i}") for i in range(3)]
+    db.add_rule("", "pause bottom 1 by epc per program where clicks >= 10", 10)
+    for i, ad in enumerate(ids):
+        db.update_performance(ad, 1_000, 100, 0, 1, float(i + 2))
+    assert _statuses(db, ids) == ["Paused", "Active", "Active"]
+    worse = make_ad(headline="worse")
+    db.update_performance(worse, 1_000, 100, 0, 1, 1.0)
+    db.apply_rules()
+    # The new worst is paused; the already paused one stays paused, nobody else is touched.
+    assert _statuses(db, ids + [worse]) == ["Paused", "Active", "Active", "Paused"]
+
+
+def test_archived_pauses_still_fill_the_bottom_n(db, make_ad):
+    ids = [make_ad(headline=f"h{i}") for i in range(4)]
+    db.add_rule("", "pause bottom 1 by epc per program where clicks >= 10", 10)
+    for i, ad in enumerate(ids):
+        db.update_performance(ad, 1_000, 100, 0, 1, float(i + 1))
+    assert db.archive_ads([ids[0]]) == 1
+    for _ in range(3):
+        db.apply_rules()
+    assert _statuses(db, ids) == [None, "Active", "Active", "Active"]
+
+
+def test_top_n_promotion_demotes_dropouts(db, make_ad):
+    ids = [make_ad(headline=f"h{i}") for i in range(3)]
+    db.add_rule("", "promote top 1 by epc per program where clicks >= 10", 10)
+    db.update_performance(ids[0], 1_000, 100, 0, 1, 50.0)
+    db.update_performance(ids[1], 1_000, 100, 0, 1, 10.0)
+    assert _statuses(db, ids[:2]) == ["Winner", "Active"]
+    db.update_performance(ids[1], 1_000, 100, 0, 1, 90.0)
+    db.apply_rules()
+    assert _statuses(db, ids[:2]) == ["Active", "Winner"]
+
+
+def test_bulk_metric_saves_queue_rule_evaluation(db, make_ad, monkeypatch):
+    ads = [make_ad(headline=f"b{i}") for i in range(3)]
+    db.add_rule("kill", "pause if clicks > 500 and cr < 0.2%", 10)
+    queued = []
+    monkeypatch.setattr(db, "submit_job", lambda kind, params: queued.append((kind, params)) or "job")
+
+    db.bulk_update_performance([(ad, 10_000, 600, 0, 0, 0.0) for ad in ads])
+    assert queued == [("evaluate_rules", {"ad_ids": sorted(ads)})]
+    assert _statuses(db, ads) == ["Active"] * 3  # nothing ran on the caller's thread
+
+    db.job_evaluate_rules(db.JobContext("j"), queued[0][1])
+    assert _statuses(db, ads) == ["Paused"] * 3
+
+
+def test_higher_priority_threshold_rule_keeps_deciding_on_reevaluation(db, make_ad):
+    ad = make_ad()
+    db.add_rule("promote", "promote if ctr > 2%", 10)
+    db.add_rule("kill", "pause if clicks > 500 and cr < 0.2%", 100)
+    # ctr 3%, cr 0%: both rules match; the promote rule outranks the pause rule.
+    db.update_performance(ad, 20_000, 600, 0, 0, 0.0)
+    assert _statuses(db, [ad]) == ["Winner"]
+    assert db.update_performance(ad, 20_001, 600, 0, 0, 0.0) == []
+    db.apply_rules()
+    assert _statuses(db, [ad]) == ["Winner"]
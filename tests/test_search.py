@@ -0,0 +1,24 @@
+import pytest
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("", ""),
+        ("hot", '"hot"*'),
+        ('hot "single" moms', '"hot" """single""" "moms"*'),
+        ("AND OR NOT", '"AND" "OR" "NOT"*'),
+    ],
+)
+def test_fts_query_quotes_every_term_and_prefixes_the_last(db, text, expected):
+    assert db.build_fts_query(text) == expected
+
+
+def test_search_ranks_headline_hits_first_and_follows_edits(db, make_ad):
+    in_body = make_ad(headline="Late night chat", body="Discreet dating for busy people")
+    in_headline = make_ad(headline="Discreet dating tonight", body="Meet people near you")
+    ids = [r["id"] for r in db.search_creatives("discreet dat")]
+    assert ids == [in_headline, in_body]
+
+    db.submit_write(lambda conn: conn.execute("UPDATE ad_creatives SET headline = 'Webcam offer' WHERE id = ?", (in_headline,))).result()
+    assert [r["id"] for r in db.search_creatives("webcam")] == [in_headline]
@@ -0,0 +1,23 @@
+import pytest
+
+
+def test_a_failing_op_only_fails_its_own_future(db, program):
+    writer = db.DBWriter(db.DB_PATH)
+    try:
+        ok = writer.submit(db.insert_ad_op, program, "ok", "", "", "", "", "", "", "")
+        bad = writer.submit(lambda conn: conn.execute("INSERT INTO no_such_table VALUES (1)"))
+        also_ok = writer.submit(db.insert_ad_op, program, "also ok", "", "", "", "", "", "", "")
+        assert ok.result() and also_ok.result()
+        with pytest.raises(Exception, match="no_such_table"):
+            bad.result()
+    finally:
+        writer.close()
+    titles = {a["title"] for a in db.fetch_ads()}
+    assert {"ok", "also ok"} <= titles
+    stats = writer.stats()
+    assert stats["failed_ops"] == 1 and stats["ops"] == 3
+
+
+def test_exclusive_ops_run_outside_a_transaction(db):
+    assert db.submit_exclusive_write(lambda conn: conn.in_transaction).result() is False
+    assert db.submit_write(lambda conn: conn.in_transaction).result() is True